@@ -12,7 +12,7 @@ from pycatan import Resource
 from pycatan.board import BuildingType
 
 # Import some utilities
-from util import tuple_to_path_coordinate, tuple_to_coordinate
+from util import tuple_to_path_coordinate, tuple_to_coordinate, coordinate_to_tuple
 
 
 #: True if the program run with 'DEBUG' environment variable.
@@ -103,10 +103,16 @@ class ROAD(Action):
                 return
 
         # Build a road on the specified place
-        board._game.build_road(player=player,
-                               path_coords=self.edge,
-                               ensure_connected=not board._initial_phase,
-                               cost_resources=not board._initial_phase)
+        if board._engine is not None:  # The setup engine runs the initial phase.
+            board._engine.build_road(self.player_id, tuple(sorted(coordinate_to_tuple(c) for c in self.edge)))
+        else:
+            board._game.build_road(player=player,
+                                   path_coords=self.edge,
+                                   ensure_connected=not board._initial_phase,
+                                   cost_resources=not board._initial_phase)
+        board._path_changed(self.edge)
+        if not board._initial_phase:
+            board._resources_changed()
         if IS_DEBUG:  # Logging for debugging
             self._logger.debug('ROAD construction is successful.')
 
@@ -144,10 +150,16 @@ class VILLAGE(Action):
                 return
 
         # Build a settlement on the specified place
-        board._game.build_settlement(player=player,
-                                     coords=self.node,
-                                     ensure_connected=not board._initial_phase,
-                                     cost_resources=not board._initial_phase)
+        if board._engine is not None:  # The setup engine runs the initial phase.
+            board._engine.build_village(self.player_id, coordinate_to_tuple(self.node))
+        else:
+            board._game.build_settlement(player=player,
+                                         coords=self.node,
+                                         ensure_connected=not board._initial_phase,
+                                         cost_resources=not board._initial_phase)
+        board._node_changed(self.node)
+        if not board._initial_phase:
+            board._resources_changed()
         if IS_DEBUG:  # Logging for debugging
             self._logger.debug('VILLAGE construction is successful.')
 
@@ -187,6 +199,8 @@ class UPGRADE(Action):
         board._game.upgrade_settlement_to_city(player=player,
                                                coords=self.node,
                                                cost_resources=True)
+        board._node_changed(self.node)
+        board._resources_changed()
         if IS_DEBUG:  # Logging for debugging
             self._logger.debug('City UPGRADE is successful.')
 
@@ -230,6 +244,7 @@ class TRADE(Action):
             self.given: -rate,
             self.request: 1
         })
+        board._resources_changed()
         if IS_DEBUG:  # Logging for debugging
             self._logger.debug('TRADE action is successfully executed.')
 
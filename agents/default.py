@@ -1,19 +1,116 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import chain
+from math import exp
+from multiprocessing import get_context, get_all_start_methods
 from random import choice
 from time import time
 from traceback import print_exc, format_exc
-from typing import Tuple, List, Callable, Dict, Generator
+from typing import Tuple, List, Callable, Dict, Generator, Hashable
 
 from action import *
 from board import GameBoard
+from pycatan import Resource
 
 
-def expand_board_state(board: GameBoard, state: dict, player: int):
+#: Type of an opponent model.
+#: An opponent model receives the board (set to the state before the move), the player ID and the list of candidate
+#: coordinates (nodes for villages, or pairs of nodes for roads). It returns the candidates to expand, ordered by
+#: their priority. The returned list may be a subset of the candidates, which prunes the search tree.
+OpponentModel = Callable[[GameBoard, int, list], list]
+
+
+def _resource_count(board: GameBoard, coord, resource: str = None) -> int:
+    """
+    Count the neighboring resource tiles of a node or a road.
+
+    :param board: Game board to query
+    :param coord: Coordinate of a node, or a pair of node coordinates (road)
+    :param resource: Resource name to count. If None, count all resources.
+    :return: The number of resource tiles. For roads, the larger count of two end nodes.
+    """
+    if isinstance(coord[0], tuple):  # Road: use the better end node (as the greedy initial policy does)
+        return max(_resource_count(board, c, resource) for c in coord)
+
+    counts = board.resources_of_place(coord)
+    return sum(counts.values()) if resource is None else counts[resource]
+
+
+def top_k_by_resources(k: int) -> OpponentModel:
+    """
+    Opponent model which expands only k candidates that neighbor the most resource tiles.
+
+    :param k: The number of candidates to expand
+    :return: An opponent model
+    """
+    assert k > 0, 'At least one candidate should be expanded.'
+
+    def model(board: GameBoard, player: int, candidates: list) -> list:
+        # sorted() is stable, so ties are broken by the order of the board.
+        return sorted(candidates, key=lambda c: -_resource_count(board, c))[:k]
+
+    return model
+
+
+def greedy_resource_policy(resources: List[Resource] = (Resource.BRICK, Resource.LUMBER)) -> OpponentModel:
+    """
+    Opponent model which assumes that the opponent follows a greedy policy maximizing one of the given resources.
+    With the default arguments, this gives the same choices as the default opponents of the evaluation,
+    i.e., GameBoard._one_resource_init_policy with BRICK or LUMBER.
+
+    :param resources: Resources which the opponent may maximize
+    :return: An opponent model
+    """
+    names = [res.name for res in resources]
+
+    def model(board: GameBoard, player: int, candidates: list) -> list:
+        chosen = []
+        for name in names:
+            # max() returns the first maximal candidate, as the greedy policy does.
+            best = max(candidates, key=lambda c: _resource_count(board, c, name), default=None)
+            if best is not None and best not in chosen:
+                chosen.append(best)
+        return chosen
+
+    return model
+
+
+def probability_threshold(threshold: float, temperature: float = 1.0) -> OpponentModel:
+    """
+    Opponent model which assumes a softmax (Boltzmann) distribution over the resource counts of the candidates,
+    and expands only the candidates whose probability is at least the given threshold.
+    The most probable candidate is always expanded.
+
+    :param threshold: Minimum probability of a candidate to be expanded
+    :param temperature: Temperature of the softmax distribution. Lower temperature prunes more candidates.
+    :return: An opponent model
+    """
+    assert 0 <= threshold <= 1, 'The threshold should be a probability.'
+    assert temperature > 0, 'The temperature should be positive.'
+
+    def model(board: GameBoard, player: int, candidates: list) -> list:
+        if not candidates:
+            return []
+
+        scores = [_resource_count(board, c) for c in candidates]
+        best = max(scores)
+        weights = [exp((s - best) / temperature) for s in scores]
+        total = sum(weights)
+
+        ranked = sorted(zip(weights, range(len(candidates))), key=lambda x: -x[0])
+        return [candidates[i] for rank, (w, i) in enumerate(ranked) if rank == 0 or w / total >= threshold]
+
+    return model
+
+
+def expand_board_state(board: GameBoard, state: dict, player: int, model: OpponentModel = None):
     """
     Expand all possible children of given state, when a player placing his/her village and road, using the board.
 
     :param board: Game board to manipulate
     :param state: State to expand it children
     :param player: Player ID who is currently doing his/her initial setup procedure.
+    :param model: Opponent model which selects the villages and roads to expand. If None, expand all villages.
 
     :returns: A generator
         Each item is a tuple of VILLAGE action, ROAD action and the resulting state dictionary.
@@ -22,26 +119,68 @@ def expand_board_state(board: GameBoard, state: dict, player: int):
     state = board.simulate_action(state, PASS())
 
     # The player will put a village and a road block on his/her turn.
-    for coord in board.get_applicable_villages(player=player):
-        board.set_to_state(state)
+    villages = board.get_applicable_villages(player=player)
+    if model is not None:
+        villages = model(board, player, villages)
+
+    action_tuples = []
+    for coord in villages:
         # Test all possible villages
         village = VILLAGE(player, coord)
-        # Apply village construction for further construction
-        board.simulate_action(state, village)
+        # Apply village construction temporarily, for querying the roads (without re-reading the whole board)
+        board.apply(village)
 
-        for path_coord in board.get_applicable_roads_from(coord, player=player)[:1]:
-            # Test all possible roads nearby that village
-            road = ROAD(player, path_coord)
-            yield village, road, board.simulate_action(state, village, road)  # Yield this simulation result
+        # Without a model, only the first road is tested. A model decides which roads should be tested.
+        roads = board.get_applicable_roads_from(coord, player=player)
+        roads = roads[:1] if model is None else model(board, player, roads)
+        board.undo()
 
+        # Test all possible roads nearby that village
+        action_tuples += [(village, ROAD(player, path_coord)) for path_coord in roads]
 
-def cascade_expansion(board: GameBoard, state: dict, players: List[int]):
+    # Simulate all children from the same parent state.
+    for (village, road), next_state in zip(action_tuples, board.simulate_many(state, action_tuples, lazy=True)):
+        yield village, road, next_state  # Yield this simulation result
+
+
+def occupancy(state: dict, player: int) -> int:
+    """
+    Read the buildings of the other players on the board.
+    (The state dictionaries of a board always list the places in the same order.)
+
+    :param state: A state dictionary
+    :param player: Player ID of ours
+    :return: Bitmask of the buildings. Bit 4k+p is set if player p has a building at the k-th place
+        (intersections first, then paths, in the order of the state dictionary).
+    """
+    board = state['board']
+    mask = 0
+    for k, i in enumerate(chain(board['intersections'].values(), board['paths'].values())):
+        if i['owner'] is not None and i['owner'] != player:
+            mask |= 1 << (4 * k + i['owner'])
+    return mask
+
+
+def opponent_moves(before: int, after: int) -> int:
+    """
+    Find the buildings of the other players, which are built between two states.
+    This is the only thing which changes between two decisions of a player, so plans use it as the key of branches.
+
+    :param before: Occupancy of the earlier state (see occupancy())
+    :param after: Occupancy of the later state
+    :return: Bitmask of the new buildings of the other players
+    """
+    return after & ~before
+
+
+def cascade_expansion(board: GameBoard, state: dict, players: List[int], model: OpponentModel = None):
     """
     Expand all possible children of given state, when several players placing his/her village and road, using the board.
 
     :param board: Game board to manipulate
     :param state: State to expand it children
     :param players: A list of Player IDs who are currently doing their initial setup procedure.
+    :param model: Opponent model which selects the moves of the players to expand. If None, expand all moves.
 
     :returns: A generator
         Each item is a resulting state dictionary, after all construction of given players
@@ -54,17 +193,226 @@ def cascade_expansion(board: GameBoard, state: dict, players: List[int]):
     next_players = players[1:]
     current_order = board.get_remaining_setup_order()
 
-    for _, _, next_state in expand_board_state(board, state, current_player):
+    for _, _, next_state in expand_board_state(board, state, current_player, model):
         board.reset_setup_order(current_order[1:])
-        for next_next_state in cascade_expansion(board, next_state, next_players):
+        for next_next_state in cascade_expansion(board, next_state, next_players, model):
             yield next_next_state
 
 
+#: Size of MB in bytes
+MEGABYTES = 1024 ** 2
+#: Memory budget for the transposition table. (The first memory tier of the README is 10MB)
+TRANSPOSITION_BUDGET = 10 * MEGABYTES
+#: Estimated size of a transposition table entry in bytes (LRU link, key tuple and a reference to the plan)
+TRANSPOSITION_ENTRY_SIZE = 256
+
+#: Opponent models of the anytime search, from the narrowest (fastest) to the widest (exhaustive).
+ANYTIME_MODELS = (greedy_resource_policy(), top_k_by_resources(2), top_k_by_resources(4), None)
+#: Safety margin (in seconds) before the time limit, for returning the plan to the evaluation process.
+TIME_MARGIN = 5
+#: Default search time in seconds. (The first time tier of the README is 1 minute, including the evaluation)
+TIME_BUDGET = 50
+
+
+class TranspositionTable:
+    """
+    Size-bounded transposition table, which stores solved sub-plans (or failures) of the AND-OR search.
+    When the table is full, the least recently used entry is evicted.
+    """
+
+    #: Marker for the positions that have no solution
+    FAILURE = object()
+
+    def __init__(self, budget: int = TRANSPOSITION_BUDGET):
+        """
+        :param budget: Memory budget in bytes. The number of entries is bounded by budget / TRANSPOSITION_ENTRY_SIZE.
+        """
+        self.budget = budget
+        self.max_entries = max(1, budget // TRANSPOSITION_ENTRY_SIZE)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._table = OrderedDict()
+
+    def get(self, key: Hashable, default=None):
+        """
+        Find a solved sub-plan.
+
+        :param key: Key of the position
+        :param default: Value to return when the position is not solved yet
+        :return: The stored sub-plan (or FAILURE), or default.
+        """
+        value = self._table.get(key, default)
+        if value is default:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._table.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value):
+        """
+        Store a solved sub-plan (or FAILURE).
+
+        :param key: Key of the position
+        :param value: Sub-plan to store
+        """
+        self._table[key] = value
+        self._table.move_to_end(key)
+        while len(self._table) > self.max_entries:
+            self._table.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._table)
+
+    def __repr__(self):  # String representation for this
+        return f'TranspositionTable({len(self)}/{self.max_entries} entries, ' \
+               f'hits={self.hits}, misses={self.misses}, evictions={self.evictions})'
+
+
+class CompiledPlan:
+    """
+    Compact decision structure of a contingent plan, compiled from the result of the AND-OR search.
+    Identical sub-plans are hash-consed into a DAG of decision nodes, and each branch of a node is keyed by the
+    buildings of the other players since our last decision (see opponent_moves()), instead of the whole board.
+    """
+
+    def __init__(self, plans: dict):
+        """
+        :param plans: Result of the AND search, i.e., a dictionary from the moves of the other players to an OR plan
+            ([(village, road), AND plan] or an empty list).
+        """
+        #: Decision nodes. Each node maps the moves of the other players into (index of actions, index of next node).
+        self.nodes: List[Dict[int, Tuple[int, int]]] = []
+        #: Distinct (village, road) pairs used in the plan
+        self.actions: List[Tuple[Action, Action]] = []
+        #: Index of the root node
+        self.root: int = self._compile(plans, {}, {}, {})
+
+    def _compile(self, plans: dict, by_id: dict, by_structure: dict, action_ids: dict) -> int:
+        """
+        [PRIVATE] Compile an AND plan into a decision node.
+
+        :param plans: AND plan to compile
+        :param by_id: Memo of the compiled AND plans by their object IDs (shared by the transposition table)
+        :param by_structure: Memo of the decision nodes by their structure (hash-consing)
+        :param action_ids: Memo of the action indices by their string representation
+        :return: Index of the decision node
+        """
+        if id(plans) in by_id:
+            return by_id[id(plans)]
+
+        node = {}
+        for key, or_plan in plans.items():
+            if not or_plan:  # Nothing to do in this branch.
+                continue
+            actions, and_plan = or_plan
+            action = action_ids.setdefault(str(actions), len(self.actions))
+            if action == len(self.actions):
+                self.actions.append(actions)
+            node[key] = (action, self._compile(and_plan, by_id, by_structure, action_ids))
+
+        structure = frozenset(node.items())
+        index = by_structure.get(structure)
+        if index is None:
+            index = by_structure[structure] = len(self.nodes)
+            self.nodes.append(node)
+
+        by_id[id(plans)] = index
+        return index
+
+    def get(self, node: int, moves: int):
+        """
+        Find the actions to do at a decision node.
+
+        :param node: Index of the current decision node
+        :param moves: The moves of the other players since our last decision
+        :return: Tuple of (village, road) actions and the index of the next decision node, or None if not covered.
+        """
+        branch = self.nodes[node].get(moves)
+        if branch is None:
+            return None
+        return self.actions[branch[0]], branch[1]
+
+    def __repr__(self):  # String representation for this
+        return f'CompiledPlan({len(self.nodes)} nodes, {len(self.actions)} actions)'
+
+
+class SearchCancelled(Exception):
+    """
+    Exception for the searches which are cancelled since other worker found a solution (or a failure) first,
+    or since the search reached its deadline.
+    """
+    pass
+
+
+#: [PRIVATE] Board and agent of a worker process in the parallel mode
+_worker = None
+
+
+def _initialize_worker(agent: 'Agent', initial_state: dict, cancel):
+    """
+    [PRIVATE] Initialize a worker process of the parallel mode, with its own board and transposition table.
+
+    :param agent: Agent to search with (copied into the worker)
+    :param initial_state: The initial state of the board
+    :param cancel: Event object, which is set when the remaining searches should be cancelled
+    """
+    global _worker
+    agent.workers = 0  # Workers search sequentially.
+    agent.transposition = TranspositionTable(agent.transposition.budget)
+    agent._cancel = cancel
+    _worker = (GameBoard.from_state(initial_state), agent)
+
+
+def _search_in_worker(kind: str, state: dict, remaining_order: list, path: list):
+    """
+    [PRIVATE] Run an OR search or an AND search in a worker process.
+
+    :param kind: 'OR' or 'AND'
+    :param state: State to search from
+    :param remaining_order: Remaining setup order at the state
+    :param path: Path of the state hashes from the root
+    :return: The plan found by the search
+    """
+    board, agent = _worker
+    board.set_to_state(state)
+    search = agent.or_search if kind == 'OR' else agent.and_search
+    return search(board, state, remaining_order, path)
+
+
 class Agent:  # Do not change the name of this class!
     """
     An agent class, with and-or search (DFS) method
     """
 
+    def __init__(self, transposition_budget: int = TRANSPOSITION_BUDGET, opponent_model: OpponentModel = None,
+                 workers: int = 0, anytime: bool = True, time_budget: float = TIME_BUDGET):
+        """
+        :param transposition_budget: Memory budget (in bytes) of the transposition table
+        :param opponent_model: Opponent model which prunes the moves of the other players (AND nodes).
+            If None, all moves of the other players are expanded.
+            E.g., top_k_by_resources(3), greedy_resource_policy() or probability_threshold(0.1).
+        :param workers: The number of worker processes for the parallel mode. If 0, search sequentially.
+            [WARN] Multiprocessing is not allowed for the submission (See README). Use this only for experiments.
+            Also, the memory used by the workers is not measured by the board.
+        :param anytime: If True and a time limit is given, search with the wider opponent models (ANYTIME_MODELS)
+            one by one, and keep the last complete plan when the time runs out. If an opponent model is given,
+            only that model is used, but the search still stops at the time limit.
+        :param time_budget: Maximum search time in seconds. (Default: within the first time tier of the README)
+            If None, the search can use the whole time limit.
+        """
+        self.transposition = TranspositionTable(transposition_budget)
+        self.opponent_model = opponent_model
+        self.workers = workers
+        self.anytime = anytime
+        self.time_budget = time_budget
+        #: [PRIVATE] Event object for cancelling the search (only in the worker processes of the parallel mode)
+        self._cancel = None
+        #: [PRIVATE] Timestamp where the current search should stop
+        self._deadline = None
+
     def or_search(self, board: GameBoard, state: dict, remaining_order: List[int], path: list) -> list:
         """
         An Or search function.
@@ -76,21 +424,39 @@ class Agent:  # Do not change the name of this class!
         if player_id not in remaining_order:  # After second setup turn. We reached the end point.
             return []  # Do nothing
 
-        if state['state_id'] in path:
-            raise Exception(f'We reached a cycle! {path} and {state["state_id"]}')
+        if self._cancel is not None and self._cancel.is_set():
+            raise SearchCancelled()
+        if self._deadline is not None and time() > self._deadline:
+            raise SearchCancelled('The search reached its deadline.')
+
+        if state['state_hash'] in path:
+            raise Exception(f'We reached a cycle! {path} and {state["state_hash"]}')
+
+        # Reuse the solution if the same position has been solved via another move order.
+        key = ('OR', state['state_hash'], tuple(remaining_order))
+        solved = self.transposition.get(key)
+        if solved is TranspositionTable.FAILURE:
+            raise Exception('No solution exists: (cached) Errors on all AND children.')
+        if solved is not None:
+            return solved
 
         # For each children state, call AND search.
         error_cause = []
         for village, road, next_state in expand_board_state(board, state, player=player_id):
             try:
                 board.set_to_state(next_state)
-                and_plan = self.and_search(board, next_state, remaining_order[1:], path + [state['state_id']])
-                return [(village, road), and_plan]
+                and_plan = self.and_search(board, next_state, remaining_order[1:], path + [state['state_hash']])
+                solved = [(village, road), and_plan]
+                self.transposition.put(key, solved)
+                return solved
                 # Call (village, road) at this state, and run other actions by following dictionary of and_plan
+            except SearchCancelled:
+                raise
             except:
                 error_cause.append(format_exc())
                 pass
 
+        self.transposition.put(key, TranspositionTable.FAILURE)
         raise Exception('No solution exists: Errors on all AND children.\n [Cause]\n' + '\n'.join(error_cause) + '-' * 80)
 
     def and_search(self, board: GameBoard, state: dict, remaining_order: list, path: list) -> dict:
@@ -108,21 +474,105 @@ class Agent:  # Do not change the name of this class!
         order_from_player = remaining_order[players_turn:]
 
         if before_player:
-            path = path + [state['state_id']]
+            path = path + [state['state_hash']]
+
+        # Reuse the solution if the same position has been solved via another move order.
+        key = ('AND', state['state_hash'], tuple(remaining_order))
+        solved = self.transposition.get(key)
+        if solved is TranspositionTable.FAILURE:
+            raise Exception('No solution exists: (cached) Errors on an OR child.')
+        if solved is not None:
+            return solved
 
         plans = {}
+        before = occupancy(state, player_id)
 
         # For each children state (after doing all other's actions), call OR search.
-        for next_state in cascade_expansion(board, state, before_player):
-            # We will call OR search here. We will throw the error as it is.
-            board.set_to_state(next_state)
-            or_plan = self.or_search(board, next_state, order_from_player, path)
-            # Call or_plan if we reach this state
-            plans[next_state['state_id']] = or_plan
-
+        try:
+            for next_state in cascade_expansion(board, state, before_player, self.opponent_model):
+                # We will call OR search here. We will throw the error as it is.
+                board.set_to_state(next_state)
+                or_plan = self.or_search(board, next_state, order_from_player, path)
+                # Call or_plan if the other players build these (new buildings are used as a key)
+                plans[opponent_moves(before, occupancy(next_state, player_id))] = or_plan
+        except SearchCancelled:
+            raise
+        except:
+            self.transposition.put(key, TranspositionTable.FAILURE)
+            raise
+
+        self.transposition.put(key, plans)
         return plans
 
-    def decide_new_village(self, board: GameBoard, time_limit: float = None) -> Callable[[str], Tuple[Action, Action]]:
+    def parallel_search(self, board: GameBoard, state: dict, remaining_order: list) -> dict:
+        """
+        An And search function, which distributes the children to worker processes.
+        If the root AND node has several children (i.e., the other players move before us), all children (OR nodes) are
+        solved in parallel. Otherwise, the alternatives of the only OR child are solved in parallel, and the remaining
+        alternatives are cancelled as soon as one of them succeeds.
+        Each worker rebuilds its own GameBoard from the initial state.
+        """
+        player_id = board.get_player_id()
+        board.reset_setup_order(remaining_order)
+        if player_id not in remaining_order:  # We don't have to search anymore
+            return {}  # Do nothing
+
+        players_turn = remaining_order.index(player_id)
+        before_player = remaining_order[:players_turn]
+        order_from_player = remaining_order[players_turn:]
+        path = [state['state_hash']] if before_player else []
+
+        children = list(cascade_expansion(board, state, before_player, self.opponent_model))
+        if not children:  # (e.g., the opponent model gives no moves)
+            raise Exception('No solution exists: No children of the AND node.')
+        before = occupancy(state, player_id)
+
+        # Fork the workers if possible, since the opponent models may not be picklable.
+        context = get_context('fork' if 'fork' in get_all_start_methods() else None)
+        cancel = context.Event()
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_initialize_worker,
+                                 initargs=(self, board.get_initial_state(), cancel)) as pool:
+            if len(children) > 1:
+                # AND node: all children should be solved. We will throw the error as it is.
+                futures = {pool.submit(_search_in_worker, 'OR', child, order_from_player, path):
+                           opponent_moves(before, occupancy(child, player_id))
+                           for child in children}
+                plans = {}
+                try:
+                    for future in as_completed(futures):
+                        plans[futures[future]] = future.result()
+                finally:
+                    # Cancel the remaining searches if an error occurred.
+                    cancel.set()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                return plans
+
+            # OR node: one of the alternatives should be solved.
+            child = children[0]
+            child_key = opponent_moves(before, occupancy(child, player_id))
+            board.set_to_state(child)
+            board.reset_setup_order(order_from_player)
+            futures = {pool.submit(_search_in_worker, 'AND', next_state, order_from_player[1:],
+                                   path + [child['state_hash']]): (village, road)
+                       for village, road, next_state in expand_board_state(board, child, player=player_id)}
+
+            error_cause = []
+            try:
+                for future in as_completed(futures):
+                    try:
+                        return {child_key: [futures[future], future.result()]}
+                    except SearchCancelled:
+                        raise  # Reached the deadline.
+                    except:
+                        error_cause.append(format_exc())
+            finally:
+                # Cancel the remaining searches.
+                cancel.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        raise Exception('No solution exists: Errors on all AND children.\n [Cause]\n' + '\n'.join(error_cause) + '-' * 80)
+
+    def decide_new_village(self, board: GameBoard, time_limit: float = None) -> Callable[[dict], Tuple[Action, Action]]:
         """
         This algorithm search for the best place of placing a new village.
 
@@ -132,17 +582,110 @@ class Agent:  # Do not change the name of this class!
         """
         initial = board.get_state()
         expansion_order = board.reset_setup_order()
-        plans = self.and_search(board, initial, expansion_order, [])
+        fallback = self.greedy_policy(board, initial)
+
+        if time_limit is None or not self.anytime:
+            # Search the whole tree once.
+            plan_list = [self._search(board, initial, expansion_order, self.opponent_model)]
+        else:
+            # Anytime search: widen the opponent model until the time runs out.
+            deadline = time_limit - TIME_MARGIN
+            if self.time_budget is not None:
+                deadline = min(deadline, time() + self.time_budget)
+
+            models = ANYTIME_MODELS if self.opponent_model is None else (self.opponent_model,)
+            plan_list = []
+            self._deadline = deadline
+            try:
+                for model in models:
+                    try:
+                        # The plan from the wider model comes first.
+                        plan_list.insert(0, self._search(board, initial, expansion_order, model))
+                    except SearchCancelled:
+                        break  # Time is over. Use the complete plans found so far.
+                    except:
+                        continue  # No solution with this model. Try the wider one.
+            finally:
+                self._deadline = None
+
+        # Compile the plans, and release the search results.
+        cursors = [(plan, plan.root) for plan in map(CompiledPlan, plan_list)]
+        self.transposition = TranspositionTable(self.transposition.budget)
+        player_id = board.get_player_id()
+        last_occupancy = [occupancy(initial, player_id)]
 
-        def _plan_execute(state_id):
-            plan = plans.get(state_id, None)
-            if plan is None:
-                return None, None
+        def _plan_execute(state):
+            current = occupancy(state, player_id)
+            moves = opponent_moves(last_occupancy[0], current)
+            last_occupancy[0] = current
 
-            actions, next_step_plan = plan
-            plans.clear()
-            plans.update(next_step_plan)
+            covered = [(plan, plan.get(node, moves)) for plan, node in cursors]
+            covered = [(plan, branch) for plan, branch in covered if branch is not None]
+            if not covered:
+                # No plan covers this state. Use the greedy policy.
+                return fallback(state)
 
-            return actions
+            # Follow the first plan that covers this state.
+            # The other plans are kept only if they agree with the chosen actions.
+            chosen = covered[0][1][0]
+            cursors[:] = [(plan, next_node) for plan, (actions, next_node) in covered if str(actions) == str(chosen)]
+            return chosen
 
         return _plan_execute
+
+    def _search(self, board: GameBoard, state: dict, remaining_order: list, model: OpponentModel) -> dict:
+        """
+        [PRIVATE] Run a whole AND-OR search from the root with given opponent model.
+
+        :return: The root plan (a copy, since the plan execution modifies it)
+        """
+        previous_model = self.opponent_model
+        self.opponent_model = model
+        # Start from an empty table. The solutions with other opponent models are not valid.
+        self.transposition = TranspositionTable(self.transposition.budget)
+        try:
+            if self.workers > 0:
+                return self.parallel_search(board, state, list(remaining_order))
+            return dict(self.and_search(board, state, remaining_order, []))
+        finally:
+            self.opponent_model = previous_model
+
+    def greedy_policy(self, board: GameBoard, state: dict) -> Callable[[dict], Tuple[Action, Action]]:
+        """
+        Build a greedy policy for the states that the plan does not cover.
+        The policy takes a free place which adds the most new resource types (ties are broken by the number of
+        neighboring resource tiles), and a road next to it. Since the board cannot be accessed when executing the
+        plan, the static information is captured here, and the policy reads the buildings from the state dictionary.
+
+        :param board: Game board to query the static information
+        :param state: A state of the board
+        :return: A Program (Function) to execute
+        """
+        intersections = list(state['board']['intersections'].keys())
+        diversity = {c: board.diversity_of_place(c) for c in intersections}
+        richness = {c: _resource_count(board, c) for c in intersections}
+        neighbors = {c: set() for c in intersections}
+        roads = {c: [] for c in intersections}
+        for path in state['board']['paths'].keys():
+            c1, c2 = path
+            neighbors[c1].add(c2)
+            neighbors[c2].add(c1)
+            roads[c1].append(path)
+            roads[c2].append(path)
+
+        def _policy(current: dict):
+            player = current['player_id']
+            nodes = current['board']['intersections']
+            paths = current['board']['paths']
+
+            occupied = {c for c, i in nodes.items() if i['owner'] is not None}
+            owned = set().union(*(diversity[c] for c, i in nodes.items() if i['owner'] == player))
+            free = [c for c in intersections if c not in occupied and not (neighbors[c] & occupied)]
+            if not free:
+                return None, None
+
+            node = max(free, key=lambda c: (len(diversity[c] - owned), richness[c]))
+            path = next(p for p in roads[node] if paths[p]['owner'] is None)
+            return VILLAGE(player, node), ROAD(player, path)
+
+        return _policy
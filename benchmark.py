@@ -0,0 +1,331 @@
+# Package for command line options
+import argparse
+# Package for storing and loading the baseline
+import json
+import sys
+# Package for tracking allocations
+import tracemalloc
+from pathlib import Path
+from time import perf_counter, time
+from typing import Callable, Dict, List
+
+# Import action specifications
+from action import VILLAGE, ROAD, PASS
+# Package for problem definitions
+from board import GameBoard, BACKENDS, _read_state, _unique_game_state_identifier
+# Corpus of initial states
+from corpus import generate_states, load_states
+# Peak memory usage tracker
+from memory import MemoryTracker
+# Import state utilities
+from state import thaw
+# Default agent for end-to-end benchmark
+from agents.default import Agent, TIME_MARGIN
+
+
+#: Size of KB in bytes
+KILOBYTES = 1024
+#: Random seed of the benchmark corpus (the same seed as the evaluation)
+BENCHMARK_SEED = 5606
+#: The number of boards in the benchmark corpus
+BENCHMARK_BOARDS = 5
+#: Minimum duration (in seconds) of a measuring round of a micro benchmark
+ROUND_DURATION = 0.05
+#: The number of measuring rounds of a micro benchmark on a board (the best round is taken, as timeit does)
+ROUNDS = 7
+#: The number of calls for measuring allocations of a micro benchmark on a board
+ALLOCATION_CALLS = 10
+#: Duration (in seconds) of running the default agent for each seat
+MACRO_DURATION = 5
+#: Relative slowdown of ops/sec which is reported as a regression
+REGRESSION_TOLERANCE = 0.25
+
+
+def build_corpus(boards: int = BENCHMARK_BOARDS, seed: int = BENCHMARK_SEED, path: Path = None) -> List[dict]:
+    """
+    Build a fixed corpus of initial states. The same seed (or the same corpus file) always gives the same boards.
+
+    :param boards: The number of boards
+    :param seed: Random seed for generating boards
+    :param path: Corpus file to load the boards from. If None, the boards are generated.
+    :return: List of initial states
+    """
+    if path is not None:
+        return load_states(path, boards)
+    return list(generate_states(boards, seed))
+
+
+def _new_board(initial: dict, backend: str) -> GameBoard:
+    """
+    [PRIVATE] Create a game board for the micro benchmarks.
+
+    :param initial: Initial state of the corpus
+    :param backend: Backend of the board (one of BACKENDS)
+    :return: Game board, which is set to the initial state
+    """
+    board = GameBoard()
+    board._initialize(initial_state=initial, backend=backend)
+    return board
+
+
+def _uncached(board: GameBoard, query: Callable[[], object]) -> Callable[[], object]:
+    """
+    [PRIVATE] Wrap a query of the board, so that every call converts the bitsets into coordinates again.
+    (Otherwise, repeating the query on the same state only measures the lookup of the bitset caches.)
+
+    :param board: Game board of the query
+    :param query: Query function without arguments
+    :return: Function without arguments
+    """
+    caches = board._mask_cache[1:]
+
+    def _query():
+        for cache in caches:
+            cache.clear()
+        return query()
+
+    return _query
+
+
+def _setup_cases(initial: dict, backend: str) -> Dict[str, Callable[[], object]]:
+    """
+    [PRIVATE] Prepare the hot calls of the board, on the first setup turn.
+    The legality queries use their own boards, which are set to the queried state once here (not in the timed calls),
+    as the other calls change the state of the shared board. They are measured with and without the bitset caches.
+
+    :param initial: Initial state of the corpus
+    :param backend: Backend of the board (one of BACKENDS)
+    :return: Dictionary of benchmark name to a function without arguments
+    """
+    board = _new_board(initial, backend)
+    initial = board.get_initial_state()
+    passed = board.simulate_action(initial, PASS())
+    player = passed['current_player']
+
+    board.set_to_state(passed)
+    village = board.get_applicable_villages(player=player)[0]
+    board.apply(VILLAGE(player, village))
+    road = board.get_applicable_roads_from(village, player=player)[0]
+    board.undo()
+    actions = VILLAGE(player, village), ROAD(player, road)
+    child = board.simulate_action(passed, *actions)
+
+    villages_board = _new_board(initial, backend)
+    villages_board.set_to_state(passed)
+    roads_board = _new_board(initial, backend)
+    roads_board.set_to_state(child)
+
+    def _villages():
+        return villages_board.get_applicable_villages(player=player)
+
+    def _roads_from():
+        return roads_board.get_applicable_roads_from(village, player=player)
+
+    return {
+        'simulate_action': lambda: board.simulate_action(passed, *actions),
+        'set_to_state': lambda: board.set_to_state(child),
+        'get_applicable_villages': _uncached(villages_board, _villages),
+        'get_applicable_villages/cached': _villages,
+        'get_applicable_roads_from': _uncached(roads_board, _roads_from),
+        'get_applicable_roads_from/cached': _roads_from,
+        'diversity_of_state': lambda: board.diversity_of_state(child),
+        '_read_state': lambda: _read_state(board._game, player, player, layout=board._layout),
+        '_unique_game_state_identifier': lambda: _unique_game_state_identifier(board._game),
+    }
+
+
+def _measure(function: Callable[[], object], tracker: MemoryTracker) -> dict:
+    """
+    [PRIVATE] Measure a function: throughput, allocated bytes per call and peak RSS growth.
+
+    :param function: Function without arguments
+    :param tracker: Memory tracker of this process
+    :return: Dictionary of ops (calls per second), alloc (bytes per call) and rss (bytes)
+    """
+    function()  # Warm up the caches
+
+    # Allocations: the peak of traced memory during a call, above the memory before the call.
+    tracemalloc.start()
+    allocated = 0
+    for _ in range(ALLOCATION_CALLS):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function()
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    # Throughput: find the batch size of a round, and take the best of rounds (the least disturbed one).
+    tracker.reset()
+    rss_before = tracker.current()
+    batch, elapsed = 1, 0.0
+    while True:
+        begin = perf_counter()
+        for _ in range(batch):
+            function()
+        elapsed = perf_counter() - begin
+        if elapsed >= ROUND_DURATION:
+            break
+        batch *= 2
+
+    for _ in range(ROUNDS - 1):
+        begin = perf_counter()
+        for _ in range(batch):
+            function()
+        elapsed = min(elapsed, perf_counter() - begin)
+
+    return {'ops': batch / elapsed, 'alloc': allocated / ALLOCATION_CALLS, 'rss': max(0, tracker.peak() - rss_before)}
+
+
+class _CountingBoard(GameBoard):
+    """
+    [PRIVATE] Game board which counts the states generated by simulation (i.e., search nodes).
+    """
+    #: The number of states generated
+    nodes = 0
+
+    def simulate_action(self, state: dict = None, *actions, mutable: bool = False) -> dict:
+        self.nodes += 1
+        return super().simulate_action(state, *actions, mutable=mutable)
+
+    def _simulate_many(self, state, action_tuples):
+        for child in super()._simulate_many(state, action_tuples):
+            self.nodes += 1
+            yield child
+
+
+def run_micro(corpus: List[dict], backend: str = BACKENDS[0]) -> Dict[str, dict]:
+    """
+    Run the micro benchmarks (hot calls of the board) over the corpus.
+
+    :param corpus: List of initial states
+    :param backend: Backend of the board (one of BACKENDS)
+    :return: Dictionary of benchmark name to the result (ops_per_sec, alloc_bytes, peak_rss)
+    """
+    tracker = MemoryTracker()
+    totals = {}
+    for initial in corpus:
+        for name, function in _setup_cases(initial, backend).items():
+            result = _measure(function, tracker)
+            total = totals.setdefault(name, {'ops': [], 'alloc': [], 'rss': 0})
+            total['ops'].append(result['ops'])
+            total['alloc'].append(result['alloc'])
+            total['rss'] = max(total['rss'], result['rss'])
+
+    return {
+        name: {'ops_per_sec': sum(total['ops']) / len(total['ops']),
+               'alloc_bytes': sum(total['alloc']) / len(total['alloc']),
+               'peak_rss': total['rss']}
+        for name, total in totals.items()
+    }
+
+
+def run_macro(corpus: List[dict], duration: float = MACRO_DURATION, backend: str = BACKENDS[0]) -> Dict[str, dict]:
+    """
+    Run the default agent on the corpus for each seat, and measure the search nodes per second.
+    Allocations are not measured here (alloc_bytes is None), as tracing them slows the search down several times.
+    See the peak RSS and the micro benchmarks instead.
+
+    :param corpus: List of initial states
+    :param duration: Search time (in seconds) for each board and seat
+    :param backend: Backend of the board (one of BACKENDS)
+    :return: Dictionary of benchmark name to the result (ops_per_sec, alloc_bytes, peak_rss)
+    """
+    tracker = MemoryTracker()
+    results = {}
+    for seat in range(4):
+        nodes, elapsed, peak = 0, 0.0, 0
+        for initial in corpus:
+            initial = thaw(initial)
+            initial['player_id'] = seat
+
+            board = _CountingBoard()
+            board._initialize(initial_state=initial, backend=backend)
+            tracker.reset()
+            rss_before = tracker.current()
+
+            begin = perf_counter()
+            Agent(time_budget=duration).decide_new_village(board, time_limit=time() + duration + TIME_MARGIN)
+            elapsed += perf_counter() - begin
+            nodes += board.nodes
+            peak = max(peak, tracker.peak() - rss_before)
+
+        results[f'default/seat{seat}'] = {'ops_per_sec': nodes / elapsed, 'alloc_bytes': None,
+                                          'peak_rss': max(0, peak)}
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float = REGRESSION_TOLERANCE) -> List[str]:
+    """
+    Compare the results with a baseline.
+
+    :param results: Results of this run
+    :param baseline: Results of the baseline run
+    :param tolerance: Relative slowdown of ops/sec which is reported as a regression
+    :return: List of names of the benchmarks which regressed
+    """
+    return [
+        name for name, result in results.items()
+        if name in baseline and result['ops_per_sec'] < (1 - tolerance) * baseline[name]['ops_per_sec']
+    ]
+
+
+def _print(results: Dict[str, dict], baseline: Dict[str, dict] = None):
+    """
+    [PRIVATE] Print the result table.
+    """
+    print(f' {"Benchmark":32s} | {"ops/sec":>12s} {"alloc/call":>12s} {"peak RSS":>10s} | {"vs. baseline":>12s}')
+    print('=' * 33 + '|' + '=' * 38 + '|' + '=' * 14)
+    for name, result in results.items():
+        ratio = ''
+        if baseline and name in baseline:
+            ratio = f'{result["ops_per_sec"] / baseline[name]["ops_per_sec"]:11.2f}x'
+        alloc = '' if result['alloc_bytes'] is None else f'{result["alloc_bytes"] / KILOBYTES:10.1f}KB'
+        print(f' {name:32s} | {result["ops_per_sec"]:12.1f} {alloc:>12s}'
+              f' {result["peak_rss"] / KILOBYTES:8.0f}KB | {ratio:>12s}')
+
+
+# Main function
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hot calls of the board and the default agent.')
+    parser.add_argument('--boards', type=int, default=BENCHMARK_BOARDS, help='The number of boards in the corpus')
+    parser.add_argument('--seed', type=int, default=BENCHMARK_SEED, help='Random seed of the corpus')
+    parser.add_argument('--corpus', type=Path, help='Load the boards from a corpus file, instead of generating them')
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKENDS[0], help='Backend of the board')
+    parser.add_argument('--macro', type=float, default=MACRO_DURATION,
+                        help='Search time (in seconds) of the default agent per board and seat. 0 to skip.')
+    parser.add_argument('--save', type=Path, help='Store the results as a baseline JSON file')
+    parser.add_argument('--compare', type=Path, help='Compare the results with a baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help='Relative slowdown of ops/sec which is reported as a regression')
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.boards, args.seed, args.corpus)
+    corpus_name = None if args.corpus is None else args.corpus.name
+    results = run_micro(corpus, args.backend)
+    if args.macro > 0:
+        results.update(run_macro(corpus, args.macro, args.backend))
+
+    baseline = None
+    if args.compare is not None:
+        with args.compare.open('rt') as fp:
+            stored = json.load(fp)
+        if (stored['seed'], stored['boards'], stored.get('corpus')) != (args.seed, args.boards, corpus_name):
+            print(f'[WARN] The baseline uses a different corpus: seed={stored["seed"]}, boards={stored["boards"]}, '
+                  f'corpus={stored.get("corpus")}')
+        if stored.get('backend', BACKENDS[0]) != args.backend:
+            print(f'[INFO] The baseline uses a different backend: {stored.get("backend", BACKENDS[0])}')
+        baseline = stored['results']
+
+    _print(results, baseline)
+
+    if args.save is not None:
+        with args.save.open('wt') as fp:
+            json.dump({'seed': args.seed, 'boards': args.boards, 'corpus': corpus_name, 'backend': args.backend,
+                       'python': sys.version, 'results': results}, fp, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name in regressions:
+            print(f'[REGRESSION] {name}: {results[name]["ops_per_sec"]:.1f} ops/sec '
+                  f'(baseline: {baseline[name]["ops_per_sec"]:.1f} ops/sec)')
+        sys.exit(1 if regressions else 0)
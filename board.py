@@ -1,11 +1,7 @@
 # Logging method for board execution
 import logging
-# Library for OS environment
-import os
 import random
 import sys
-# Object-level deep copy method
-from copy import deepcopy
 # Random number generators
 from random import randint as random_integer
 # Type specification for Python code
@@ -13,16 +9,25 @@ from typing import Tuple, List, Dict, Callable
 
 # Import some class definitions that implements the Settlers of Catan game.
 from pycatan import Game, Resource
-from pycatan.board import BuildingType, BoardRenderer, RandomBoard, Hex, HexType, Harbor, \
+from pycatan.board import Board, BuildingType, BoardRenderer, RandomBoard, Hex, HexType, Harbor, \
     IntersectionBuilding, PathBuilding
 
-# Process information class: for memory usage tracking
-from psutil import Process as PUInfo, NoSuchProcess
+# Peak memory usage tracker
+from memory import MemoryTracker
+# Statistics of API calls (opt-in)
+from stats import BoardStats
 
 # Import action specifications
-from action import Action, VILLAGE, ROAD, PASS
+from action import Action, VILLAGE, ROAD, PASS, UPGRADE
 # Import some utilities
-from util import tuple_to_coordinate, count_building, coordinate_to_tuple, tuple_to_path_coordinate
+from util import tuple_to_coordinate, coordinate_to_tuple, tuple_to_path_coordinate
+# Import compact state representations
+from state import BoardLayout, CompactState, StateDelta, StateView, RESOURCE_ORDER, EMPTY, SETTLEMENT_CODE, CITY_CODE, \
+    ROAD_CODE, node_entry, path_entry, state_identifier, stable_hash, freeze, thaw
+# Import the static topology index
+from topology import BoardTopology, batch_diversity
+# Rules engine for the initial phase, independent of PyCatan
+from engine import SetupEngine
 
 
 #: True if the program run with 'DEBUG' environment variable.
@@ -57,6 +62,15 @@ RESOURCES = [
 # List of player colors
 PLAYER_COLOR = ["#00c40d", "#ff00d9", "#0000FF", "#00FFFF"]
 
+#: Maximum number of entries in each cache of legal move lists
+MASK_CACHE_SIZE = 4096
+#: Available backends of the GameBoard: PyCatan's object model, or the setup engine (see engine.py)
+BACKENDS = ('pycatan', 'engine')
+#: Methods recorded by GameBoard.enable_stats()
+STATS_METHODS = ('set_to_state', 'get_state', 'get_compact_state', 'simulate_action', 'simulate_many', 'apply', 'undo',
+                 'get_applicable_villages', 'get_applicable_roads', 'get_applicable_roads_from',
+                 'get_applicable_cities', 'diversity_of_state', 'diversity_of_places', 'to_dict', 'to_compact')
+
 
 def _coordinate_to_identifier(c):
     """
@@ -74,6 +88,7 @@ def _unique_game_state_identifier(game: Game) -> str:
     """
     Return the unique identifier for game states.
     If two states are having the same identifier, then the states can be treated as identical in this problem.
+    The identifier does not depend on the order of the hexes and harbors in PyCatan, which varies between runs.
 
     :param game: Game to make a unique identifier
     :return: String of game identifier
@@ -81,7 +96,7 @@ def _unique_game_state_identifier(game: Game) -> str:
 
     hexes = ':'.join([
         str(h.token_number) + _coordinate_to_identifier(c) + str(h.hex_type.value)
-        for c, h in sorted(game.board.hexes.items(), key=lambda t: t[1].token_number or -1)
+        for c, h in sorted(game.board.hexes.items(), key=lambda t: (t[1].token_number or -1, coordinate_to_tuple(t[0])))
     ])
     intersections = ':'.join([
         _coordinate_to_identifier(c) + str(game.players.index(i.building.owner)) + str(i.building.building_type.value)
@@ -97,36 +112,36 @@ def _unique_game_state_identifier(game: Game) -> str:
         '.'.join(str(r.value) + str(c) for r, c in sorted(p.resources.items(), key=lambda t: t[0].name))
         for p in game.players
     ])
-    harbors = ':'.join([
+    harbors = ':'.join(sorted([
         '-'.join(sorted(_coordinate_to_identifier(c) for c in p)) +
         (str(i.resource.value) if i.resource is not None else 'X')
         for p, i in game.board.harbors.items()
-    ])
+    ]))
 
     return f'{hexes}/{intersections}/{paths}/{players}/{harbors}'
 
 
-def _read_state(game: Game, player: int, current_player: int) -> dict:
+def _read_state(game: Game, player: int, current_player: int, state_hash: int = None,
+                layout: BoardLayout = None) -> dict:
     """
     Helper function for reading the current state representation as a python dictionary from the PyCatan board.
 
     :param game: Game to build a state.
-    :return: State representation of a game (in basic python objects)
+    :param state_hash: 64-bit hash of the current state, maintained by the GameBoard.
+    :param layout: Layout of the board. If given, the static sections (hexes and harbors) of the layout are shared,
+        instead of reading them again.
+    :return: State representation of a game (read-only view of basic python objects)
     """
 
-    return {
+    return freeze({
         'state_id': _unique_game_state_identifier(game),
         # Unique identifier for the game state. If this is the same, then the state will be equivalent.
+        'state_hash': state_hash,
+        # 64-bit hash of the game state. Equivalent states have the same hash. (Use this as a cheap dictionary key)
         'player_id': player,  # The agent's Player ID
         'current_player': current_player,  # Currently playing Player's ID
         'board': {  # Information about the current board
-            'hexes': {  # Information about each hexagon cell
-                coordinate_to_tuple(c): {  # For each coordinate(placement)
-                    'type': h.hex_type.name,  # Resource type of that hexagon
-                    'dice': h.token_number  # Dice number for that hexagon
-                }
-                for c, h in game.board.hexes.items()
-            },
+            'hexes': _read_hexes(game) if layout is None else layout.hexes,  # Information about each hexagon cell
             'intersections': {  # Information about node intersection among three hexagon cells
                 coordinate_to_tuple(c): {  # For each coordinate (placement)
                     'type': i.building.building_type.name if i.building is not None else None,  # Type of building
@@ -142,66 +157,133 @@ def _read_state(game: Game, player: int, current_player: int) -> dict:
                 }
                 for p, i in game.board.paths.items()
             },
-            'harbors': {  # Information about harbors
-                tuple(sorted(coordinate_to_tuple(c) for c in p)): {  # For each coordinate of harbor,
-                    'type': i.resource.name if i.resource is not None else None
-                    # Resource type for that harbor(2:1 trade). None means generic harbor(3:1)
-                }
-                for p, i in game.board.harbors.items()
-            },
-        },
-        'player': {
-            p: {  # Information about the current player
-                'resources': {  # Information about resource cards
-                    res.name: cnt  # For each resource, the number of resource cards will be stored
-                    for res, cnt in game.players[p].resources.items()
-                },
-                'harbors': [  # Information about the connected harbors, with the coordinate names
-                    tuple(sorted(coordinate_to_tuple(c) for c in h.path_coords))
-                    for h in game.players[p].connected_harbors
-                ]
-            }
-            for p in range(4)
+            'harbors': _read_harbors(game) if layout is None else layout.harbors,  # Information about harbors
         },
+        'player': _read_players(game),
         'robber': coordinate_to_tuple(game.board.robber)
+    })
+
+
+def _read_hexes(game: Game) -> dict:
+    """
+    Helper function for reading the hex section of the state representation. (Static during a game)
+
+    :param game: Game to read
+    :return: Dictionary of hex type and dice number, for each hex
+    """
+
+    return {
+        coordinate_to_tuple(c): {  # For each coordinate(placement)
+            'type': h.hex_type.name,  # Resource type of that hexagon
+            'dice': h.token_number  # Dice number for that hexagon
+        }
+        for c, h in game.board.hexes.items()
+    }
+
+
+def _read_harbors(game: Game) -> dict:
+    """
+    Helper function for reading the harbor section of the state representation. (Static during a game)
+
+    :param game: Game to read
+    :return: Dictionary of harbor type, for each harbor
+    """
+
+    return {
+        tuple(sorted(coordinate_to_tuple(c) for c in p)): {  # For each coordinate of harbor,
+            'type': i.resource.name if i.resource is not None else None
+            # Resource type for that harbor(2:1 trade). None means generic harbor(3:1)
+        }
+        for p, i in game.board.harbors.items()
+    }
+
+
+def _read_players(game: Game) -> dict:
+    """
+    Helper function for reading the player section of the state representation.
+
+    :param game: Game to read
+    :return: Dictionary of resources and connected harbors, for each player
+    """
+
+    return {
+        p: {  # Information about the current player
+            'resources': {  # Information about resource cards
+                res.name: cnt  # For each resource, the number of resource cards will be stored
+                for res, cnt in game.players[p].resources.items()
+            },
+            'harbors': [  # Information about the connected harbors, with the coordinate names
+                tuple(sorted(coordinate_to_tuple(c) for c in h.path_coords))
+                for h in game.players[p].connected_harbors
+            ]
+        }
+        for p in range(4)
     }
 
 
-def _restore_state(game: Game, state: dict, turnoff_check: bool):
+def _build_board(state: dict) -> Board:
+    """
+    Helper function for building a PyCatan board from the static sections (hexes, harbors and robber) of a state,
+    without generating a random board first.
+
+    :param state: State representation of a board
+    :return: A new PyCatan board with no buildings
+    """
+    hexes = [
+        Hex(coords=tuple_to_coordinate(c), hex_type=HexType[h['type'].upper()], token_number=h['dice'])
+        for c, h in state['board']['hexes'].items()
+    ]
+    harbors = [
+        Harbor(path_coords=tuple_to_path_coordinate((c1, c2)),
+               resource=None if i['type'] is None else Resource[i['type'].upper()])
+        for (c1, c2), i in state['board']['harbors'].items()
+    ]
+    robber = tuple_to_coordinate(state['robber']) if 'robber' in state else None
+    return Board(hexes=hexes, harbors=harbors, robber=robber)
+
+
+def _restore_state(game: Game, state: dict, turnoff_check: bool, layout: BoardLayout = None):
     """
     Helper function to restore board state to given state representation.
 
     :param game: Game to restore a state.
     :param state: State to be restored
+    :param layout: Layout of the board. If the state shares the static sections of the layout (the same objects),
+        the check of the static sections is skipped.
     """
-    # Check whether hexes are the same.
-    if turnoff_check:
-        game.board.hexes.clear()
-        game.board.harbors.clear()
+    # The static sections don't need to be checked, if they are the interned ones.
+    is_static_shared = not turnoff_check and layout is not None and \
+        state['board']['hexes'] is layout.hexes and state['board']['harbors'] is layout.harbors
 
-    for c, h in state['board']['hexes'].items():
-        c = tuple_to_coordinate(c)
+    if not is_static_shared:
+        # Check whether hexes are the same.
         if turnoff_check:
-            game.board.hexes[c] = Hex(
-                coords=c, hex_type=HexType[h['type'].upper()], token_number=h['dice']
-            )
-        else:
-            assert game.board.hexes[c].hex_type.name == h['type'],\
-                f'The hex information (hex type) is different! {game.board.hexes[c].hex_type.name} == {h["type"]}'
-            assert game.board.hexes[c].token_number == h['dice'], 'The hex information (hex token) is different!'
-
-    # Check whether harbors are the same.
-    for (c1, c2), i in state['board']['harbors'].items():
-        c = tuple_to_path_coordinate((c1, c2))
+            game.board.hexes.clear()
+            game.board.harbors.clear()
+
+        for c, h in state['board']['hexes'].items():
+            c = tuple_to_coordinate(c)
+            if turnoff_check:
+                game.board.hexes[c] = Hex(
+                    coords=c, hex_type=HexType[h['type'].upper()], token_number=h['dice']
+                )
+            else:
+                assert game.board.hexes[c].hex_type.name == h['type'],\
+                    f'The hex information (hex type) is different! {game.board.hexes[c].hex_type.name} == {h["type"]}'
+                assert game.board.hexes[c].token_number == h['dice'], 'The hex information (hex token) is different!'
+
+        # Check whether harbors are the same.
+        for (c1, c2), i in state['board']['harbors'].items():
+            c = tuple_to_path_coordinate((c1, c2))
 
-        if turnoff_check:
-            game.board.harbors[c] = Harbor(
-                path_coords=c,
-                resource=None if i['type'] is None else Resource[i['type'].upper()]
-            )
-        else:
-            res = game.board.harbors[c].resource
-            assert (res is None and i['type'] is None) or (res.name == i['type']), 'Harbor information is different!'
+            if turnoff_check:
+                game.board.harbors[c] = Harbor(
+                    path_coords=c,
+                    resource=None if i['type'] is None else Resource[i['type'].upper()]
+                )
+            else:
+                res = game.board.harbors[c].resource
+                assert (res is None and i['type'] is None) or (res.name == i['type']), 'Harbor information is different!'
 
     # Restore intersections
     for c, i in state['board']['intersections'].items():
@@ -245,6 +327,119 @@ def _restore_state(game: Game, state: dict, turnoff_check: bool):
     return state['player_id'], state['current_player']
 
 
+def _building_code(game: Game, building) -> int:
+    """
+    Helper function for converting a PyCatan building into an occupancy code of the compact representation.
+
+    :param game: Game where the building is placed.
+    :param building: IntersectionBuilding, PathBuilding or None.
+    :return: Occupancy code of the building
+    """
+    if building is None:
+        return EMPTY
+
+    owner = game.players.index(building.owner)
+    if building.building_type == BuildingType.ROAD:
+        return ROAD_CODE + owner
+    if building.building_type == BuildingType.CITY:
+        return CITY_CODE + owner
+    return SETTLEMENT_CODE + owner
+
+
+def _read_compact_state(game: Game, layout: BoardLayout, player: int, current_player: int) -> CompactState:
+    """
+    Helper function for reading the current state as a compact representation from the PyCatan board.
+
+    :param game: Game to build a state.
+    :param layout: Layout of the board, which specifies the index of nodes and paths
+    :return: Compact state representation of a game
+    """
+    nodes = bytearray(layout.num_nodes)
+    for c, i in game.board.intersections.items():
+        if i.building is not None:
+            nodes[layout.node_index[coordinate_to_tuple(c)]] = _building_code(game, i.building)
+
+    paths = bytearray(layout.num_paths)
+    for p, i in game.board.paths.items():
+        if i.building is not None:
+            key = tuple(sorted(coordinate_to_tuple(c) for c in p))
+            paths[layout.path_index[key]] = _building_code(game, i.building)
+
+    resources = [
+        game.players[p].resources[Resource[r]]
+        for p in range(4)
+        for r in RESOURCE_ORDER
+    ]
+
+    return CompactState.build(player, current_player, nodes, paths, resources)
+
+
+def _restore_compact_state(game: Game, layout: BoardLayout, state: CompactState):
+    """
+    Helper function to restore board state to given compact state representation.
+    The static sections (hexes, harbors and robber) are not touched, as they are the same within a board.
+
+    :param game: Game to restore a state.
+    :param layout: Layout of the board, which specifies the index of nodes and paths
+    :param state: Compact state to be restored
+    """
+    for p in range(4):
+        game.players[p].connected_harbors = set()
+
+    # Restore intersections
+    for c, code in zip(layout.nodes, state.nodes):
+        c = tuple_to_coordinate(c)
+        building = None
+        if code != EMPTY:
+            building_type = BuildingType.CITY if code >= CITY_CODE else BuildingType.SETTLEMENT
+            owner = game.players[code - (CITY_CODE if code >= CITY_CODE else SETTLEMENT_CODE)]
+            building = IntersectionBuilding(building_type=building_type, owner=owner, coords=c)
+
+            # Restore connected harbor information
+            for harbor in game.board.harbors.values():
+                if c in harbor.path_coords:
+                    owner.connected_harbors.add(harbor)
+
+        game.board.intersections[c].building = building
+
+    # Restore paths
+    for (c1, c2), code in zip(layout.paths, state.paths):
+        c = tuple_to_path_coordinate((c1, c2))
+        building = None
+        if code != EMPTY:
+            building = PathBuilding(building_type=BuildingType.ROAD, owner=game.players[code - ROAD_CODE], path_coords=c)
+
+        game.board.paths[c].building = building
+
+    # Restore player's resource
+    resources = state.resources
+    for p in range(4):
+        for k, res in enumerate(RESOURCE_ORDER):
+            game.players[p].resources[Resource[res]] = resources[p * len(RESOURCE_ORDER) + k]
+
+    return state.player_id, state.current_player
+
+
+def _node_owner(code: int) -> int:
+    """
+    Helper function for reading the owner from a node occupancy code.
+
+    :param code: Occupancy code of a node (should not be EMPTY)
+    :return: Player index of the owner
+    """
+    return code - (CITY_CODE if code >= CITY_CODE else SETTLEMENT_CODE)
+
+
+def _popcount(mask: int) -> int:
+    """
+    Helper function for counting the number of set bits.
+
+    :param mask: Bitset
+    :return: The number of set bits
+    """
+    return bin(mask).count('1')
+
+
 class GameBoard:
     """
     The game board object.
@@ -264,29 +459,65 @@ class GameBoard:
     _initial = None
     #: [PRIVATE] The current state of the board. Don't access this directly in your agent code!
     _current = None
+    #: [PRIVATE] Static topology index of the board (node/path indices and adjacency), shared by all compact states.
+    _layout: BoardTopology = None
+    #: [PRIVATE] Stack of undo records for apply() and undo().
+    _undo_stack = None
+    #: [PRIVATE] True if the board has been changed by apply()/undo() after the last reading of the current state.
+    _current_is_stale = False
+    #: [PRIVATE] Occupancy codes of the nodes on the current board (mirror of the PyCatan board)
+    _node_codes = None
+    #: [PRIVATE] Occupancy codes of the paths on the current board (mirror of the PyCatan board)
+    _path_codes = None
+    #: [PRIVATE] 64-bit Zobrist hash of the current board, maintained incrementally.
+    _hash = 0
+    #: [PRIVATE] Part of the Zobrist hash for the resource counts.
+    _resource_hash = 0
+    #: [PRIVATE] Bitset of the nodes where a village can be built under the distance rule.
+    _free_nodes = 0
+    #: [PRIVATE] Bitset of the occupied nodes.
+    _occupied_nodes = 0
+    #: [PRIVATE] Bitset of the empty paths.
+    _free_paths = 0
+    #: [PRIVATE] Bitsets of the nodes having buildings, for each player.
+    _owned_nodes = None
+    #: [PRIVATE] Bitsets of the paths having roads, for each player.
+    _owned_paths = None
+    #: [PRIVATE] Cache of legal move lists and connectivity masks, keyed by bitsets of occupancy.
+    _mask_cache = None
+    #: [PRIVATE] Setup engine, which replaces the PyCatan game for the initial phase. None if PyCatan is the backend.
+    _engine: SetupEngine = None
     #: [PRIVATE] Logger instance for Board's function calls
     _logger = logging.getLogger('GameBoard')
-    #: [PRIVATE] Memory usage tracker
-    _process_info = None
-    #: [PRIVATE] Maximum memory usage. Don't access this directly in your agent code!
-    _max_memory = 0
+    #: [PRIVATE] Memory usage tracker (kernel high-water mark). Don't access this directly in your agent code!
+    _memory: MemoryTracker = None
+    #: [PRIVATE] Statistics of API calls. None if not enabled.
+    _stats: BoardStats = None
     #: [PRIVATE] Boolean for indicating whether this is on an initial set-up procedure or not
     _initial_phase = True
     #: [PRIVATE] Random seed generator
     _rng = random.Random(2938)
 
-    def _initialize(self):
+    def _initialize(self, memory_interval: float = None, initial_state: dict = None, backend: str = BACKENDS[0]):
         """
         Initialize the board for evaluation. ONLY for evaluation purposes.
         [WARN] Don't access this method in your agent code.
+
+        :param memory_interval: Interval (in seconds) of background memory sampling.
+            If None, the peak memory is read from the kernel high-water mark only.
+        :param initial_state: The initial state (dictionary) of the board. If given, the board is built directly from
+            the state and set to it. Otherwise, a new random board is generated.
+        :param backend: Backend of the board (one of BACKENDS)
         """
         # Initialize process tracker
-        self._process_info = PUInfo(os.getpid())
+        self._memory = MemoryTracker(interval=memory_interval)
+        # The engine of the previous board (if any) is not valid for a new board.
+        self._engine = None
 
         if IS_DEBUG:  # Logging for debug
             self._logger.debug('Initializing a new game board...')
         # Initialize a new game board
-        self._game = Game(RandomBoard())
+        self._game = Game(RandomBoard() if initial_state is None else _build_board(initial_state))
         # Initialize board renderer for debugging purposes
         if IS_DEBUG:  # Logging for debug
             self._renderer = BoardRenderer(self._game.board, player_color_map={
@@ -306,14 +537,74 @@ class GameBoard:
             self._logger.debug('After constructing initial village: \n' + _unique_game_state_identifier(self._game))
             self._renderer.render_board()
 
+        if initial_state is not None:
+            # Set the board to the given state. (This also updates memory usage)
+            self.set_to_state(initial_state, is_initial=True)
+            self.set_backend(backend)
+            return
+
         # Store initial state representation
-        self._initial = _read_state(self._game, self._player_number, 0)
-        self._current = deepcopy(self._initial)
+        initial = _read_state(self._game, self._player_number, 0)
+        self._layout = BoardTopology(initial)
+        self._undo_stack = []
+        self._reset_occupancy()
+        self._initial = self._current = StateView(initial, state_hash=self._hash)
         self.reset_setup_order()
+        self.set_backend(backend)
 
         # Update memory usage
         self._update_memory_usage()
 
+    def set_backend(self, backend: str):
+        """
+        Choose the backend which runs the rules of the board. ONLY for evaluation purposes.
+        [WARN] Don't access this method in your agent code.
+
+        With 'engine', the initial phase (VILLAGE, ROAD and PASS) runs on the setup engine, which is independent of
+        PyCatan, and the PyCatan game is synchronized only when a query needs it (e.g., get_longest_route()).
+        The current state is kept, but the actions applied before cannot be undone after switching.
+
+        :param backend: One of BACKENDS ('pycatan' or 'engine')
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend: {backend}. Should be one of {BACKENDS}.')
+
+        if backend == 'pycatan' and self._engine is not None:
+            self._sync_game()
+            self._engine = None
+            self._undo_stack = []
+        elif backend == 'engine' and (self._engine is None or self._engine.layout is not self._layout):
+            self._engine = SetupEngine(self._layout)
+            self._engine.restore(_read_state(self._game, self._player_number, self._current_player, self._hash,
+                                             self._layout))
+            self._undo_stack = []
+
+    def get_backend(self) -> str:
+        """
+        :return: The backend which runs the rules of the board (one of BACKENDS)
+        """
+        return BACKENDS[0] if self._engine is None else 'engine'
+
+    def _sync_game(self):
+        """
+        [PRIVATE] Set the PyCatan game to the current board, when the setup engine is the backend.
+        """
+        if self._engine is not None:
+            _restore_state(self._game, self._read_current_state(), turnoff_check=False, layout=self._layout)
+
+    @classmethod
+    def from_state(cls, initial_state: dict) -> 'GameBoard':
+        """
+        Build a new game board, which starts from the given initial state.
+        Use this when you need an independent copy of the board (e.g., in another process).
+
+        :param initial_state: The initial state (dictionary) of the board to build
+        :return: A new GameBoard
+        """
+        board = cls()
+        board._initialize(initial_state=initial_state)
+        return board
+
     def reset_setup_order(self, reset_to=None):
         """
         Initialize the setup turn order to 1-2-3-4-4-3-2-1.
@@ -350,7 +641,7 @@ class GameBoard:
             state = self.simulate_action(state, PASS())
             policy = players_policy[self._current_player]
 
-            act1, act2 = policy(self._current.copy())
+            act1, act2 = policy(self.get_state())
             assert isinstance(act1, VILLAGE), f'The first action should be a VILLAGE action, but received {type(act1)} for {self._current_player}'
             assert isinstance(act2, ROAD), f'The second action should be a ROAD action, but received {type(act2)} for {self._current_player}'
 
@@ -365,7 +656,7 @@ class GameBoard:
 
         def policy(state: dict):
             def _res_counter(coord):
-                return self._game.board.get_hex_resources_for_intersection(tuple_to_coordinate(coord)).get(resource, 0)
+                return self._layout.node_resource_counts[self._layout.node_index[coord]][resource.name]
 
             # Query all applicable nodes for the initial village.
             applicable_nodes = self.get_applicable_villages()
@@ -393,7 +684,7 @@ class GameBoard:
         """
 
         def _lumber_counter(coord):
-            return self._game.board.get_hex_resources_for_intersection(tuple_to_coordinate(coord))[Resource.LUMBER]
+            return self._layout.node_resource_counts[self._layout.node_index[coord]][Resource.LUMBER.name]
 
         # Query all applicable nodes for the initial village.
         applicable_nodes = self.get_applicable_villages()
@@ -417,25 +708,44 @@ class GameBoard:
         """
         Restore the board to the initial state for repeated evaluation.
 
-        :param specific_state: A state representation which the board reset to
+        :param specific_state: A state representation (dictionary or CompactState) which the board reset to
         :param is_initial: True if this is an initial state to begin evaluation
         """
         assert specific_state is not None or not is_initial
+        assert not (is_initial and isinstance(specific_state, CompactState)), \
+            'The initial state should be given as a dictionary.'
         if specific_state is None:
             specific_state = self._initial
         if is_initial:
-            self._initial = specific_state
-            self._current = deepcopy(self._initial)
-            self._rng.seed(hash(self._initial['state_id']))  # Use state_id as hash seed.
+            specific_state = freeze(specific_state)
+            self._layout = BoardTopology(specific_state)
+            self._rng.seed(stable_hash(specific_state['state_id']))  # Use state_id as seed. (Same in every process)
             self.reset_setup_order()  # Reset the setup order
+            if self._engine is not None:
+                self._engine = SetupEngine(self._layout)  # The engine is built for each board.
 
         # Restore the board to the given state.
-        self._player_number, self._current_player = _restore_state(self._game, specific_state, turnoff_check=is_initial)
+        if self._engine is not None:
+            self._player_number, self._current_player = self._engine.restore(specific_state)
+        if self._engine is None or is_initial:
+            # (The PyCatan game is also set to the initial state, as it is synchronized from there when needed.)
+            if isinstance(specific_state, CompactState):
+                self._player_number, self._current_player = \
+                    _restore_compact_state(self._game, self._layout, specific_state)
+            else:
+                self._player_number, self._current_player = \
+                    _restore_state(self._game, specific_state, turnoff_check=is_initial, layout=self._layout)
+        # Previous apply() records are not valid anymore.
+        self._undo_stack = []
+        self._reset_occupancy()
+        if is_initial:
+            self._initial = self._current = StateView(specific_state, state_hash=self._hash)
 
         # Update memory usage
         self._update_memory_usage()
 
         if IS_DEBUG:  # Logging for debug
+            self._sync_game()
             self._logger.debug('State has been set as follows: \n' + _unique_game_state_identifier(self._game))
             self._renderer.render_board()
 
@@ -446,39 +756,275 @@ class GameBoard:
         :param state: A state to check. If None, then it will use the initial state.
         :return: True if the game ends at the given state
         """
+        self._sync_game()  # (Only PyCatan knows the victory points.)
         player = self._game.players[self._current_player]
         is_game_end = self._game.get_victory_points(player) >= 10
         if IS_DEBUG:  # Logging for debug
             self._logger.debug(f'Querying whether the game ends in this state... Answer = {is_game_end}')
         return is_game_end
 
-    def get_state(self) -> dict:
+    def get_state(self, mutable: bool = False) -> dict:
         """
         Get the current board state
 
-        :return: A copy of the initial board state dictionary
+        :param mutable: True if you want to get a mutable copy, instead of a read-only view.
+        :return: The current board state dictionary (read-only view, unless mutable is True)
         """
         if IS_DEBUG:  # Logging for debug
             self._logger.debug('Querying initial state...')
 
         # Check whether the game has been initialized or not.
         assert self._current is not None, 'The board should be initialized. Did you run the evaluation code properly?'
-        # Return the initial state representation as a copy.
-        return deepcopy(self._current)
+        if self._current_is_stale:
+            # The board has been changed by apply()/undo(). Read the state again.
+            self._current = self._read_current_state()
+            self._current_is_stale = False
+            self._count_materialized()
+        # Return the current state representation. A copy is made only when requested.
+        state = self._current
+        if isinstance(state, CompactState):
+            state = state.to_dict(self._layout)
+            self._count_materialized()
+        return thaw(state) if mutable else state
+
+    def get_compact_state(self) -> CompactState:
+        """
+        Get the current board state as a compact representation.
+        Compact states are immutable bytes objects, so they can be stored and used as dictionary keys without copying.
+        They can be passed to set_to_state() or simulate_action() in place of state dictionaries.
+
+        :return: A CompactState of the current board
+        """
+        assert self._layout is not None, 'The board should be initialized. Did you run the evaluation code properly?'
+        self._count_materialized()
+        return CompactState.build(self._player_number, self._current_player,
+                                  self._node_codes, self._path_codes, self._read_resources())
+
+    def get_state_hash(self) -> int:
+        """
+        Get the 64-bit hash of the current board state. This is the same as state['state_hash'].
+        Like the state ID, two equivalent states have the same hash, but it costs O(1) to query and to store.
+
+        :return: 64-bit integer hash
+        """
+        return self._hash
+
+    def _read_current_state(self) -> dict:
+        """
+        [PRIVATE] Read the state dictionary of the current board, from the backend.
+        """
+        if self._engine is not None:
+            return self._engine.read_state(self._player_number, self._current_player, self._hash)
+        return _read_state(self._game, self._player_number, self._current_player, self._hash, self._layout)
+
+    def _read_resources(self) -> List[int]:
+        """
+        [PRIVATE] Read the resource counts of all players, in the order of the compact representation.
+        """
+        if self._engine is not None:
+            return list(self._engine.resources)
+        return [
+            self._game.players[p].resources[Resource[r]]
+            for p in range(4)
+            for r in RESOURCE_ORDER
+        ]
+
+    def _reset_occupancy(self):
+        """
+        [PRIVATE] Rebuild the occupancy mirror and the hash of the current board from scratch.
+        """
+        if self._engine is not None:
+            compact = self._engine.to_compact(self._player_number, self._current_player)
+        else:
+            compact = _read_compact_state(self._game, self._layout, self._player_number, self._current_player)
+        self._node_codes = bytearray(compact.nodes)
+        self._path_codes = bytearray(compact.paths)
+        self._resource_hash = self._layout.zobrist.resource_hash(compact.resources)
+        self._hash = compact.state_hash(self._layout)
+
+        # Rebuild legality bitsets
+        if self._mask_cache is None or self._mask_cache[0] is not self._layout:
+            # Cached lists are valid only for the same topology.
+            self._mask_cache = (self._layout, {}, {}, {})
+        self._owned_nodes = [0] * 4
+        self._owned_paths = [0] * 4
+        self._occupied_nodes = 0
+        for n, code in enumerate(self._node_codes):
+            if code != EMPTY:
+                self._occupied_nodes |= 1 << n
+                self._owned_nodes[_node_owner(code)] |= 1 << n
+        self._free_nodes = 0
+        for n in range(self._layout.num_nodes):
+            if not self._occupied_nodes & self._layout.node_block_mask[n]:
+                self._free_nodes |= 1 << n
+        self._free_paths = 0
+        for e, code in enumerate(self._path_codes):
+            if code == EMPTY:
+                self._free_paths |= 1 << e
+            else:
+                self._owned_paths[code - ROAD_CODE] |= 1 << e
+
+    def _node_changed(self, coord):
+        """
+        [PRIVATE] Update the occupancy mirror and the hash, after the building on the node has been changed.
+
+        :param coord: Coordinate (PyCatan Coords) of the changed node
+        """
+        index = self._layout.node_index[coordinate_to_tuple(coord)]
+        keys = self._layout.zobrist.node_keys[index]
+        old = self._node_codes[index]
+        new = self._code_of(self._node_building(coord))
+        self._hash ^= keys[old] ^ keys[new]
+        self._node_codes[index] = new
+
+        # Update legality bitsets
+        bit = 1 << index
+        if old != EMPTY:
+            self._owned_nodes[_node_owner(old)] &= ~bit
+        if new != EMPTY:
+            self._owned_nodes[_node_owner(new)] |= bit
+            self._occupied_nodes |= bit
+            # Distance rule: the node and its neighbors cannot have a village anymore.
+            self._free_nodes &= ~self._layout.node_block_mask[index]
+        elif old != EMPTY:
+            self._occupied_nodes &= ~bit
+            # The node and its neighbors may have a village again.
+            for n in self._layout.bits(self._layout.node_block_mask[index]):
+                if not self._occupied_nodes & self._layout.node_block_mask[n]:
+                    self._free_nodes |= 1 << n
+
+    def _path_changed(self, coord):
+        """
+        [PRIVATE] Update the occupancy mirror and the hash, after the building on the path has been changed.
+
+        :param coord: Coordinate (frozenset of PyCatan Coords) of the changed path
+        """
+        index = self._layout.path_index[tuple(sorted(coordinate_to_tuple(c) for c in coord))]
+        keys = self._layout.zobrist.path_keys[index]
+        old = self._path_codes[index]
+        new = self._code_of(self._path_building(coord))
+        self._hash ^= keys[old] ^ keys[new]
+        self._path_codes[index] = new
+
+        # Update legality bitsets
+        bit = 1 << index
+        if old != EMPTY:
+            self._owned_paths[old - ROAD_CODE] &= ~bit
+        if new != EMPTY:
+            self._owned_paths[new - ROAD_CODE] |= bit
+            self._free_paths &= ~bit
+        else:
+            self._free_paths |= bit
 
-    def get_initial_state(self) -> dict:
+    def _node_building(self, coord):
+        """
+        [PRIVATE] Read the building on a node from the backend.
+
+        :param coord: Coordinate (PyCatan Coords) of the node
+        :return: PyCatan building (or None), or the occupancy code if the setup engine is the backend.
+        """
+        if self._engine is not None:
+            return self._engine.node_codes[self._layout.node_index[coordinate_to_tuple(coord)]]
+        return self._game.board.intersections[coord].building
+
+    def _path_building(self, coord):
+        """
+        [PRIVATE] Read the building on a path from the backend.
+
+        :param coord: Coordinate (frozenset of PyCatan Coords) of the path
+        :return: PyCatan building (or None), or the occupancy code if the setup engine is the backend.
+        """
+        if self._engine is not None:
+            return self._engine.path_codes[self._layout.path_index[tuple(sorted(coordinate_to_tuple(c) for c in coord))]]
+        return self._game.board.paths[coord].building
+
+    def _set_node_building(self, coord, building):
+        """
+        [PRIVATE] Put a building (read by _node_building()) on a node of the backend.
+        """
+        if self._engine is not None:
+            self._engine.set_node(self._layout.node_index[coordinate_to_tuple(coord)], building)
+        else:
+            self._game.board.intersections[coord].building = building
+
+    def _set_path_building(self, coord, building):
+        """
+        [PRIVATE] Put a building (read by _path_building()) on a path of the backend.
+        """
+        if self._engine is not None:
+            self._engine.set_path(self._layout.path_index[tuple(sorted(coordinate_to_tuple(c) for c in coord))],
+                                  building)
+        else:
+            self._game.board.paths[coord].building = building
+
+    def _code_of(self, building) -> int:
+        """
+        [PRIVATE] Convert a building of the backend into an occupancy code.
+        """
+        return building if self._engine is not None else _building_code(self._game, building)
+
+    def _connected_harbors(self, player: int):
+        """
+        [PRIVATE] Read the harbors connected to the player from the backend.
+        """
+        if self._engine is not None:
+            return self._engine.harbors[player]
+        return set(self._game.players[player].connected_harbors)
+
+    def _set_connected_harbors(self, player: int, connected):
+        """
+        [PRIVATE] Set the harbors (read by _connected_harbors()) connected to the player on the backend.
+        """
+        if self._engine is not None:
+            self._engine.harbors[player] = connected
+        else:
+            self._game.players[player].connected_harbors = connected
+
+    def _resources_changed(self):
+        """
+        [PRIVATE] Update the hash, after resource cards of players have been changed.
+        """
+        new = self._layout.zobrist.resource_hash(self._read_resources())
+        self._hash ^= self._resource_hash ^ new
+        self._resource_hash = new
+
+    def to_compact(self, state: dict) -> CompactState:
+        """
+        Convert a state dictionary into the compact representation.
+
+        :param state: State dictionary to convert
+        :return: A CompactState of the given state
+        """
+        if isinstance(state, CompactState):
+            return state
+        return CompactState.from_dict(self._layout, state)
+
+    def to_dict(self, state: CompactState) -> dict:
+        """
+        Convert a compact state into the state dictionary form.
+
+        :param state: CompactState to convert
+        :return: A state dictionary, as get_state() returns.
+        """
+        if isinstance(state, dict):
+            return freeze(state)
+        self._count_materialized()
+        return state.to_dict(self._layout)
+
+    def get_initial_state(self, mutable: bool = False) -> dict:
         """
         Get the initial board state
 
-        :return: A copy of the initial board state dictionary
+        :param mutable: True if you want to get a mutable copy, instead of a read-only view.
+        :return: The initial board state dictionary (read-only view, unless mutable is True)
         """
         if IS_DEBUG:  # Logging for debug
             self._logger.debug('Querying initial state...')
 
         # Check whether the game has been initialized or not.
         assert self._initial is not None, 'The board should be initialized. Did you run the evaluation code properly?'
-        # Return the initial state representation as a copy.
-        return deepcopy(self._initial)
+        # Return the initial state representation. A copy is made only when requested.
+        return thaw(self._initial) if mutable else self._initial
 
     def get_applicable_roads(self, player: int = None) -> List[Tuple[Tuple[int, int]]]:
         """
@@ -492,26 +1038,20 @@ class GameBoard:
             self._logger.debug('Querying applicable roads...')
 
         # Query the player's current building state
-        player = self._game.players[self._current_player if player is None else player]
+        player = self._current_player if player is None else player
 
         if not self._initial_phase:
-            path_count = count_building(self._game.board.paths.values(), player)
-
             # If the number of current road is 15, then we cannot build a road anymore.
-            if path_count[BuildingType.ROAD] >= 15:
+            if _popcount(self._owned_paths[player]) >= 15:
                 if IS_DEBUG:  # Logging for debug
                     self._logger.debug('All road blocks are already in use. You cannot construct it now.')
                 return []
 
-        # Read all applicable positions
-        applicable_positions = \
-            self._game.board.get_valid_road_coords(player,
-                                                   ensure_connected=not self._initial_phase)
-        # Make it to a basic python tuples
-        applicable_positions = [
-            tuple(sorted([coordinate_to_tuple(coord) for coord in coord_set]))
-            for coord_set in applicable_positions
-        ]
+        # Read all applicable positions from the legality bitsets
+        mask = self._free_paths
+        if not self._initial_phase:
+            mask &= self._connectable_edges(player)
+        applicable_positions = self._edges_of(mask)
 
         # Update memory usage
         self._update_memory_usage()
@@ -535,27 +1075,18 @@ class GameBoard:
             self._logger.debug(f'Querying applicable roads for {coord}...')
 
         # Query the player's current building state
-        player = self._game.players[self._current_player if player is None else player]
+        player = self._current_player if player is None else player
 
         if not self._initial_phase:
-            path_count = count_building(self._game.board.paths.values(), player)
-
             # If the number of current road is 15, then we cannot build a road anymore.
-            if path_count[BuildingType.ROAD] >= 15:
+            if _popcount(self._owned_paths[player]) >= 15:
                 if IS_DEBUG:  # Logging for debug
                     self._logger.debug('All road blocks are already in use. You cannot construct it now.')
                 return []
 
-        # Read all applicable positions
-        applicable_positions = \
-            self._game.board.get_valid_road_coords(player,
-                                                   connected_intersection=tuple_to_coordinate(coord),
-                                                   ensure_connected=True)
-        # Make it to a basic python tuples
-        applicable_positions = [
-            tuple(sorted([coordinate_to_tuple(coord) for coord in coord_set]))
-            for coord_set in applicable_positions
-        ]
+        # Read all applicable positions from the legality bitsets
+        mask = self._layout.node_edge_mask[self._layout.node_index[tuple(coord)]] & self._free_paths
+        applicable_positions = self._edges_of(mask & self._connectable_edges(player))
 
         # Update memory usage
         self._update_memory_usage()
@@ -574,25 +1105,21 @@ class GameBoard:
             (List of Coordinate tuples[Q, R].)
         """
         # Query the player's current building state
-        player = self._game.players[self._current_player if player is None else player]
+        player = self._current_player if player is None else player
 
         if not self._initial_phase:
-            village_count = count_building(self._game.board.intersections.values(), player)
-
             # If the number of current village is 5, then we cannot build a village anymore.
-            if village_count[BuildingType.SETTLEMENT] >= 5:
+            if self._node_codes.count(SETTLEMENT_CODE + player) >= 5:
                 if IS_DEBUG:  # Logging for debug
                     self._logger.debug('All village blocks are already in use. You cannot construct it now.')
                 return []
 
-        # Read all applicable positions
-        applicable_positions = \
-            self._game.board.get_valid_settlement_coords(player, ensure_connected=not self._initial_phase)
-        # Make it to a basic python tuples
-        applicable_positions = [
-            coordinate_to_tuple(coord)
-            for coord in applicable_positions
-        ]
+        # Read all applicable positions from the legality bitsets
+        mask = self._free_nodes
+        if not self._initial_phase:
+            # The village should be connected to the player's road.
+            mask &= self._road_nodes(player)
+        applicable_positions = self._nodes_of(mask)
 
         # Update memory usage
         self._update_memory_usage()
@@ -611,22 +1138,19 @@ class GameBoard:
             (List of Coordinate tuples[Q, R].)
         """
         # Query the player's current building state
-        player = self._game.players[self._current_player if player is None else player]
-        village_count = count_building(self._game.board.intersections.values(), player)
+        player = self._current_player if player is None else player
 
         # If the number of current city is 4, then we cannot build a city anymore.
-        if village_count[BuildingType.CITY] >= 4:
+        if self._node_codes.count(CITY_CODE + player) >= 4:
             if IS_DEBUG:  # Logging for debug
                 self._logger.debug('All city blocks are already in use. You cannot construct it now.')
             return []
 
-        # Read all applicable positions
-        applicable_positions = \
-            self._game.board.get_valid_city_coords(player)
-        # Make it to a basic python tuples
+        # Read all applicable positions: the player's villages can be upgraded.
         applicable_positions = [
-            coordinate_to_tuple(coord)
-            for coord in applicable_positions
+            self._layout.nodes[n]
+            for n, code in enumerate(self._node_codes)
+            if code == SETTLEMENT_CODE + player
         ]
 
         # Update memory usage
@@ -637,12 +1161,76 @@ class GameBoard:
         # Return applicable positions as list of tuples.
         return applicable_positions
 
+    def _nodes_of(self, mask: int) -> List[Tuple[int, int]]:
+        """
+        [PRIVATE] Convert a bitset of nodes into the list of node coordinates. Results are cached by the bitset.
+
+        :param mask: Bitset of nodes
+        :return: A new list of node coordinates
+        """
+        cache = self._mask_cache[1]
+        result = cache.get(mask, None)
+        if result is None:
+            if len(cache) >= MASK_CACHE_SIZE:
+                cache.clear()
+            result = cache[mask] = tuple(self._layout.nodes[n] for n in self._layout.bits(mask))
+        return list(result)
+
+    def _edges_of(self, mask: int) -> List[Tuple[Tuple[int, int]]]:
+        """
+        [PRIVATE] Convert a bitset of edges into the list of path coordinates. Results are cached by the bitset.
+
+        :param mask: Bitset of edges
+        :return: A new list of path coordinates
+        """
+        cache = self._mask_cache[2]
+        result = cache.get(mask, None)
+        if result is None:
+            if len(cache) >= MASK_CACHE_SIZE:
+                cache.clear()
+            result = cache[mask] = tuple(self._layout.paths[e] for e in self._layout.bits(mask))
+        return list(result)
+
+    def _road_nodes(self, player: int) -> int:
+        """
+        [PRIVATE] Compute the bitset of nodes that are endpoints of the player's roads.
+
+        :param player: Player index
+        :return: Bitset of nodes
+        """
+        mask = 0
+        for e in self._layout.bits(self._owned_paths[player]):
+            mask |= self._layout.edge_node_mask[e]
+        return mask
+
+    def _connectable_edges(self, player: int) -> int:
+        """
+        [PRIVATE] Compute the bitset of edges where the player's new road will be connected (Same rule as PyCatan).
+        A road is connected if one of its endpoints has the player's building,
+        or one of its empty endpoints has the player's road.
+
+        :param player: Player index
+        :return: Bitset of edges (including occupied edges)
+        """
+        anchors = self._owned_nodes[player] | (self._road_nodes(player) & ~self._occupied_nodes)
+        cache = self._mask_cache[3]
+        result = cache.get(anchors, None)
+        if result is None:
+            if len(cache) >= MASK_CACHE_SIZE:
+                cache.clear()
+            result = 0
+            for n in self._layout.bits(anchors):
+                result |= self._layout.node_edge_mask[n]
+            cache[anchors] = result
+        return result
+
     def get_resource_cards(self) -> Dict[str, int]:
         """
         Get the number of resource cards that you have.
 
         :return: Dictionary of resource to number of cards mapping.
         """
+        self._sync_game()
         resources = {
             str(res): count
             for res, count in self._game.players[self._player_number].resources.items()
@@ -662,6 +1250,7 @@ class GameBoard:
 
         :return: The length of the longest trading route for the player.
         """
+        self._sync_game()
         player = self._game.players[self._current_player if player is not None else player]
         long_route = self._game.board.calculate_player_longest_road(player)
         if IS_DEBUG:  # Logging for debug
@@ -680,6 +1269,7 @@ class GameBoard:
         If trading is impossible, then -1 will be given.
         """
         # Get all possible trade conditions
+        self._sync_game()
         trading_conds = self._game.players[self._current_player].get_possible_trades()
         # Filter out other resources
         resource = Resource[resource.upper()]
@@ -720,49 +1310,84 @@ class GameBoard:
         """
         :return: Current memory usage for the process having this board
         """
-        try:
-            return self._process_info.memory_info().rss
-        except NoSuchProcess:
-            if self._max_memory >= 0:
-                self._logger.warning('As tracking the process has been failed, '
-                                     'I turned off memory usage tracking ability.')
-                self._max_memory = -1
-            return -1
+        return self._memory.current()
 
     def get_max_memory_usage(self):
         """
-        :return: Maximum memory usage for the process having this board
+        :return: Maximum memory usage for the process having this board, since the last reset_max_memory_usage()
         """
-        return self._max_memory
+        return self._memory.peak()
 
-    def _update_memory_usage(self):
+    def reset_max_memory_usage(self):
         """
-        [PRIVATE] updating maximum memory usage
+        Reset the maximum memory usage to the current memory usage. ONLY for evaluation purposes.
+        [WARN] Don't access this method in your agent code.
         """
-        if self._max_memory >= 0:
-            self._max_memory = max(self._max_memory, self.get_current_memory_usage())
+        self._memory.reset()
 
-    def simulate_action(self, state: dict = None, *actions: Action) -> dict:
+    def limit_memory_usage(self, limit: int, on_exceed: Callable[[int], None]):
         """
-        Simulate given actions.
+        Enforce the memory limit on this process, from a background thread. ONLY for evaluation purposes.
+        [WARN] Don't access this method in your agent code.
 
-        Usage:
-            - `simulate_action(state, action1)` will execute a single action, `action1`
-            - `simulate_action(state, action1, action2)` will execute two consecutive actions, `action1` and `action2`
-            - ...
-            - `simulate_action(state, *action_list)` will execute actions in the order specified in the `action_list`
+        :param limit: Memory limit in bytes
+        :param on_exceed: Function to be called with the peak memory usage (in bytes), when the limit is exceeded.
+        """
+        self._memory.start_watchdog(limit, on_exceed)
 
-        :param state: State where the simulation starts from. If None, the simulation starts from the initial state.
-        :param actions: Actions to simulate or execute.
-        :return: The last state after simulating all actions
+    def enable_stats(self):
         """
-        if IS_DEBUG:  # Logging for debug
-            self._logger.debug(f'------- SIMULATION START: {actions} -------')
+        Start recording the statistics of API calls on this board: call counts and latencies of the methods
+        in STATS_METHODS, and the number of materialized states. The previous statistics are discarded.
+        Recording adds a small overhead to each call, so this is disabled by default.
+        """
+        self.disable_stats()
+        self._stats = BoardStats()
+        for name in STATS_METHODS:
+            # Replace the bound method of this instance only.
+            setattr(self, name, self._stats.timed(name, getattr(self, name)))
 
-        # Restore to the given state
-        self.set_to_state(state)
+    def disable_stats(self):
+        """
+        Stop recording the statistics of API calls. The recorded statistics are discarded.
+        """
+        if self._stats is None:
+            return
+        for name in STATS_METHODS:
+            self.__dict__.pop(name, None)
+        self._stats = None
+
+    def get_stats(self) -> dict:
+        """
+        Get the statistics of API calls, since enable_stats() was called.
+
+        :return: Dictionary of 'states_materialized' (the number of states built by the board) and 'methods'
+            (call count, cumulative and percentile latencies of each method, in the order of cumulative latency).
+            None if the statistics are not enabled.
+        """
+        return None if self._stats is None else self._stats.summary()
+
+    def _count_materialized(self, count: int = 1):
+        """
+        [PRIVATE] Count the states built by the board, if the statistics are enabled.
+        """
+        if self._stats is not None:
+            self._stats.states_materialized += count
+
+    def _update_memory_usage(self):
+        """
+        [PRIVATE] updating maximum memory usage.
+        The kernel keeps track of the peak, so this samples the memory usage only when the peak cannot be tracked.
+        """
+        if self._memory.needs_sampling():
+            self._memory.sample()
+
+    def _check_actions(self, actions):
+        """
+        [PRIVATE] Check whether the given sequence of actions can be simulated at once.
 
-        # Check whether these actions are valid
+        :param actions: Actions to simulate or execute.
+        """
         if self._initial_phase:
             if len(actions) > 2:
                 raise ValueError('On the initial phase, you can simulate at most two actions.')
@@ -772,6 +1397,12 @@ class GameBoard:
             if len(actions) == 1 and not isinstance(actions[0], (VILLAGE, ROAD, PASS)):
                 raise ValueError('You need to execute VILLAGE, ROAD, or PASS actions during the initial phase')
 
+    def _run_actions(self, actions):
+        """
+        [PRIVATE] Run the given actions on the current board.
+
+        :param actions: Actions to execute.
+        """
         for act in actions:  # For each actions in the variable arguments,
             try:
                 # Run actions through calling each action object
@@ -784,10 +1415,157 @@ class GameBoard:
             if not self._initial_phase and self.is_game_end():
                 break
 
+    def apply(self, *actions: Action, as_delta: bool = False):
+        """
+        Apply given actions on the current board, without restoring or copying the whole board.
+        Only the nodes and paths touched by the actions are changed, and the change can be reverted by calling undo().
+        This is useful for walking a search tree in depth-first order.
+
+        Usage:
+            - `apply(village, road)` will execute two consecutive actions, and return the resulting CompactState.
+            - `apply(PASS(), as_delta=True)` will execute PASS action, and return the StateDelta.
+            - `undo()` will revert the last apply() call.
+
+        :param actions: Actions to execute. The same restrictions of simulate_action() are applied.
+        :param as_delta: True if you want to get the difference (StateDelta) instead of the full state.
+        :return: The CompactState after applying all actions, or the StateDelta if as_delta is True.
+        """
+        assert self._undo_stack is not None, 'The board should be initialized. Did you run the evaluation code properly?'
+        if IS_DEBUG:  # Logging for debug
+            self._logger.debug(f'------- APPLY: {actions} -------')
+
+        self._check_actions(actions)
+
+        # Record everything that the actions can touch.
+        nodes = {}
+        paths = {}
+        harbors = {}
+        for act in actions:
+            if isinstance(act, (VILLAGE, UPGRADE)):
+                nodes.setdefault(act.node, self._node_building(act.node))
+                harbors.setdefault(act.player_id, self._connected_harbors(act.player_id))
+            elif isinstance(act, ROAD):
+                paths.setdefault(act.edge, self._path_building(act.edge))
+
+        resources = None
+        if not self._initial_phase:  # Resources can be changed only after the initial phase
+            resources = [dict(p.resources) for p in self._game.players]
+
+        record = (self._current_player, self._setup_order, self._game.longest_road_owner,
+                  nodes, paths, harbors, resources)
+        self._undo_stack.append(record)
+
+        # Run the actions
+        self._run_actions(actions)
+        self._current_is_stale = True
+
+        # Update memory usage
+        self._update_memory_usage()
+
+        if as_delta:
+            return self._delta_of(record)
+        return self.get_compact_state()
+
+    def undo(self, as_delta: bool = False):
+        """
+        Revert the last apply() call.
+
+        :param as_delta: True if you want to get the difference (StateDelta) instead of the full state.
+        :return: The CompactState after reverting, or the StateDelta (from the reverted state) if as_delta is True.
+        """
+        if not self._undo_stack:
+            raise ValueError('There is no applied action to undo.')
+        if IS_DEBUG:  # Logging for debug
+            self._logger.debug('------- UNDO -------')
+
+        record = self._undo_stack.pop()
+        delta = self._delta_of(record) if as_delta else None
+        current_player, setup_order, longest_road_owner, nodes, paths, harbors, resources = record
+
+        for c, building in nodes.items():
+            self._set_node_building(c, building)
+            self._node_changed(c)
+        for c, building in paths.items():
+            self._set_path_building(c, building)
+            self._path_changed(c)
+        for p, connected in harbors.items():
+            self._set_connected_harbors(p, connected)
+        if resources is not None:
+            for player, res in zip(self._game.players, resources):
+                player.resources = res
+            self._resources_changed()
+
+        self._current_player = current_player
+        self._setup_order = setup_order
+        self._game.longest_road_owner = longest_road_owner
+        self._current_is_stale = True
+
+        if as_delta:
+            return StateDelta(delta.new_player, delta.old_player,
+                              tuple((i, new, old) for i, old, new in delta.nodes),
+                              tuple((i, new, old) for i, old, new in delta.paths))
+        return self.get_compact_state()
+
+    def _delta_of(self, record) -> StateDelta:
+        """
+        [PRIVATE] Compute the difference between the recorded state and the current board.
+
+        :param record: An undo record pushed by apply()
+        :return: StateDelta from the recorded state to the current board
+        """
+        current_player, _, _, nodes, paths, _, _ = record
+        node_changes = []
+        for c, building in nodes.items():
+            index = self._layout.node_index[coordinate_to_tuple(c)]
+            old = self._code_of(building)
+            if old != self._node_codes[index]:
+                node_changes.append((index, old, self._node_codes[index]))
+
+        path_changes = []
+        for c, building in paths.items():
+            index = self._layout.path_index[tuple(sorted(coordinate_to_tuple(x) for x in c))]
+            old = self._code_of(building)
+            if old != self._path_codes[index]:
+                path_changes.append((index, old, self._path_codes[index]))
+
+        return StateDelta(current_player, self._current_player, tuple(node_changes), tuple(path_changes))
+
+    def simulate_action(self, state: dict = None, *actions: Action, mutable: bool = False) -> dict:
+        """
+        Simulate given actions.
+
+        Usage:
+            - `simulate_action(state, action1)` will execute a single action, `action1`
+            - `simulate_action(state, action1, action2)` will execute two consecutive actions, `action1` and `action2`
+            - ...
+            - `simulate_action(state, *action_list)` will execute actions in the order specified in the `action_list`
+
+        :param state: State where the simulation starts from. If None, the simulation starts from the initial state.
+            If a CompactState is given, the result will also be a CompactState.
+        :param actions: Actions to simulate or execute.
+        :param mutable: True if you want to get a mutable copy, instead of a read-only view.
+        :return: The last state after simulating all actions (read-only view, unless mutable is True)
+        """
+        if IS_DEBUG:  # Logging for debug
+            self._logger.debug(f'------- SIMULATION START: {actions} -------')
+
+        # Restore to the given state
+        self.set_to_state(state)
+
+        # Check whether these actions are valid, and run them.
+        self._check_actions(actions)
+        self._run_actions(actions)
+        self._current_is_stale = False
+
         # Copy the current state to return
-        self._current = _read_state(self._game, self._player_number, self._current_player)
+        if isinstance(state, CompactState):
+            self._current = self.get_compact_state()
+        else:
+            self._current = self._read_current_state()
+            self._count_materialized()
 
         if IS_DEBUG:  # Logging for debug
+            self._sync_game()
             self._logger.debug('State has been changed to: \n' + _unique_game_state_identifier(self._game))
             self._renderer.render_board()
             self._logger.debug('------- SIMULATION ENDS -------')
@@ -795,7 +1573,87 @@ class GameBoard:
         # Update memory usage
         self._update_memory_usage()
 
-        return deepcopy(self._current)
+        if isinstance(self._current, CompactState):
+            return self._current
+        return thaw(self._current) if mutable else self._current
+
+    def simulate_many(self, state: dict = None, action_tuples: List[Tuple[Action, ...]] = (), lazy: bool = False):
+        """
+        Simulate several alternatives of actions from the same state.
+        The board is restored to the given state only once, and each alternative is applied and reverted locally.
+
+        Usage:
+            - `simulate_many(state, [(village1, road1), (village2, road2)])` will give you the list of two children.
+            - `simulate_many(state, action_tuples, lazy=True)` will give you a generator of the children.
+              (The board is restored again, if you move the board while iterating the generator.)
+
+        :param state: State where the simulations start from. If None, the simulations start from the initial state.
+            If a CompactState is given, the results will also be CompactStates.
+        :param action_tuples: Tuples of actions. Each tuple is simulated in the same way as simulate_action().
+        :param lazy: True if you want to get a generator instead of a list.
+        :return: List (or generator) of the last states after simulating each tuple of actions.
+            The resulting views share the unchanged sections with each other.
+        """
+        children = self._simulate_many(state, action_tuples)
+        return children if lazy else list(children)
+
+    def _simulate_many(self, state, action_tuples):
+        """
+        [PRIVATE] Generator for simulate_many().
+        """
+        if IS_DEBUG:  # Logging for debug
+            self._logger.debug(f'------- BATCH SIMULATION START: {len(action_tuples)} alternatives -------')
+
+        # Restore to the given state, once.
+        self.set_to_state(state)
+        is_compact = isinstance(state, CompactState)
+        # Children share the unchanged sections with this private copy of the parent.
+        parent = None if is_compact else self._read_current_state()
+        self._count_materialized(0 if is_compact else 1)  # (Compact states are counted by get_compact_state())
+
+        for actions in action_tuples:
+            delta = self.apply(*actions, as_delta=True)
+            record = self._undo_stack[-1]
+
+            child = self.get_compact_state() if is_compact else self._patch_state(parent, delta)
+            self._count_materialized(0 if is_compact else 1)
+
+            yield child
+
+            if self._undo_stack and self._undo_stack[-1] is record:
+                self.undo()
+            else:  # The board has been moved while the caller used the child. Restore it again.
+                self.set_to_state(state)
+
+        # Update memory usage
+        self._update_memory_usage()
+
+    def _patch_state(self, parent: dict, delta: StateDelta) -> dict:
+        """
+        [PRIVATE] Build the state dictionary of the current board, by patching the changed places of the parent.
+        Unchanged sections of the board are shared with the parent. The player section is read again.
+
+        :param parent: State dictionary of the parent state
+        :param delta: StateDelta from the parent to the current board
+        :return: State dictionary of the current board
+        """
+        board = dict(parent['board'])
+        if delta.nodes:
+            intersections = dict(board['intersections'])
+            for i, _, code in delta.nodes:
+                intersections[self._layout.nodes[i]] = node_entry(code)
+            board['intersections'] = StateView(intersections)
+        if delta.paths:
+            paths = dict(board['paths'])
+            for i, _, code in delta.paths:
+                paths[self._layout.paths[i]] = path_entry(code)
+            board['paths'] = StateView(paths)
+
+        child = dict(parent, board=StateView(board), current_player=self._current_player, state_hash=self._hash,
+                     player=self._engine.read_players() if self._engine is not None else
+                     freeze(_read_players(self._game)))
+        child['state_id'] = state_identifier(child)
+        return StateView(child)
 
     def diversity_of_place(self, coord: Tuple[int, int]) -> set:
         """
@@ -809,9 +1667,7 @@ class GameBoard:
         :return: The set of resource types (hex tile types) neighboring the given position
         """
 
-        return {r.name
-                for r, c in self._game.board.get_hex_resources_for_intersection(tuple_to_coordinate(coord)).items()
-                if c > 0}
+        return self._layout.node_resources(self._layout.node_index[tuple(coord)])
 
     def diversity_of_road(self, path_coord: Tuple[Tuple[int, int]]) -> set:
         """
@@ -827,6 +1683,17 @@ class GameBoard:
 
         return self.diversity_of_place(path_coord[0]).union(self.diversity_of_place(path_coord[1]))
 
+    def resources_of_place(self, coord: Tuple[int, int]) -> Dict[str, int]:
+        """
+        Count the resources neighboring the given place.
+        Here, the count is the number of hex tiles that produce each resource, neighboring the given position.
+
+        :param coord: Coordinate to evaluate.
+        :return: Dictionary of resource name and the number of neighboring hex tiles producing it.
+        """
+
+        return dict(self._layout.node_resource_counts[self._layout.node_index[tuple(coord)]])
+
     def diversity_of_state(self, state: dict = None) -> int:
         """
         Evaluate the diversity of given state.
@@ -840,6 +1707,7 @@ class GameBoard:
         """
         # Restore to the given state
         self.set_to_state(state)
+        self._sync_game()  # (The yields are computed by PyCatan.)
 
         # Get the current number of cards
         player = self._game.players[self._current_player]
@@ -864,9 +1732,37 @@ class GameBoard:
         # Return evaluation result
         return len(hex_types)
 
+    def diversity_of_places(self, coords: List[Tuple[int, int]] = None, pairs: bool = False, player: int = None):
+        """
+        Evaluate the diversity of many places at once. This requires NumPy.
+        Here, the diversity is the number of resource types (hex tile types) neighboring the given positions.
+
+        Usage:
+            - `diversity_of_places()` will give you the diversity scores of all nodes.
+            - `diversity_of_places(coords, pairs=True)[i, j]` will give you the diversity score of taking both
+              `coords[i]` and `coords[j]`.
+
+        :param coords: Coordinates to evaluate. If None, all nodes are evaluated (in the order of the state dictionary).
+        :param pairs: If True, evaluate every pair of the given positions.
+        :param player: If given, the resource types near the existing villages of the player are also counted.
+        :return: NumPy array of the diversity scores. The shape is (N,), or (N, N) if pairs is True.
+        """
+        layout = self._layout
+        if coords is None:
+            masks = layout.node_type_mask
+        else:
+            masks = [layout.node_type_mask[layout.node_index[tuple(c)]] for c in coords]
+
+        base_mask = 0
+        if player is not None:
+            for node in layout.bits(self._owned_nodes[player]):
+                base_mask |= layout.node_type_mask[node]
+
+        return batch_diversity(masks, pairs=pairs, base_mask=base_mask)
+
     def get_player_id(self):
         return self._player_number
 
 
 # Export only GameBoard and RESOURCES.
-__all__ = ['GameBoard', 'RESOURCES', 'IS_DEBUG', 'IS_RUN']
+__all__ = ['GameBoard', 'CompactState', 'RESOURCES', 'BACKENDS', 'IS_DEBUG', 'IS_RUN']
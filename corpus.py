@@ -0,0 +1,258 @@
+# Package for command line options
+import argparse
+# Memory-mapped file access
+import mmap
+import random
+# Binary packing of the file header
+import struct
+# Safe parser for the template section
+from ast import literal_eval
+from pathlib import Path
+from typing import Iterable, Iterator, List, Union
+
+# Import some class definitions that implements the Settlers of Catan game.
+from pycatan import Resource
+from pycatan.board import HexType
+
+# Package for problem definitions
+from board import GameBoard
+# Import state utilities
+from state import freeze, thaw, stable_hash, state_identifier, static_signature
+
+
+#: Magic bytes at the beginning of a corpus file (the last byte is the format version)
+CORPUS_MAGIC = b'CATCORP\x01'
+#: Header of a corpus file: magic, the number of boards, size of a record, size of the template (little endian)
+CORPUS_HEADER = struct.Struct('<8sIII')
+#: Random seed of the corpus (the same seed as the evaluation)
+CORPUS_SEED = 5606
+#: The number of boards to generate by default
+CORPUS_BOARDS = 1000
+#: Code of "no dice token" (the desert) and "generic harbor" in a record
+NO_CODE = 0
+
+
+def generate_states(boards: int = CORPUS_BOARDS, seed: int = CORPUS_SEED) -> Iterator[dict]:
+    """
+    Generate initial states of random boards. The same seed always gives the same boards.
+
+    :param boards: The number of boards to generate
+    :param seed: Random seed
+    :return: A generator of initial states
+    """
+    seeded = random.Random(seed).getstate()
+    generator = GameBoard()
+    for _ in range(boards):
+        # Generate a board with the seeded sequence, without disturbing the global random generator of the caller.
+        caller = random.getstate()
+        random.setstate(seeded)
+        try:
+            generator._initialize()
+        finally:
+            seeded = random.getstate()
+            random.setstate(caller)
+        yield generator.get_initial_state()
+
+
+def _template_of(state: dict) -> dict:
+    """
+    [PRIVATE] Build the template of a corpus from a state: the sections shared by all initial states,
+    and the order of the hexes and harbors in a record.
+    """
+    state = thaw(state)
+    board = state['board']
+    return {
+        'hexes': sorted(board['hexes']),
+        'harbors': sorted(board['harbors']),
+        'current_player': state['current_player'],
+        'intersections': board['intersections'],
+        'paths': board['paths'],
+        'player': state['player'],
+    }
+
+
+def _encode(state: dict, template: dict) -> bytes:
+    """
+    [PRIVATE] Encode the board-specific sections of an initial state into a record.
+    A record consists of (hex type, dice token) for each hex, harbor resource for each harbor,
+    index of the robber hex, and the player ID.
+    """
+    board = state['board']
+    if sorted(board['hexes']) != template['hexes'] or sorted(board['harbors']) != template['harbors']:
+        raise ValueError('All boards in a corpus should have the same hex and harbor coordinates.')
+    if state['current_player'] != template['current_player'] or thaw(state['player']) != template['player'] or \
+            thaw(board['intersections']) != template['intersections'] or thaw(board['paths']) != template['paths']:
+        raise ValueError('A corpus can only contain initial states (no buildings and no resources).')
+
+    record = bytearray()
+    for c in template['hexes']:
+        h = board['hexes'][c]
+        record += bytes((HexType[h['type']].value, NO_CODE if h['dice'] is None else h['dice']))
+    for p in template['harbors']:
+        resource = board['harbors'][p]['type']
+        record.append(NO_CODE if resource is None else Resource[resource].value + 1)
+    record.append(template['hexes'].index(tuple(state['robber'])))
+    record.append(state['player_id'])
+    return bytes(record)
+
+
+def _decode(record: bytes, template: dict) -> dict:
+    """
+    [PRIVATE] Decode a record into an initial state, using the template of the corpus.
+    """
+    num_hexes = len(template['hexes'])
+    hexes = {
+        c: {'type': HexType(record[2 * k]).name, 'dice': None if record[2 * k + 1] == NO_CODE else record[2 * k + 1]}
+        for k, c in enumerate(template['hexes'])
+    }
+    harbors = {
+        p: {'type': None if code == NO_CODE else Resource(code - 1).name}
+        for p, code in zip(template['harbors'], record[2 * num_hexes:])
+    }
+
+    board = {
+        'hexes': hexes,
+        'intersections': template['intersections'],
+        'paths': template['paths'],
+        'harbors': harbors,
+    }
+    state = {
+        'state_id': None,
+        # An initial state has no buildings and no resources, so its hash is the key of the board itself.
+        'state_hash': stable_hash(static_signature(board)),
+        'player_id': record[-1],
+        'current_player': template['current_player'],
+        'board': board,
+        'player': template['player'],
+        'robber': template['hexes'][record[-2]]
+    }
+    state['state_id'] = state_identifier(state)
+    return freeze(state)
+
+
+def write_corpus(path: Union[str, Path], states: Iterable[dict]) -> int:
+    """
+    Write initial states into a corpus file.
+
+    :param path: Path of the corpus file
+    :param states: Initial states of boards which have the same geometry (e.g., from generate_states())
+    :return: The number of boards written
+    """
+    states = iter(states)
+    first = next(states, None)
+    if first is None:
+        raise ValueError('A corpus should contain at least one board.')
+
+    template = _template_of(first)
+    records = []
+    for state in [first] + list(states):
+        record = _encode(state, template)
+        # Round-trip check: the loaded board should be the same board, as its state_id seeds the opponents.
+        decoded = _decode(record, template)
+        if decoded['state_id'] != state['state_id'] or decoded['state_hash'] != state['state_hash']:
+            raise ValueError(f'A state cannot be restored from its record: {state["state_id"]}')
+        records.append(record)
+    template = repr(template).encode()
+
+    with Path(path).open('wb') as fp:
+        fp.write(CORPUS_HEADER.pack(CORPUS_MAGIC, len(records), len(records[0]), len(template)))
+        fp.write(template)
+        fp.write(b''.join(records))
+    return len(records)
+
+
+class BoardCorpus:
+    """
+    Corpus of initial states, loaded from a corpus file by memory-mapping.
+    Opening a corpus reads only the header, and each state is decoded when it is accessed.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Open a corpus file.
+
+        :param path: Path of the corpus file
+        """
+        #: [PRIVATE] File object and its memory map
+        self._file = Path(path).open('rb')
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, record_size, template_size = CORPUS_HEADER.unpack_from(self._buffer)
+        if magic != CORPUS_MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a corpus file (or made by a different version).')
+
+        #: The number of boards in this corpus
+        self.count: int = count
+        #: [PRIVATE] Size of a record in bytes
+        self._record_size = record_size
+        #: [PRIVATE] Offset of the first record
+        self._offset = CORPUS_HEADER.size + template_size
+        #: [PRIVATE] Template of the states. The shared sections are read-only views, shared by all decoded states.
+        self._template = literal_eval(self._buffer[CORPUS_HEADER.size:self._offset].decode())
+        for key in ('intersections', 'paths', 'player'):
+            self._template[key] = freeze(self._template[key])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> dict:
+        """
+        Decode the initial state of a board.
+
+        :param index: Index of the board
+        :return: Initial state (read-only view)
+        """
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(f'Board index out of range: {index}')
+
+        begin = self._offset + index * self._record_size
+        return _decode(self._buffer[begin:begin + self._record_size], self._template)
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self[i] for i in range(self.count))
+
+    def close(self):
+        """
+        Close the memory map and the file.
+        """
+        self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load_states(path: Union[str, Path], boards: int = None) -> List[dict]:
+    """
+    Load initial states from a corpus file.
+
+    :param path: Path of the corpus file
+    :param boards: The number of boards to load from the beginning. If None, load all boards.
+    :return: List of initial states
+    """
+    with BoardCorpus(path) as corpus:
+        if boards is not None and boards > len(corpus):
+            raise ValueError(f'The corpus has only {len(corpus)} boards, but {boards} boards are requested.')
+        return [corpus[i] for i in range(len(corpus) if boards is None else boards)]
+
+
+# Main function
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a corpus file of initial states.')
+    parser.add_argument('output', type=Path, help='Path of the corpus file')
+    parser.add_argument('--boards', type=int, default=CORPUS_BOARDS, help='The number of boards to generate')
+    parser.add_argument('--seed', type=int, default=CORPUS_SEED, help='Random seed of the boards')
+    args = parser.parse_args()
+
+    written = write_corpus(args.output, generate_states(args.boards, args.seed))
+    print(f'{written} boards are written to {args.output} ({args.output.stat().st_size} bytes).')
+
+
+# Export the corpus functions
+__all__ = ['BoardCorpus', 'generate_states', 'write_corpus', 'load_states', 'CORPUS_SEED', 'CORPUS_BOARDS']
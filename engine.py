@@ -0,0 +1,331 @@
+# Package for command line options
+import argparse
+import random
+import sys
+# Type specification for Python code
+from typing import List, Optional, Tuple, Union
+
+# Import some class definitions that implements the Settlers of Catan game.
+from pycatan.board import HexType
+
+# Import compact state representations
+from state import CompactState, StateView, StateList, RESOURCE_ORDER, EMPTY, SETTLEMENT_CODE, CITY_CODE, ROAD_CODE, \
+    node_entry, path_entry, state_identifier
+# Import the static topology index
+from topology import BoardTopology
+
+
+#: Entries of the intersection section, for each node occupancy code. (Read-only views are shared by all states.)
+NODE_ENTRIES = tuple(node_entry(code) for code in range(CITY_CODE + 4))
+#: Entries of the path section, for each path occupancy code
+PATH_ENTRIES = tuple(path_entry(code) for code in range(ROAD_CODE + 4))
+#: The number of random boards in a cross-check by default
+CHECK_BOARDS = 50
+#: Random seed of the cross-check by default (the same seed as the evaluation)
+CHECK_SEED = 5606
+#: Probability of trying a random (possibly illegal) action instead of a legal one, in a cross-check
+ILLEGAL_RATE = 0.2
+
+
+class SetupEngine:
+    """
+    Rules engine for the initial placement phase (VILLAGE, ROAD and PASS), independent of PyCatan.
+    Buildings are stored as occupancy codes in flat arrays indexed by the node and path IDs of a BoardTopology,
+    so building and restoring a state does not create any PyCatan object.
+    The rules are the same as PyCatan's, without connectivity and resource checks (as in the initial phase):
+    a village needs an empty node with empty neighbors (distance rule), and a road needs an empty path.
+    """
+
+    def __init__(self, layout: BoardTopology):
+        """
+        Build an empty board.
+
+        :param layout: Topology index of the board
+        """
+        #: Topology index of the board
+        self.layout = layout
+        #: Occupancy code of each node
+        self.node_codes = bytearray(layout.num_nodes)
+        #: Occupancy code of each path
+        self.path_codes = bytearray(layout.num_paths)
+        #: Resource counts of the players (player-major, ordered by RESOURCE_ORDER)
+        self.resources = bytearray(4 * len(RESOURCE_ORDER))
+        #: Bitset of the connected harbors (indexed as harbor_paths), for each player
+        self.harbors = [0] * 4
+        #: Bitset of the occupied nodes
+        self.occupied = 0
+        #: Coordinate of the hex where the robber is
+        self.robber: Optional[Tuple[int, int]] = layout.robber if layout.robber is not None else self._desert()
+
+        #: Path coordinates of the harbors, ordered by their index
+        self.harbor_paths = tuple(layout.harbors.keys())
+        #: [PRIVATE] Mapping from harbor path coordinate to its index
+        self._harbor_index = {h: k for k, h in enumerate(self.harbor_paths)}
+        #: [PRIVATE] Bitset of the harbors on each node
+        self._node_harbors = tuple(
+            sum(1 << k for k, h in enumerate(self.harbor_paths) if c in h)
+            for c in layout.nodes
+        )
+
+    def _desert(self) -> Optional[Tuple[int, int]]:
+        """
+        [PRIVATE] Find the desert hex, where the robber is at the beginning (the same as PyCatan).
+        """
+        return next((c for c, t in zip(self.layout.hex_coords, self.layout.hex_types) if t == HexType.DESERT.name),
+                    None)
+
+    def build_village(self, player: int, coord: Tuple[int, int]) -> int:
+        """
+        Build a village, without checking connectivity and resources.
+
+        :param player: Player index
+        :param coord: Node coordinate (Q, R)
+        :return: Index of the node
+        """
+        node = self.layout.node_index.get(coord, None)
+        if node is None:
+            raise ValueError(f'{coord} is not an intersection of this board.')
+        if self.node_codes[node] != EMPTY:
+            raise ValueError('There is already a building on this intersection.')
+        if self.occupied & self.layout.node_block_mask[node]:
+            raise ValueError('There is a building that is not at least 2 paths away from this position.')
+
+        self.node_codes[node] = SETTLEMENT_CODE + player
+        self.occupied |= 1 << node
+        self.harbors[player] |= self._node_harbors[node]
+        return node
+
+    def build_road(self, player: int, path: Tuple[Tuple[int, int], Tuple[int, int]]) -> int:
+        """
+        Build a road, without checking connectivity and resources.
+
+        :param player: Player index
+        :param path: Path coordinate, i.e., ((Q1, R1), (Q2, R2)) in sorted order
+        :return: Index of the path
+        """
+        edge = self.layout.path_index.get(path, None)
+        if edge is None:
+            raise ValueError(f'{path} is not a path of this board.')
+        if self.path_codes[edge] != EMPTY:
+            raise ValueError('There is already a building on this path.')
+
+        self.path_codes[edge] = ROAD_CODE + player
+        return edge
+
+    def set_node(self, node: int, code: int):
+        """
+        Put an occupancy code on a node directly (e.g., for reverting a change). Connected harbors are not changed.
+
+        :param node: Index of the node
+        :param code: Occupancy code
+        """
+        self.node_codes[node] = code
+        if code == EMPTY:
+            self.occupied &= ~(1 << node)
+        else:
+            self.occupied |= 1 << node
+
+    def set_path(self, edge: int, code: int):
+        """
+        Put an occupancy code on a path directly (e.g., for reverting a change).
+
+        :param edge: Index of the path
+        :param code: Occupancy code
+        """
+        self.path_codes[edge] = code
+
+    def restore(self, state: Union[dict, CompactState]) -> Tuple[int, int]:
+        """
+        Restore the board to the given state.
+        Like PyCatan, the connected harbors and the robber are read from a state dictionary, while a compact state
+        keeps the robber and recomputes the connected harbors from the buildings.
+
+        :param state: State dictionary or CompactState on this board
+        :return: Tuple of the player ID and the current player of the state
+        """
+        compact = state
+        if not isinstance(state, CompactState):
+            board = state['board']
+            if board['hexes'] is not self.layout.hexes:
+                assert board['hexes'] == self.layout.hexes, 'The hex information is different!'
+            if board['harbors'] is not self.layout.harbors:
+                assert board['harbors'] == self.layout.harbors, 'Harbor information is different!'
+            compact = CompactState.from_dict(self.layout, state)
+
+        self.node_codes[:] = compact.nodes
+        self.path_codes[:] = compact.paths
+        self.resources[:] = compact.resources
+        self.occupied = sum(1 << n for n, code in enumerate(self.node_codes) if code != EMPTY)
+
+        if compact is state:
+            self.harbors = [0] * 4
+            for n in self.layout.bits(self.occupied):
+                code = self.node_codes[n]
+                self.harbors[code - (CITY_CODE if code >= CITY_CODE else SETTLEMENT_CODE)] |= self._node_harbors[n]
+        else:
+            self.harbors = [
+                sum(1 << self._harbor_index[tuple(h)] for h in state['player'][p]['harbors'])
+                for p in range(4)
+            ]
+            self.robber = tuple(state['robber']) if 'robber' in state else self._desert()
+
+        return compact.player_id, compact.current_player
+
+    def to_compact(self, player_id: int, current_player: int) -> CompactState:
+        """
+        :param player_id: The agent's Player ID
+        :param current_player: Currently playing Player's ID
+        :return: CompactState of the current board
+        """
+        return CompactState.build(player_id, current_player, self.node_codes, self.path_codes, self.resources)
+
+    def read_players(self) -> dict:
+        """
+        :return: The player section of the state dictionary (read-only view)
+        """
+        size = len(RESOURCE_ORDER)
+        return StateView({
+            p: StateView(
+                resources=StateView(zip(RESOURCE_ORDER, self.resources[p * size:(p + 1) * size])),
+                harbors=StateList(self.harbor_paths[k] for k in self.layout.bits(self.harbors[p]))
+            )
+            for p in range(4)
+        })
+
+    def read_state(self, player_id: int, current_player: int, state_hash: int = None) -> dict:
+        """
+        Read the current state dictionary, which is the same as the one read from a PyCatan board.
+        The static sections are shared with the layout, and the entries of nodes and paths are shared views.
+
+        :param player_id: The agent's Player ID
+        :param current_player: Currently playing Player's ID
+        :param state_hash: 64-bit hash of the current state, maintained by the GameBoard.
+        :return: State dictionary (read-only view)
+        """
+        layout = self.layout
+        state = {
+            'state_id': None,
+            'state_hash': state_hash,
+            'player_id': player_id,
+            'current_player': current_player,
+            'board': StateView(
+                hexes=layout.hexes,
+                intersections=StateView(zip(layout.nodes, map(NODE_ENTRIES.__getitem__, self.node_codes))),
+                paths=StateView(zip(layout.paths, map(PATH_ENTRIES.__getitem__, self.path_codes))),
+                harbors=layout.harbors
+            ),
+            'player': self.read_players(),
+            'robber': self.robber
+        }
+        state['state_id'] = state_identifier(state)
+        return StateView(state)
+
+
+def _difference(expected: dict, actual: dict) -> Optional[str]:
+    """
+    [PRIVATE] Compare two state dictionaries. The order of connected harbors is ignored (PyCatan keeps them in a set).
+
+    :return: Name of the first different section, or None if the states are the same.
+    """
+    for key in ('state_id', 'state_hash', 'player_id', 'current_player', 'robber'):
+        if expected.get(key) != actual.get(key):
+            return key
+    for key in ('hexes', 'intersections', 'paths', 'harbors'):
+        if expected['board'][key] != actual['board'][key]:
+            return f'board.{key}'
+    for p in range(4):
+        if expected['player'][p]['resources'] != actual['player'][p]['resources']:
+            return f'player.{p}.resources'
+        if sorted(expected['player'][p]['harbors']) != sorted(actual['player'][p]['harbors']):
+            return f'player.{p}.harbors'
+    return None
+
+
+def cross_check(boards: int = CHECK_BOARDS, seed: int = CHECK_SEED) -> Tuple[int, List[str]]:
+    """
+    Differential test of the engine against PyCatan. On each random board, two GameBoards (one with each backend)
+    play the same random initial placement, including illegal actions. After each step, the states, hashes,
+    legal moves, apply()/undo() results, and the legality of every node and path (asked to the PyCatan board)
+    are compared.
+
+    :param boards: The number of random boards
+    :param seed: Random seed of the boards and the actions
+    :return: Tuple of the number of comparisons and the list of mismatches
+    """
+    # (Imported here, as the board module uses this module as a backend.)
+    from action import VILLAGE, ROAD, PASS
+    from board import GameBoard
+    from corpus import generate_states
+    from util import tuple_to_coordinate, tuple_to_path_coordinate
+
+    rng = random.Random(seed)
+    checks, mismatches = 0, []
+
+    def _check(name, expected, actual):
+        nonlocal checks
+        checks += 1
+        if expected != actual:
+            mismatches.append(f'Board #{index}, {name}: expected {expected}, got {actual}')
+
+    for index, initial in enumerate(generate_states(boards, seed)):
+        reference = GameBoard.from_state(initial)
+        candidate = GameBoard.from_state(initial)
+        candidate.set_backend('engine')
+        layout = candidate._layout
+        engine = candidate._engine
+
+        state = reference.get_initial_state()
+        _check('initial state', None, _difference(state, candidate.get_initial_state()))
+        for player in reference.get_remaining_setup_order():
+            child = reference.simulate_action(state, PASS())
+            _check('PASS', None, _difference(child, candidate.simulate_action(state, PASS())))
+            state = child
+
+            # Legality of every node and path: the engine's rule against PyCatan's rule (of the initial phase).
+            game = reference._game
+            villages = reference.get_applicable_villages()
+            _check('applicable villages', villages, candidate.get_applicable_villages())
+            _check('village legality', [
+                game.board.is_valid_settlement_coords(game.players[player], tuple_to_coordinate(c), False)
+                for c in layout.nodes
+            ], [not engine.occupied & layout.node_block_mask[n] for n in range(layout.num_nodes)])
+            _check('road legality', [
+                game.board.is_valid_road_coords(game.players[player], tuple_to_path_coordinate(c), False)
+                for c in layout.paths
+            ], [code == EMPTY for code in engine.path_codes])
+
+            # Choose a village and a road. Sometimes, they are random (and possibly illegal) places.
+            village = rng.choice(layout.nodes if rng.random() < ILLEGAL_RATE else villages)
+            roads = reference.get_applicable_roads_from(village) if village in villages else []
+            road = rng.choice(layout.paths if rng.random() < ILLEGAL_RATE or not roads else roads)
+            actions = VILLAGE(player, village), ROAD(player, road)
+
+            # apply() and undo() should change the board in the same way.
+            _check(f'apply{actions}', reference.apply(*actions), candidate.apply(*actions))
+            _check(f'undo{actions}', reference.undo(as_delta=True), candidate.undo(as_delta=True))
+
+            child = reference.simulate_action(state, *actions)
+            _check(f'simulate{actions}', None, _difference(child, candidate.simulate_action(state, *actions)))
+            state = child
+
+        _check('diversity', reference.diversity_of_state(state), candidate.diversity_of_state(state))
+
+    return checks, mismatches
+
+
+# Main function
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cross-check the setup engine against PyCatan on random boards.')
+    parser.add_argument('--boards', type=int, default=CHECK_BOARDS, help='The number of random boards')
+    parser.add_argument('--seed', type=int, default=CHECK_SEED, help='Random seed of the boards and the actions')
+    args = parser.parse_args()
+
+    total, failed = cross_check(args.boards, args.seed)
+    for message in failed:
+        print(f'[MISMATCH] {message}')
+    print(f'{total} comparisons on {args.boards} boards: {len(failed)} mismatch(es).')
+    sys.exit(1 if failed else 0)
+
+
+# Export the setup engine
+__all__ = ['SetupEngine', 'cross_check']
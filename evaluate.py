@@ -1,32 +1,48 @@
+# Package for writing the statistics of API calls
+import json
 # Package for logging your execution
 import logging
 import math
 import os
+# Package for naming the signal which killed a process
+import signal
+import sys
 # Package for random seed control
 import random
 # A dictionary class which can set the default value
-from collections import defaultdict
+from collections import defaultdict, deque
 # Package for runtime importing
 from importlib import import_module
 # Package for multiprocessing (evaluation will be done with multiprocessing)
-from multiprocessing import Process, Queue
+from multiprocessing import get_context, get_all_start_methods
+# Waiting function for multiple processes and pipes
+from multiprocessing.connection import Connection, wait
 # Querying function for the number of CPUs
 from os import cpu_count
 # Package for file handling
 from pathlib import Path
-from time import time, sleep
+# Lock for sending a result from multiple threads
+from threading import Lock
+from time import time
 # Package for writing exceptions
 from traceback import format_exc
 from typing import Callable
 
-# Memory usage tracking function
-import psutil as pu
-
 from action import VILLAGE
 # Package for problem definitions
 from board import *
 # Function for loading your agents
 from agents.load import get_all_agents
+# Function for loading a corpus of initial states
+from corpus import load_states
+# Function for summarizing the statistics of API calls
+from stats import top_method
+# Functions for profiling the search of agents
+from profiling import profile_call, write_report, PROFILE_EXTENSIONS
+# Allocation tracer for diagnosing memory usage
+from memory import AllocationTracer
+# Hard limits of the evaluation processes
+from limits import apply_limits, prepare_cgroups, collect_cgroup
 
 #: Size of MB in bytes
 MEGABYTES = 1024 ** 2
@@ -36,6 +52,24 @@ GAMES = 5
 TIME_LIMIT = 60 * 11
 #: LIMIT OF MEMORY USAGE, 1GB
 MEMORY_LIMIT = 1 * 1024 * MEGABYTES
+#: Interval (in seconds) of updating the progress message, while waiting for running processes.
+PROGRESS_INTERVAL = 1
+#: Interval (in seconds) of background memory sampling. None means using the kernel's peak memory tracking only.
+MEMORY_SAMPLING_INTERVAL = None
+#: Corpus file of the initial states (given by '--corpus FILE' option). If None, boards are generated randomly.
+CORPUS_FILE = sys.argv[sys.argv.index('--corpus') + 1] if '--corpus' in sys.argv[:-1] else None
+#: True if the statistics of API calls during the search should be recorded for each run ('--stats' option).
+RECORD_STATS = '--stats' in sys.argv
+#: Profiler for the search of each run: 'cprofile' ('--profile' option), 'sample' ('--profile-sample' option) or None
+PROFILER = 'cprofile' if '--profile' in sys.argv else ('sample' if '--profile-sample' in sys.argv else None)
+#: True if the allocations during the search should be traced, to report the top allocation sites at the peak
+#: ('--trace-memory' option). Tracing increases both memory usage and time.
+TRACE_MEMORY = '--trace-memory' in sys.argv
+#: Backend of the game boards: the setup engine ('--engine' option) or PyCatan (default). See engine.py.
+BACKEND = 'engine' if '--engine' in sys.argv else BACKENDS[0]
+#: Modules to be imported once in the fork server, so that each evaluation process starts with them already loaded.
+PRELOAD_MODULES = ['__main__', 'board', 'action', 'state', 'topology', 'memory', 'stats', 'profiling', 'util', 'corpus',
+                   'limits', 'engine', 'pycatan', 'psutil', 'agents.load']
 
 # Set a random seed
 random.seed(5606)
@@ -52,13 +86,56 @@ def _compute_efficiency_score(m, t):
     return (2 if m <= 10 else (1 if m <= 100 else 0.5 * (m <= 500))) + \
         (1 if t <= 60 else 0.5 * (t <= 300))
 
-def evaluate_algorithm(agent_name, initial_state, result_queue: Queue):
+def _evaluation_context():
+    """
+    Choose the way of starting the evaluation processes.
+    Each run is isolated in its own process, forked from a warm parent which has already imported the game modules:
+    a fork server with preloaded modules if available, otherwise this (already warm) process.
+
+    :return: A multiprocessing context
+    """
+    methods = get_all_start_methods()
+    # Flags (IS_DEBUG, IS_RUN) are read from sys.argv at import time, which the fork server does not have.
+    if 'forkserver' in methods and not (IS_DEBUG or IS_RUN):
+        context = get_context('forkserver')
+        context.set_forkserver_preload(PRELOAD_MODULES)
+        return context
+    if 'fork' in methods:
+        return get_context('fork')
+    return get_context()
+
+
+def _profile_path(agent_name, trial) -> Path:
+    """
+    Path of the profile of a run.
+    :param agent_name: Agent
+    :param trial: Game trial number
+    :return: Path of the profile file
+    """
+    return Path(f'./profile_{agent_name}_{trial}{PROFILE_EXTENSIONS[PROFILER]}')
+
+
+def evaluate_algorithm(agent_name, initial_state, result_pipe: Connection, record_stats: bool = False,
+                       profiler: str = None, profile_path: Path = None, trace_path: Path = None,
+                       backend: str = BACKENDS[0]):
     """
     Run the evaluation for an agent.
     :param agent_name: Agent to be evaluated
     :param initial_state: Initial state for the test
-    :param result_queue: A multiprocessing Queue to return the execution result.
+    :param result_pipe: A multiprocessing Connection to return the execution result.
+    :param record_stats: True if the statistics of API calls during the search should be returned.
+    :param profiler: Profiler for the search ('cprofile' or 'sample'). None means no profiling.
+    :param profile_path: Path of the profile to write, when a profiler is given.
+    :param trace_path: Path of the report of allocation sites at the peak memory. None means no tracing.
+    :param backend: Backend of the game board (one of BACKENDS).
     """
+    send_lock = Lock()
+
+    def _send(failure_msg, diversity=float('NaN'), memory=float('NaN'), time_spent=float('NaN'), stats=None):
+        # The memory watchdog may send a result while the main thread sends one.
+        with send_lock:
+            result_pipe.send((agent_name, failure_msg, diversity, memory, time_spent, stats))
+
     # Initialize logger
     if not IS_RUN:
         logging.basicConfig(level=logging.DEBUG if IS_DEBUG else logging.INFO,
@@ -72,15 +149,40 @@ def evaluate_algorithm(agent_name, initial_state, result_queue: Queue):
                             format='%(asctime)s [%(name)-12s] %(levelname)-8s %(message)s',
                             force=True)
 
-    # Set up the given problem
+    # Set up the given problem (directly from the initial state)
     problem = GameBoard()
-    problem._initialize()
-    problem.set_to_state(initial_state, is_initial=True)
+    problem._initialize(memory_interval=MEMORY_SAMPLING_INTERVAL, initial_state=initial_state, backend=backend)
 
-    # Log initial memory size
+    # Log initial memory size (and begin to track the peak memory usage from here)
+    problem.reset_max_memory_usage()
     init_memory = problem.get_current_memory_usage()
     logger = logging.getLogger('Evaluate')
 
+    def _exceeded(peak):
+        # Report the failure and stop this process immediately.
+        message = f'Process consumed memory more than {MEMORY_LIMIT / MEGABYTES}MB (used: {peak / MEGABYTES}MB)'
+        logger.error(f'[MEM LIMIT] {agent_name} / {message}')
+        _send(message)
+        os._exit(1)
+
+    # Enforce the memory limit within this process, so that a spike cannot be missed.
+    problem.limit_memory_usage(MEMORY_LIMIT, _exceeded)
+
+    def _cpu_exceeded():
+        # Report the failure and stop this process immediately. (Called by SIGXCPU, on the main thread.)
+        message = f'CPU time limit exceeded! The process used more than {TIME_LIMIT} seconds of CPU time'
+        logger.error(f'[CPU LIMIT] {agent_name} / {message}')
+        _send(message)
+        os._exit(1)
+
+    # Set hard limits of this process, so that an allocation burst fails here instead of swapping.
+    hard_limits = apply_limits(MEMORY_LIMIT, TIME_LIMIT, _cpu_exceeded)
+    logger.info(f'Hard limits: cgroup={hard_limits["cgroup"]}, address space={hard_limits["address_space"]}, '
+                f'CPU time={hard_limits["cpu"]}')
+    if hard_limits['cgroup_fallback'] is not None:
+        logger.info(f'No cgroup memory limit (using the address space limit instead), '
+                    f'because {hard_limits["cgroup_fallback"]}.')
+
     # Initialize an agent
     try:
         logger.info(f'Loading {agent_name} agent to memory...')
@@ -90,7 +192,7 @@ def evaluate_algorithm(agent_name, initial_state, result_queue: Queue):
         # When agent loading fails, send the failure log to main process.
         failure = format_exc()
         logger.error('Loading failed!', exc_info=e)
-        result_queue.put((agent_name, failure, float('NaN'), float('NaN'), float('NaN')))
+        _send(failure)
         return
 
     # Do search
@@ -100,18 +202,41 @@ def evaluate_algorithm(agent_name, initial_state, result_queue: Queue):
     num_calls = float('inf')  # Record for Performance measure III
 
     logger.info(f'Begin to search using {agent_name} agent.')
+    if record_stats:
+        problem.enable_stats()
+    tracer = None
+    if trace_path is not None:
+        tracer = AllocationTracer()
+        tracer.start()
     time_start = time()
     try:
-        solution = agent.decide_new_village(problem, time_limit=time_start + 600)  # 10 minutes
+        if profiler is None:
+            solution = agent.decide_new_village(problem, time_limit=time_start + 600)  # 10 minutes
+        else:
+            solution = profile_call(profiler, profile_path, agent.decide_new_village, problem,
+                                    time_limit=time_start + 600)
         assert isinstance(solution, Callable), f'Solution should be a function! Received: {type(solution)}'
+    except MemoryError:
+        # An allocation failed by the address space limit.
+        limit = hard_limits['address_space']
+        failure = f'Memory limit exceeded! An allocation failed under the hard limit ' \
+                  f'(address space: {"-" if limit is None else limit / MEGABYTES}MB)\n' + format_exc()
     except:
         failure = format_exc()
 
     time_end = time()
+    # Write the top allocation sites at the peak memory usage
+    if tracer is not None:
+        tracer.stop()
+        with Path(trace_path).open('wt') as fp:
+            fp.write(tracer.report() + '\n')
+    # Stop recording the statistics of API calls (the execution below is not a part of the search).
+    stats = problem.get_stats()
+    problem.disable_stats()
+
     time_delta = min(600, max(int(time_end - time_start), 0))
     if time_delta >= 600:
-        result_queue.put((agent_name,
-                          f'Time limit exceeded! {time_delta} seconds passed', float('NaN'), float('NaN'), float('NaN')))
+        _send(f'Time limit exceeded! {time_delta} seconds passed', stats=stats)
         return
 
     # Get maximum memory usage during search (Performance measure IV)
@@ -132,7 +257,7 @@ def evaluate_algorithm(agent_name, initial_state, result_queue: Queue):
     if IS_DEBUG:
         logger.debug(f'Execution Result: Failure {not not failure}, {max_memory_usage}MB/{time_delta}sec, '
                      f'diversity score = {diversity_score}.')
-    result_queue.put((agent_name, failure, diversity_score, max_memory_usage, time_delta))
+    _send(failure, diversity_score, max_memory_usage, time_delta, stats)
 
 
 # Main function
@@ -148,19 +273,22 @@ if __name__ == '__main__':
     diversity_avg = defaultdict(list)  # This will be computed as average score
     mem_avg = defaultdict(list)  # This will be computed as average score
     time_avg = defaultdict(list)  # This will be computed as average score
-    last_execution = defaultdict(lambda: (1, float('NaN'), float('NaN'), float('NaN')))
+    executions = [{} for _ in range(GAMES)]  # Execution results of agents, for each game trial
+    api_stats = [{} for _ in range(GAMES)]  # Statistics of API calls of agents, for each game trial
 
     def _print(t):
         """
         Helper function for printing rank table
         :param t: Game trial number
         """
+        last_execution = executions[t]
 
         # Print header
         print('-' * 80)
         print(f'\nCurrent game trial: #{t}')
-        print(f' AgentName    |  Failure?  Diversity  MemoryUsg  TimeSpent | Score ')
-        print('=' * 14 + '|' + '=' * 44 + '|' + '=' * 30)
+        print(f' AgentName    |  Failure?  Diversity  MemoryUsg  TimeSpent | Score '
+              + (' ' * 31 + '| Top API call' if RECORD_STATS else ''))
+        print('=' * 14 + '|' + '=' * 44 + '|' + '=' * 30 + ('=' * 8 + '|' + '=' * 30 if RECORD_STATS else ''))
 
         for agent in all_agents:
             if agent in last_execution:
@@ -192,113 +320,145 @@ if __name__ == '__main__':
             print(f' {key_print:12s} |  {"FAILURE!" if is_failure else "        "} '
                   f' {diversity:9.2f}  {memory:7.2f}MB  {time_spent:6.0f}sec |'
                   f' (1 - {failure_score:3.1f}) * [ 2 * {diversity_score:3.1f} + {efficiency_score:3.1f} ]'
-                  f' = {score:4.2f}')
+                  f' = {score:4.2f}' + (f' | {top_method(api_stats[t].get(agent))}' if RECORD_STATS else ''))
 
             # Write-down the failures
             with Path(f'./failure_{agent}.txt').open('w+t') as fp:
                 fp.write('\n\n'.join(failures[agent]))
 
+            # Aggregate the profiles of the finished game trials
+            if PROFILER:
+                profiles = [_profile_path(agent, trial_i) for trial_i in range(t + 1)]
+                write_report([path for path in profiles if path.exists()], f'./profile_{agent}.txt')
+
+            # Write-down the statistics of API calls, for each game trial
+            if RECORD_STATS:
+                with Path(f'./stats_{agent}.json').open('w+t') as fp:
+                    json.dump([dict(trial=trial_i, stats=api_stats[trial_i].get(agent)) for trial_i in range(t + 1)],
+                              fp, indent=2)
+
+    # Generate (or load) all problems up front, so that every (agent, problem) job can be scheduled at once.
+    if CORPUS_FILE is not None:
+        problems = load_states(CORPUS_FILE, GAMES)
+    else:
+        problems = []
+        for trial in range(GAMES):
+            prob_generator._initialize()
+            problems.append(prob_generator.get_initial_state())
+
+    # Scheduling queue of all (game trial, agent) jobs
+    jobs = deque()
+    for trial in range(GAMES):
+        agents_to_run = all_agents.copy()
+        random.shuffle(agents_to_run)
+        jobs.extend((trial, agent) for agent in agents_to_run)
+
+    # Prepare the cgroups for the hard memory limits, before the fork server starts.
+    cgroup_base, cgroup_fallback = prepare_cgroups()
+    if cgroup_fallback is None:
+        logging.info(f'Cgroup memory limits are applied to the evaluation processes under {cgroup_base}.')
+    else:
+        logging.warning(f'No cgroup memory limits (using the address space limits instead), because {cgroup_fallback}.')
+
     # Start evaluation process (using multi-processing)
-    process_results = Queue(len(all_agents) * 2)
+    context = _evaluation_context()
     process_count = max(cpu_count() - 2, 1)
 
-    def _execute(prob, agent_i):
+    def _execute(trial_i, agent_i):
         """
-        Execute an evaluation for an agent with given initial state.
-        :param prob: Initial state for a problem
+        Execute an evaluation for an agent with the initial state of given game trial.
+        :param trial_i: Game trial number
         :param agent_i: Agent
-        :return: A process
+        :return: A process, and a pipe to read its result
         """
-        proc = Process(name=f'EvalProc', target=evaluate_algorithm, args=(agent_i, prob, process_results), daemon=True)
+        reader, writer = context.Pipe(duplex=False)
+        proc = context.Process(name=f'EvalProc', target=evaluate_algorithm,
+                               args=(agent_i, problems[trial_i], writer, RECORD_STATS, PROFILER,
+                                     _profile_path(agent_i, trial_i) if PROFILER else None,
+                                     Path(f'./memory_{agent_i}_{trial_i}.txt') if TRACE_MEMORY else None, BACKEND),
+                               daemon=True)
         proc.start()
+        writer.close()  # Only the process writes to the pipe. (So, the pipe is closed when the process exits.)
         proc.agent = agent_i  # Make an agent tag for this process
-        last_execution[agent_i] = 1, float('NaN'), float('NaN'), float('NaN')
-        return proc
+        proc.trial = trial_i  # Make a trial tag for this process
+        logging.info(f'Trial {trial_i} begins for {agent_i}!')
+        return proc, reader
 
 
-    def _read_result(res_queue):
+    def _read_result(res_pipe, trial_i, reported):
         """
-        Read evaluation result from the queue.
-        :param res_queue: Queue to read
-        :param exceeds: failure message for agents who exceeded limits
+        Read evaluation result from the pipe. The pipe will be closed after reading.
+        :param res_pipe: Pipe to read
+        :param trial_i: Game trial number of the result
+        :param reported: Set of (game trial, agent) jobs which reported their results
         """
-        while not res_queue.empty():
-            agent_i, failure_i, div_i, mem_i, time_i = res_queue.get()
-            if failure_i is None:
-                last_execution[agent_i] = 0, div_i, mem_i, time_i
-            else:
-                last_execution[agent_i] = 1, float('NaN'), float('NaN'), float('NaN')
-                failures[agent_i].append(failure_i)
-
-
-    for trial in range(GAMES):
-        # Clear all previous results
-        last_execution.clear()
-        while not process_results.empty():
-            process_results.get()
-
-        # Generate new problem
-        prob_generator._initialize()
-        prob_spec = prob_generator.get_initial_state()
-        logging.info(f'Trial {trial} begins!')
-
-        # Execute agents
-        processes = []
-        agents_to_run = all_agents.copy()
-        random.shuffle(agents_to_run)
-
-        exceed_limit = {}  # Timeout limit
-        while agents_to_run or processes:
-            # If there is a room for new execution, execute new thing.
-            if agents_to_run and len(processes) < process_count:
-                alg = agents_to_run.pop()
-                processes.append((_execute(prob_spec, alg), time()))
-
-            new_proc_list = []
-            for p, begin in processes:
-                if not p.is_alive():
-                    continue
-
-                # Print running info
-                now = time()
-                print(f'Running "{p.agent}" for {now - begin:4.0f}/{TIME_LIMIT} second(s).', end='\r')
-
-                # For each running process, check for timeout
-                if begin + TIME_LIMIT < now:
-                    p.terminate()
-                    exceed_limit[p.agent] = \
-                        f'Process is running more than {TIME_LIMIT} sec, from ts={begin}; now={time()}'
-                    logging.error(f'[TIMEOUT] {p.agent} / '
-                                  f'Process is running more than {TIME_LIMIT} sec, from ts={begin}; now={time()}')
-                else:
-                    try:
-                        p_bytes = pu.Process(p.pid).memory_info().rss
-                        if p_bytes > MEMORY_LIMIT:
-                            p.terminate()
-                            exceed_limit[p.agent] = \
-                                f'Process consumed memory more than {MEMORY_LIMIT / MEGABYTES}MB (used: {p_bytes / MEGABYTES}MB)'
-                            logging.error(f'[MEM LIMIT] {p.agent} / '
-                                          f'Process consumed memory more than {MEMORY_LIMIT / MEGABYTES}MB (used: {p_bytes / MEGABYTES}MB)')
-                        else:
-                            new_proc_list.append((p, begin))
-                    except pu.NoSuchProcess:
-                        new_proc_list.append((p, begin))
-
-            # Prepare for the next round
-            processes = new_proc_list
-            # Read result from queue
-            _read_result(process_results)
-
-            # Wait for one seconds
-            sleep(1)
-
-        # Read results
-        logging.info(f'Reading results at Trial {trial}')
-        _read_result(process_results)
-
-        for agent_i, failure_i in exceed_limit.items():
-            last_execution[agent_i] = 1, float('NaN'), float('NaN'), float('NaN')
+        try:
+            agent_i, failure_i, div_i, mem_i, time_i, stats_i = res_pipe.recv()
+        except EOFError:
+            # The process exited without a result.
+            res_pipe.close()
+            return
+
+        res_pipe.close()
+        reported.add((trial_i, agent_i))
+        api_stats[trial_i][agent_i] = stats_i
+        if failure_i is None:
+            executions[trial_i][agent_i] = 0, div_i, mem_i, time_i
+        else:
+            executions[trial_i][agent_i] = 1, float('NaN'), float('NaN'), float('NaN')
             failures[agent_i].append(failure_i)
 
-        # Sort the results for each performance criteria and give ranks to agents
-        _print(trial)
+
+    running = {}  # Running process -> (pipe to read its result, beginning time)
+    reported = set()  # Jobs which reported their results
+    exceed_limit = set()  # Jobs which exceeded the limit
+    remaining = [len(all_agents)] * GAMES  # The number of unfinished jobs for each game trial
+    next_trial_to_print = 0
+    while jobs or running:
+        # If there is a room for new execution, execute new things.
+        while jobs and len(running) < process_count:
+            proc, pipe = _execute(*jobs.popleft())
+            running[proc] = pipe, time()
+
+        # Sleep until a result arrives, a process exits, or the nearest time limit is reached.
+        timeout = min(begin + TIME_LIMIT for _, begin in running.values()) - time()
+        ready = wait([p.sentinel for p in running] + [pipe for pipe, _ in running.values() if not pipe.closed],
+                     timeout=max(0, min(timeout, PROGRESS_INTERVAL)))
+
+        now = time()
+        for p, (pipe, begin) in list(running.items()):
+            job = p.trial, p.agent
+            # Read the result as soon as it arrives.
+            if not pipe.closed and (pipe in ready or p.sentinel in ready):
+                _read_result(pipe, p.trial, reported)
+
+            if p.sentinel in ready:
+                p.join()
+                del running[p]
+                # Remove the cgroup of the process, and find whether the kernel killed it by the memory limit.
+                cause = collect_cgroup(p.pid)
+                if job not in reported and job not in exceed_limit:
+                    if cause is None and p.exitcode < 0:
+                        cause = f'Process was killed by {signal.Signals(-p.exitcode).name} without reporting a result'
+                    failures[p.agent].append(cause or f'Process exited with code {p.exitcode} '
+                                                      f'without reporting a result')
+                remaining[p.trial] -= 1
+                continue
+
+            # Print running info
+            print(f'Running "{p.agent}" (trial #{p.trial}) for {now - begin:4.0f}/{TIME_LIMIT} second(s).', end='\r')
+
+            # For each running process, check for timeout (it will be removed when its sentinel is ready)
+            if begin + TIME_LIMIT < now and job not in exceed_limit:
+                p.terminate()
+                exceed_limit.add(job)
+                executions[p.trial][p.agent] = 1, float('NaN'), float('NaN'), float('NaN')
+                failures[p.agent].append(f'Process is running more than {TIME_LIMIT} sec, from ts={begin}; now={now}')
+                logging.error(f'[TIMEOUT] {p.agent} / '
+                              f'Process is running more than {TIME_LIMIT} sec, from ts={begin}; now={now}')
+
+        # Aggregate the results of finished game trials, in the order of trials.
+        while next_trial_to_print < GAMES and remaining[next_trial_to_print] == 0:
+            logging.info(f'All agents finished at Trial {next_trial_to_print}')
+            _print(next_trial_to_print)
+            next_trial_to_print += 1
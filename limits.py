@@ -0,0 +1,234 @@
+# Library for OS environment
+import os
+# Package for handling CPU time limit signal
+import signal
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+# Resource limits (not available on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+#: Size of MB in bytes
+MEGABYTES = 1024 ** 2
+#: Root of the cgroup v2 hierarchy
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+#: Prefix of the name of the cgroup created for each evaluation process
+CGROUP_PREFIX = 'evaluate-'
+#: Name of the leaf cgroup which the parent (supervisor) process moves into
+SUPERVISOR_CGROUP = f'{CGROUP_PREFIX}supervisor'
+#: Headroom (in bytes) above the memory limit for the hard limits. The precise limit is enforced by the watchdog
+#: (see MemoryTracker.start_watchdog), and the hard limits are the backstop against fast allocation bursts.
+HARD_LIMIT_HEADROOM = 256 * MEGABYTES
+#: Grace period (in seconds) between the soft CPU time limit (SIGXCPU) and the hard one (SIGKILL)
+CPU_GRACE_PERIOD = 5
+
+
+def _current_cgroup() -> Optional[Path]:
+    """
+    Helper function for finding the cgroup v2 of this process.
+
+    :return: Path of the cgroup directory, or None if cgroup v2 is not available.
+    """
+    try:
+        with open('/proc/self/cgroup', 'rt') as fp:
+            for line in fp:
+                if line.startswith('0::'):
+                    group = CGROUP_ROOT / line[3:].strip().lstrip('/')
+                    return group if (group / 'cgroup.controllers').exists() else None
+    except OSError:
+        pass
+    return None
+
+
+def _base_cgroup() -> Optional[Path]:
+    """
+    Helper function for finding the cgroup which holds the supervisor and the evaluation processes' cgroups.
+
+    :return: Path of the cgroup directory, or None if this process is not in the supervisor cgroup.
+    """
+    group = _current_cgroup()
+    return group.parent if group is not None and group.name == SUPERVISOR_CGROUP else None
+
+
+def _cgroup_of(pid: int, base: Path = None) -> Optional[Path]:
+    """
+    Helper function for finding the cgroup which an evaluation process creates for itself.
+
+    :param pid: Process ID of the evaluation process
+    :param base: Parent cgroup. If None, the parent of the supervisor cgroup.
+    :return: Path of the cgroup directory, or None if the cgroups are not prepared.
+    """
+    base = base or _base_cgroup()
+    return None if base is None else base / f'{CGROUP_PREFIX}{pid}'
+
+
+def prepare_cgroups() -> Tuple[Optional[Path], Optional[str]]:
+    """
+    Prepare the cgroup v2 subtree for the memory limits of the evaluation processes.
+    Call this in the parent (supervisor) process, before starting any evaluation process.
+
+    A cgroup can enable a controller for its sub-groups only if it has no process of its own (except the root).
+    So, this process moves into a leaf cgroup (SUPERVISOR_CGROUP), and enables the memory controller on its former
+    cgroup. The evaluation processes (which inherit the leaf) then create their own sibling groups.
+    This is done only when the subtree is delegated to this user, i.e., its control files are writable.
+
+    :return: Tuple of the path of the prepared cgroup and None, or None and the reason why it is not prepared.
+    """
+    base = _current_cgroup()
+    if base is None:
+        return None, 'cgroup v2 is not available'
+    if base.name == SUPERVISOR_CGROUP:  # Already prepared (e.g., by a previous run in this process)
+        base = base.parent
+
+    try:
+        if 'memory' not in (base / 'cgroup.controllers').read_text().split():
+            return None, f'the memory controller is not available in {base}'
+    except OSError as e:
+        return None, f'cannot read {base / "cgroup.controllers"}: {e}'
+    if not all(os.access(base / name, os.W_OK) for name in ('cgroup.procs', 'cgroup.subtree_control')):
+        return None, f'{base} is not delegated to this user'
+
+    supervisor = base / SUPERVISOR_CGROUP
+    try:
+        supervisor.mkdir(exist_ok=True)
+        (supervisor / 'cgroup.procs').write_text(str(os.getpid()))
+        if 'memory' not in (base / 'cgroup.subtree_control').read_text().split():
+            (base / 'cgroup.subtree_control').write_text('+memory')
+        return base, None
+    except OSError as e:
+        # (e.g., other processes are still in the cgroup.) Move back, so that nothing is changed.
+        try:
+            (base / 'cgroup.procs').write_text(str(os.getpid()))
+            supervisor.rmdir()
+        except OSError:
+            pass
+        return None, f'cannot enable the memory controller for the sub-groups of {base}: {e}'
+
+
+def join_cgroup(memory_limit: int) -> Tuple[Optional[Path], Optional[str]]:
+    """
+    Move this process into a new cgroup v2 sub-group, which has a hard memory limit and no swap.
+    The kernel kills this process when the limit is exceeded, before it slows down the others by swapping.
+    The sub-group is a sibling of the supervisor cgroup, which is prepared by prepare_cgroups() in the parent.
+
+    :param memory_limit: Memory limit in bytes
+    :return: Tuple of the path of the new cgroup and None, or None and the reason why it is not created.
+    """
+    base = _base_cgroup()
+    if base is None:
+        return None, 'the parent process did not prepare the cgroups (see its warning for the reason)'
+
+    try:
+        if 'memory' not in (base / 'cgroup.subtree_control').read_text().split():
+            return None, f'the memory controller is not enabled for the sub-groups of {base}'
+    except OSError as e:
+        return None, f'cannot read {base / "cgroup.subtree_control"}: {e}'
+
+    group = _cgroup_of(os.getpid(), base)
+    try:
+        group.mkdir(exist_ok=True)
+        (group / 'memory.max').write_text(str(memory_limit))
+        if (group / 'memory.swap.max').exists():
+            (group / 'memory.swap.max').write_text('0')
+        (group / 'cgroup.procs').write_text(str(os.getpid()))
+        return group, None
+    except OSError as e:
+        try:
+            group.rmdir()
+        except OSError:
+            pass
+        return None, f'cannot set up {group}: {e}'
+
+
+def collect_cgroup(pid: int) -> Optional[str]:
+    """
+    Remove the cgroup of a finished evaluation process, and tell whether the kernel killed it.
+    Call this from the parent process, after the evaluation process exits.
+
+    :param pid: Process ID of the finished evaluation process
+    :return: Failure message if the process was killed by its cgroup memory limit, otherwise None.
+    """
+    group = _cgroup_of(pid)
+    if group is None or not group.exists():
+        return None
+
+    cause = None
+    try:
+        events = dict(line.split() for line in (group / 'memory.events').read_text().splitlines())
+        if int(events.get('oom_kill', 0)) > 0:
+            limit = (group / 'memory.max').read_text().strip()
+            cause = f'Process was killed by the cgroup memory limit ({int(limit) / MEGABYTES}MB)'
+    except (OSError, ValueError):
+        pass
+
+    try:
+        group.rmdir()
+    except OSError:
+        pass
+    return cause
+
+
+def _address_space() -> Optional[int]:
+    """
+    Helper function for reading the current virtual memory size of this process.
+
+    :return: Size in bytes, or None if it cannot be read.
+    """
+    try:
+        with open('/proc/self/status', 'rt') as fp:
+            for line in fp:
+                if line.startswith('VmSize:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def apply_limits(memory_limit: int, cpu_limit: int, on_cpu_exceeded: Callable[[], None]) -> dict:
+    """
+    Set hard limits on this process: a cgroup v2 memory limit if the cgroups are prepared by prepare_cgroups() in the
+    parent process, otherwise an address space limit
+    (RLIMIT_AS), and a CPU time limit (RLIMIT_CPU). Call this at the beginning of an evaluation process.
+    When the address space limit is reached, allocations raise MemoryError.
+    When the CPU time limit is reached, on_cpu_exceeded is called (by SIGXCPU), and the process is killed
+    after the grace period.
+
+    :param memory_limit: Memory limit in bytes (the headroom is added to the hard limits)
+    :param cpu_limit: CPU time limit in seconds
+    :param on_cpu_exceeded: Function to be called when the CPU time limit is reached
+    :return: Dictionary of the applied limits: 'cgroup' (path), 'address_space' (bytes) and 'cpu' (seconds).
+        Each is None if it is not applied. 'cgroup_fallback' is the reason why the cgroup is not used (or None).
+    """
+    group, reason = join_cgroup(memory_limit + HARD_LIMIT_HEADROOM)
+    applied = {'cgroup': group, 'cgroup_fallback': reason, 'address_space': None, 'cpu': None}
+    if resource is None:
+        return applied
+
+    # Address space limit, above the current virtual memory (which includes the loaded modules and libraries).
+    current = _address_space()
+    if applied['cgroup'] is None and current is not None:
+        limit = current + memory_limit + HARD_LIMIT_HEADROOM
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+            applied['address_space'] = limit
+        except (ValueError, OSError):
+            pass
+
+    # CPU time limit
+    if hasattr(signal, 'SIGXCPU'):
+        signal.signal(signal.SIGXCPU, lambda signum, frame: on_cpu_exceeded())
+        try:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + CPU_GRACE_PERIOD))
+            applied['cpu'] = cpu_limit
+        except (ValueError, OSError):
+            pass
+
+    return applied
+
+
+# Export the limit functions
+__all__ = ['apply_limits', 'prepare_cgroups', 'join_cgroup', 'collect_cgroup']
@@ -0,0 +1,315 @@
+# Library for OS environment
+import os
+import sys
+# Library for tracing allocations
+import linecache
+import tracemalloc
+# Background sampling thread
+from threading import Thread, Event
+from typing import Optional, Callable
+
+# Process information class: fallback for platforms without kernel high-water mark
+from psutil import Process as PUInfo, NoSuchProcess
+
+
+#: Path to the process status file (Linux), which contains VmHWM(peak RSS) and VmRSS(current RSS).
+PROC_STATUS = '/proc/self/status'
+#: Path to the file which resets the peak RSS of this process when '5' is written (Linux 4.0+).
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+#: Size of MB in bytes
+MEGABYTES = 1024 ** 2
+
+
+def _read_proc_status(key: str) -> Optional[int]:
+    """
+    Read a memory field (in kB) from the process status file.
+
+    :param key: Field name, e.g., 'VmHWM' or 'VmRSS'
+    :return: The value in bytes, or None if the field cannot be read.
+    """
+    try:
+        with open(PROC_STATUS, 'rt') as fp:
+            for line in fp:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _read_ru_maxrss() -> Optional[int]:
+    """
+    Read the peak RSS from getrusage(). (Not resettable)
+
+    :return: The value in bytes, or None if the resource module is not available (e.g., Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, but in kilobytes on Linux.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryTracker:
+    """
+    Peak memory(RSS) tracker for the current process.
+
+    The peak is read from the kernel's high-water mark (VmHWM, or ru_maxrss), so allocation spikes between queries
+    are not missed and no system call is needed while searching. On Linux, the high-water mark is reset by reset().
+    When the high-water mark cannot be reset (or read), an optional background thread samples the current RSS
+    at a configurable interval.
+    """
+
+    def __init__(self, interval: float = None):
+        """
+        Initialize a tracker.
+
+        :param interval: Interval (in seconds) of background sampling. If None, no background thread is used.
+        """
+        #: Process information for reading the current RSS
+        self._process_info = PUInfo(os.getpid())
+        #: True if the high-water mark has been reset by the last reset() call
+        self._hwm_reset = False
+        #: High-water mark at the last reset() call (used when the mark cannot be reset)
+        self._hwm_at_reset = 0
+        #: Peak of the sampled RSS values since the last reset() call
+        self._sampled_peak = 0
+        #: Interval of background sampling
+        self._interval = interval
+        #: Background sampling thread and its stop signal
+        self._thread = None
+        self._stop = Event()
+        #: Background watchdog thread (for memory limit) and its stop signal
+        self._watchdog = None
+        self._watchdog_stop = Event()
+
+        self.reset()
+        if interval is not None:
+            self.start_sampling(interval)
+
+    def current(self) -> int:
+        """
+        :return: Current RSS of this process in bytes, or -1 if it cannot be read.
+        """
+        rss = _read_proc_status('VmRSS')
+        if rss is not None:
+            return rss
+        try:
+            return self._process_info.memory_info().rss
+        except NoSuchProcess:
+            return -1
+
+    def _high_water_mark(self) -> Optional[int]:
+        """
+        [PRIVATE] Read the kernel high-water mark of RSS in bytes.
+        """
+        hwm = _read_proc_status('VmHWM')
+        return hwm if hwm is not None else _read_ru_maxrss()
+
+    def reset(self):
+        """
+        Reset the peak memory usage to the current memory usage. Call this before each search.
+        """
+        try:
+            with open(PROC_CLEAR_REFS, 'wt') as fp:
+                fp.write('5')
+            self._hwm_reset = True
+        except OSError:
+            self._hwm_reset = False
+
+        self._hwm_at_reset = self._high_water_mark() or 0
+        self._sampled_peak = self.current()
+
+    def sample(self):
+        """
+        Sample the current RSS. Only required when the high-water mark is not available.
+        """
+        self._sampled_peak = max(self._sampled_peak, self.current())
+
+    def needs_sampling(self) -> bool:
+        """
+        :return: True if the peak cannot be tracked by the kernel (since the last reset),
+            and should be sampled on each call.
+        """
+        return not self._hwm_reset and self._thread is None
+
+    def peak(self) -> int:
+        """
+        :return: Peak RSS in bytes since the last reset() call.
+        """
+        hwm = self._high_water_mark()
+        if hwm is None:
+            return max(self._sampled_peak, self.current())
+        if self._hwm_reset or hwm > self._hwm_at_reset:
+            # The mark tracks the peak after the reset.
+            return max(hwm, self._sampled_peak)
+        # The mark has not been reset and not been exceeded; the samples are the best estimate.
+        return max(self._sampled_peak, self.current())
+
+    def start_sampling(self, interval: float):
+        """
+        Start a background thread, which samples the current RSS at given interval.
+
+        :param interval: Sampling interval in seconds
+        """
+        self.stop_sampling()
+        self._interval = interval
+        self._stop.clear()
+
+        def _run():
+            while not self._stop.wait(self._interval):
+                self.sample()
+
+        self._thread = Thread(target=_run, name='MemoryTracker', daemon=True)
+        self._thread.start()
+
+    def stop_sampling(self):
+        """
+        Stop the background sampling thread, if exists.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def start_watchdog(self, limit: int, on_exceed: Callable[[int], None], interval: float = 0.05):
+        """
+        Start a background thread, which enforces a memory limit on this process.
+        The thread checks the peak RSS at given interval, and calls on_exceed once when the peak exceeds the limit.
+        Since the peak is read from the kernel high-water mark, a spike between two checks is not missed.
+
+        :param limit: Memory limit in bytes
+        :param on_exceed: Function to be called with the peak RSS (in bytes), when the limit is exceeded.
+        :param interval: Checking interval in seconds
+        """
+        self.stop_watchdog()
+        self._watchdog_stop.clear()
+
+        def _run():
+            while not self._watchdog_stop.wait(interval):
+                if self.needs_sampling():
+                    self.sample()
+                peak = self.peak()
+                if peak > limit:
+                    on_exceed(peak)
+                    return
+
+        self._watchdog = Thread(target=_run, name='MemoryWatchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop_watchdog(self):
+        """
+        Stop the background watchdog thread, if exists.
+        """
+        if self._watchdog is not None:
+            self._watchdog_stop.set()
+            self._watchdog.join()
+            self._watchdog = None
+
+
+class AllocationTracer:
+    """
+    Allocation tracer (tracemalloc), which keeps the snapshot at the peak of the traced memory.
+    A background thread checks the traced memory at a configurable interval, and takes a new snapshot whenever
+    the traced memory grows beyond the last snapshot. So, the snapshot shows what was allocated at the observed peak.
+    Tracing slows down the program and increases its memory usage. Use this only for diagnosis.
+    """
+
+    def __init__(self, interval: float = 0.05, frames: int = 1, margin: int = MEGABYTES):
+        """
+        Initialize a tracer.
+
+        :param interval: Interval (in seconds) of checking the traced memory
+        :param frames: The number of frames to store for each allocation
+        :param margin: Growth (in bytes) of the traced memory required to take a new snapshot
+        """
+        #: Interval of checking the traced memory
+        self.interval = interval
+        #: The number of frames to store for each allocation
+        self.frames = frames
+        #: Growth of the traced memory required to take a new snapshot
+        self.margin = margin
+        #: Snapshot at the observed peak
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        #: Traced memory (in bytes) when the snapshot was taken
+        self.snapshot_size = 0
+        #: Peak of the traced memory (in bytes), tracked by tracemalloc itself
+        self.peak = 0
+        #: [PRIVATE] Background thread and its stop signal
+        self._thread = None
+        self._stop = Event()
+
+    def _check(self):
+        """
+        [PRIVATE] Take a new snapshot, if the traced memory grew beyond the last snapshot.
+        """
+        current = tracemalloc.get_traced_memory()[0]
+        if self.snapshot is None or current >= self.snapshot_size + self.margin:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_size = current
+
+    def start(self):
+        """
+        Start tracing allocations.
+        """
+        tracemalloc.start(self.frames)
+        self.snapshot, self.snapshot_size, self.peak = None, 0, 0
+        self._stop.clear()
+
+        def _run():
+            while not self._stop.wait(self.interval):
+                self._check()
+
+        self._thread = Thread(target=_run, name='AllocationTracer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop tracing allocations. The snapshot at the peak is kept.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if tracemalloc.is_tracing():
+            self._check()
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def report(self, limit: int = 20) -> str:
+        """
+        Describe the top allocation sites at the peak, grouped by file and by line.
+
+        :param limit: The number of sites to describe for each grouping
+        :return: Report string
+        """
+        if self.snapshot is None:
+            return 'No snapshot has been taken.'
+
+        snapshot = self.snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        lines = [f'Peak of traced memory: {self.peak / MEGABYTES:.1f}MB. '
+                 f'Snapshot at the observed peak: {self.snapshot_size / MEGABYTES:.1f}MB.', '']
+
+        lines.append(f'Top {limit} files:')
+        for stat in snapshot.statistics('filename')[:limit]:
+            frame = stat.traceback[0]
+            lines.append(f'{stat.size / MEGABYTES:9.2f}MB {stat.count:9d} blocks  {frame.filename}')
+
+        lines += ['', f'Top {limit} lines:']
+        for stat in snapshot.statistics('lineno')[:limit]:
+            frame = stat.traceback[0]
+            lines.append(f'{stat.size / MEGABYTES:9.2f}MB {stat.count:9d} blocks  {frame.filename}:{frame.lineno}')
+            source = linecache.getline(frame.filename, frame.lineno).strip()
+            if source:
+                lines.append(f'{"":31s}{source}')
+
+        return '\n'.join(lines)
+
+
+# Export the trackers
+__all__ = ['MemoryTracker', 'AllocationTracer']
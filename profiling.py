@@ -0,0 +1,176 @@
+# Deterministic profiler and its statistics reader
+import cProfile
+import pstats
+# Package for the sampling profiler
+import signal
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Tuple, Union
+
+
+#: Available profilers: deterministic (cProfile) and statistical (signal-based sampler)
+PROFILERS = ('cprofile', 'sample')
+#: File extension of the profile written by each profiler
+PROFILE_EXTENSIONS = {'cprofile': '.prof', 'sample': '.folded'}
+#: Interval (in seconds of CPU time) of the sampling profiler
+SAMPLING_INTERVAL = 0.005
+#: The number of functions in a hot-function report
+REPORT_SIZE = 30
+
+
+def _label(filename: str, line: int, name: str) -> str:
+    """
+    Helper function for making the label of a function, which is the same for both profilers.
+
+    :return: String of 'name (filename:line)'
+    """
+    return f'{name} ({filename}:{line})'
+
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler.
+    A timer signal (SIGPROF) interrupts the main thread at every interval of CPU time, and the call stack of
+    the main thread is counted. Only available on the platforms with setitimer() (i.e., not on Windows).
+    """
+
+    def __init__(self, interval: float = SAMPLING_INTERVAL):
+        """
+        :param interval: Sampling interval in seconds (of CPU time)
+        """
+        if not hasattr(signal, 'setitimer'):
+            raise NotImplementedError('The sampling profiler requires signal.setitimer(), which this platform lacks.')
+
+        #: Sampling interval in seconds
+        self.interval = interval
+        #: Counts of the sampled call stacks. Each stack is a tuple of function labels, from the root to the leaf.
+        self.stacks: Counter = Counter()
+        #: [PRIVATE] Cache of function labels, for each code object
+        self._labels = {}
+        #: [PRIVATE] Previous handler of SIGPROF
+        self._previous = None
+
+    def _sample(self, signum, frame):
+        """
+        [PRIVATE] Signal handler, which counts the current call stack.
+        """
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = _label(code.co_filename, code.co_firstlineno, code.co_name)
+            stack.append(label)
+            frame = frame.f_back
+        self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self):
+        """
+        Start sampling.
+        """
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """
+        Stop sampling.
+        """
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+    def dump_stats(self, path: Union[str, Path]):
+        """
+        Write the samples in the collapsed-stack format ('root;...;leaf count' for each line),
+        which flame graph tools can read.
+
+        :param path: Path of the file to write
+        """
+        with Path(path).open('wt') as fp:
+            for stack, count in self.stacks.most_common():
+                fp.write(f'{";".join(stack)} {count}\n')
+
+
+def profile_call(profiler: str, path: Union[str, Path], function: Callable, *args, **kwargs):
+    """
+    Call a function under a profiler, and write its profile. The profile is written even if the function raises.
+
+    :param profiler: Profiler to use: 'cprofile' or 'sample'
+    :param path: Path of the profile to write
+    :param function: Function to call
+    :return: The return value of the function
+    """
+    if profiler == 'cprofile':
+        instance = cProfile.Profile()
+        instance.enable()
+    elif profiler == 'sample':
+        instance = SamplingProfiler()
+        instance.start()
+    else:
+        raise ValueError(f'Unknown profiler: {profiler}. Should be one of {PROFILERS}.')
+
+    try:
+        return function(*args, **kwargs)
+    finally:
+        if profiler == 'cprofile':
+            instance.disable()
+        else:
+            instance.stop()
+        instance.dump_stats(path)
+
+
+def load_profile(path: Union[str, Path]) -> Dict[str, Tuple[float, float]]:
+    """
+    Read the time spent in each function from a profile.
+
+    :param path: Path of a profile, written by profile_call()
+    :return: Dictionary of function label to (self, total) time.
+        The unit is seconds for cProfile, and the number of samples for the sampler.
+    """
+    path = Path(path)
+    if path.suffix == PROFILE_EXTENSIONS['cprofile']:
+        return {
+            _label(*func): (tt, ct)
+            for func, (cc, nc, tt, ct, callers) in pstats.Stats(str(path)).stats.items()
+        }
+
+    functions = {}
+    with path.open('rt') as fp:
+        for line in fp:
+            stack, count = line.rstrip('\n').rsplit(' ', 1)
+            stack, count = stack.split(';'), int(count)
+            # Self time goes to the leaf, and total time goes to every distinct function on the stack.
+            for label in set(stack):
+                self_time, total_time = functions.get(label, (0, 0))
+                functions[label] = self_time + (count if label == stack[-1] else 0), total_time + count
+    return functions
+
+
+def write_report(paths: Iterable[Union[str, Path]], report_path: Union[str, Path], size: int = REPORT_SIZE) -> int:
+    """
+    Aggregate profiles (e.g., of the trials of an agent), and write the hot functions ordered by self time.
+
+    :param paths: Paths of the profiles, written by the same profiler
+    :param report_path: Path of the report to write
+    :param size: The number of functions in the report
+    :return: The number of aggregated profiles
+    """
+    paths = [Path(p) for p in paths]
+    functions = {}
+    for path in paths:
+        for label, (self_time, total_time) in load_profile(path).items():
+            previous_self, previous_total = functions.get(label, (0, 0))
+            functions[label] = previous_self + self_time, previous_total + total_time
+
+    unit = 'samples' if paths and paths[0].suffix == PROFILE_EXTENSIONS['sample'] else 'seconds'
+    overall = sum(self_time for self_time, _ in functions.values()) or 1
+    with Path(report_path).open('wt') as fp:
+        fp.write(f'Hot functions across {len(paths)} profile(s), ordered by self time (unit: {unit})\n\n')
+        fp.write(f'{"self%":>7s} {"self":>12s} {"total%":>7s} {"total":>12s}  function\n')
+        for label, (self_time, total_time) in sorted(functions.items(), key=lambda item: -item[1][0])[:size]:
+            fp.write(f'{self_time / overall * 100:6.1f}% {self_time:12.3f} {total_time / overall * 100:6.1f}% '
+                     f'{total_time:12.3f}  {label}\n')
+    return len(paths)
+
+
+# Export the profiling functions
+__all__ = ['SamplingProfiler', 'profile_call', 'load_profile', 'write_report', 'PROFILERS', 'PROFILE_EXTENSIONS']
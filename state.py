@@ -0,0 +1,513 @@
+# Stable hash function for board identification
+from hashlib import blake2b
+# Random number generator for hash keys
+from random import Random
+# Type specification for Python code
+from typing import Tuple, Dict, Optional, NamedTuple
+
+# Import some class definitions that implements the Settlers of Catan game.
+from pycatan import Resource
+from pycatan.board import BuildingType, HexType
+
+
+#: Code for an empty intersection or path in the compact representation
+EMPTY = 0
+#: Offset of the code for a settlement(village). The code of a settlement is SETTLEMENT_CODE + owner.
+SETTLEMENT_CODE = 1
+#: Offset of the code for a city. The code of a city is CITY_CODE + owner.
+CITY_CODE = 5
+#: Offset of the code for a road. The code of a road is ROAD_CODE + owner.
+ROAD_CODE = 1
+
+#: Resource names in the order stored in the compact representation
+RESOURCE_ORDER = tuple(sorted(r.name for r in Resource))
+#: Size of the header in the compact representation (player ID, current player, #nodes, #paths)
+HEADER_SIZE = 4
+
+#: Seed for generating Zobrist hash keys. Keys are the same across processes.
+ZOBRIST_SEED = 56753
+#: Mask for 64-bit integers
+MASK64 = (1 << 64) - 1
+
+
+def _mix64(x: int) -> int:
+    """
+    SplitMix64 finalizer, which scrambles a 64-bit integer.
+    :param x: Integer to scramble
+    :return: Scrambled 64-bit integer
+    """
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK64
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK64
+    return x ^ (x >> 31)
+
+
+def stable_hash(text: str) -> int:
+    """
+    Compute a 64-bit hash of a string, which is the same across processes (unlike the built-in hash()).
+
+    :param text: String to hash
+    :return: 64-bit unsigned integer
+    """
+    return int.from_bytes(blake2b(text.encode(), digest_size=8).digest(), 'little')
+
+
+def _tuple_to_identifier(c: Tuple[int, int]) -> str:
+    """
+    Return the unique identifier for a coordinate tuple on the board.
+    :param c: Coordinate tuple (Q, R) to make an identifier
+    :return: 2-character String identifier for the coordinate
+    """
+    return chr(ord('L') + int(c[0])) + chr(ord('L') + int(c[1]))
+
+
+class StateView(dict):
+    """
+    Read-only view of a state dictionary.
+    Nested dictionaries are also StateViews and nested lists are StateLists, so a view can be shared among the board,
+    the agents and other views (structural sharing) without copying. Copying a view returns the view itself.
+    Call thaw() if you need a mutable copy.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        """
+        [PRIVATE] Block modification.
+        """
+        raise TypeError('A state view is read-only. Use thaw() to get a mutable copy.')
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def thaw(self) -> dict:
+        """
+        :return: A mutable (deep) copy of this view, which consists of basic python objects.
+        """
+        return thaw(self)
+
+
+class StateList(list):
+    """
+    Read-only list in a state view.
+    """
+
+    __slots__ = ()
+
+    _read_only = StateView._read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = clear = extend = insert = pop = remove = reverse = sort = \
+        _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+
+def freeze(value):
+    """
+    Make a read-only view of a state dictionary (or a part of it). Parts which are already views are shared.
+
+    :param value: A state dictionary, or a value in it
+    :return: StateView (for dictionaries), StateList (for lists) or the value itself (for the others)
+    """
+    if isinstance(value, (StateView, StateList)):
+        return value
+    if isinstance(value, dict):
+        return StateView({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return StateList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """
+    Make a mutable copy of a state view (or a part of it).
+
+    :param value: A state view, or a value in it
+    :return: A deep copy, which consists of basic python dictionaries and lists
+    """
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+
+def node_entry(code: int) -> dict:
+    """
+    Convert an occupancy code of an intersection into the entry of the state dictionary.
+
+    :param code: Occupancy code (EMPTY, SETTLEMENT_CODE + owner or CITY_CODE + owner)
+    :return: Dictionary of building type and owner
+    """
+    if code == EMPTY:
+        return StateView(type=None, owner=None)
+    if code >= CITY_CODE:
+        return StateView(type=BuildingType.CITY.name, owner=code - CITY_CODE)
+    return StateView(type=BuildingType.SETTLEMENT.name, owner=code - SETTLEMENT_CODE)
+
+
+def path_entry(code: int) -> dict:
+    """
+    Convert an occupancy code of a path into the entry of the state dictionary.
+
+    :param code: Occupancy code (EMPTY or ROAD_CODE + owner)
+    :return: Dictionary of road existence and owner
+    """
+    return StateView(type=code != EMPTY, owner=code - ROAD_CODE if code != EMPTY else None)
+
+
+def state_identifier(state: dict) -> str:
+    """
+    Return the unique identifier for a state dictionary.
+    The result is identical to the identifier that the GameBoard computes from the PyCatan board for the same state.
+    It does not depend on the order of the hexes and harbors in the dictionary.
+
+    :param state: State representation to make a unique identifier
+    :return: String of game identifier
+    """
+    board = state['board']
+    hexes = ':'.join([
+        str(h['dice']) + _tuple_to_identifier(c) + str(HexType[h['type']].value)
+        for c, h in sorted(board['hexes'].items(), key=lambda t: (t[1]['dice'] or -1, t[0]))
+    ])
+    intersections = ':'.join([
+        _tuple_to_identifier(c) + str(i['owner']) + str(BuildingType[i['type']].value)
+        for c, i in board['intersections'].items()
+        if i['type'] is not None
+    ])
+    paths = ':'.join([
+        '-'.join(sorted(_tuple_to_identifier(c) for c in p)) + str(i['owner'])
+        for p, i in board['paths'].items()
+        if i['type']
+    ])
+    players = ':'.join([
+        '.'.join(str(Resource[r].value) + str(c) for r, c in sorted(state['player'][p]['resources'].items()))
+        for p in range(4)
+    ])
+    harbors = ':'.join(sorted([
+        '-'.join(sorted(_tuple_to_identifier(c) for c in p)) +
+        (str(Resource[i['type']].value) if i['type'] is not None else 'X')
+        for p, i in board['harbors'].items()
+    ]))
+
+    return f'{hexes}/{intersections}/{paths}/{players}/{harbors}'
+
+
+def static_signature(board: dict) -> str:
+    """
+    Return the string that identifies the static sections (hexes and harbors) of a board.
+    It does not depend on the order of the hexes and harbors.
+
+    :param board: Board section of a state dictionary
+    :return: String signature of the board
+    """
+    return repr((sorted(board['hexes'].items()), sorted(board['harbors'].items())))
+
+
+class ZobristTable:
+    """
+    Zobrist hash keys for a board layout.
+    The hash of a state is the XOR of the board key, the keys of occupied nodes and paths, and the keys of
+    resource counts. Like the state_id, the hash does not depend on the player ID and the current player.
+    As XOR is its own inverse, placing or removing a building changes the hash in O(1).
+    """
+
+    def __init__(self, num_nodes: int, num_paths: int, static_signature: str):
+        """
+        Generate hash keys.
+
+        :param num_nodes: The number of intersections on the board
+        :param num_paths: The number of paths on the board
+        :param static_signature: String that identifies the static sections (hexes, harbors) of the board
+        """
+        rng = Random(ZOBRIST_SEED)
+        #: Hash key of the board itself (distinguishes different boards)
+        self.board_key: int = stable_hash(static_signature)
+        #: Hash keys of the nodes, indexed by [node index][occupancy code]. Key of EMPTY code is zero.
+        self.node_keys = [[0] + [rng.getrandbits(64) for _ in range(CITY_CODE + 3)] for _ in range(num_nodes)]
+        #: Hash keys of the paths, indexed by [path index][occupancy code]. Key of EMPTY code is zero.
+        self.path_keys = [[0] + [rng.getrandbits(64) for _ in range(4)] for _ in range(num_paths)]
+        #: Hash keys of the resources, indexed by (player-major) resource slot
+        self.resource_keys = [rng.getrandbits(64) for _ in range(4 * len(RESOURCE_ORDER))]
+
+    def resource_hash(self, resources) -> int:
+        """
+        Compute the hash part for the resource counts.
+
+        :param resources: Sequence of 20 resource counts (player-major, ordered by RESOURCE_ORDER)
+        :return: 64-bit hash part
+        """
+        h = 0
+        for key, count in zip(self.resource_keys, resources):
+            if count:
+                h ^= _mix64((key + count) & MASK64)
+        return h
+
+    def hash_of(self, nodes, paths, resources) -> int:
+        """
+        Compute the hash from scratch.
+
+        :param nodes: Sequence of node occupancy codes
+        :param paths: Sequence of path occupancy codes
+        :param resources: Sequence of 20 resource counts (player-major, ordered by RESOURCE_ORDER)
+        :return: 64-bit hash value
+        """
+        h = self.board_key ^ self.resource_hash(resources)
+        for keys, code in zip(self.node_keys, nodes):
+            if code:
+                h ^= keys[code]
+        for keys, code in zip(self.path_keys, paths):
+            if code:
+                h ^= keys[code]
+        return h
+
+
+class BoardLayout:
+    """
+    Static layout of a game board.
+    It assigns an integer index to every intersection(node) and path(edge), and keeps the sections of a state
+    that never change during the initial setup (hexes, harbors and the robber).
+    A layout is built once per board, and shared by all compact states on that board.
+    """
+
+    def __init__(self, state: dict):
+        """
+        Build a layout from a state dictionary.
+
+        :param state: A state dictionary of the board (usually, the initial state)
+        """
+        board = state['board']
+        #: Coordinates of the nodes, ordered by their index
+        self.nodes: Tuple[Tuple[int, int], ...] = tuple(board['intersections'].keys())
+        #: Coordinates of the edges, ordered by their index
+        self.paths: Tuple[Tuple[Tuple[int, int], Tuple[int, int]], ...] = tuple(board['paths'].keys())
+        #: Mapping from node coordinate to its index
+        self.node_index: Dict[Tuple[int, int], int] = {c: i for i, c in enumerate(self.nodes)}
+        #: Mapping from edge coordinate to its index
+        self.path_index: Dict[tuple, int] = {c: i for i, c in enumerate(self.paths)}
+        #: Information about the hexes (static)
+        self.hexes: dict = freeze(board['hexes'])
+        #: Information about the harbors (static)
+        self.harbors: dict = freeze(board['harbors'])
+        #: Position of the robber (static during the initial setup)
+        self.robber: Optional[Tuple[int, int]] = state.get('robber', None)
+        #: Zobrist hash keys for the states on this board
+        self.zobrist = ZobristTable(self.num_nodes, self.num_paths, static_signature(board))
+
+    @property
+    def num_nodes(self) -> int:
+        """
+        :return: The number of intersections on the board
+        """
+        return len(self.nodes)
+
+    @property
+    def num_paths(self) -> int:
+        """
+        :return: The number of paths on the board
+        """
+        return len(self.paths)
+
+
+class CompactState(bytes):
+    """
+    Compact, immutable state representation backed by a single bytes object.
+
+    Layout of the bytes:
+        - Header: player ID, current player, the number of nodes (N) and the number of paths (M)
+        - N bytes of node occupancy: EMPTY, SETTLEMENT_CODE + owner, or CITY_CODE + owner
+        - M bytes of path occupancy: EMPTY or ROAD_CODE + owner
+        - 4 x 5 bytes of resource counts, for each player and each resource in RESOURCE_ORDER
+
+    As this is a bytes object, it is hashable and can be directly used as a dictionary key.
+    The static sections (hexes, harbors) are not stored; use a BoardLayout to convert it to a dictionary.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, player_id: int, current_player: int, nodes, paths, resources) -> 'CompactState':
+        """
+        Build a compact state from its sections.
+
+        :param player_id: The agent's Player ID
+        :param current_player: Currently playing Player's ID
+        :param nodes: Sequence of node occupancy codes
+        :param paths: Sequence of path occupancy codes
+        :param resources: Sequence of 20 resource counts (player-major, ordered by RESOURCE_ORDER)
+        :return: A compact state
+        """
+        return cls(bytes((player_id, current_player, len(nodes), len(paths))) +
+                   bytes(nodes) + bytes(paths) + bytes(resources))
+
+    @classmethod
+    def from_dict(cls, layout: BoardLayout, state: dict) -> 'CompactState':
+        """
+        Convert a state dictionary into the compact representation.
+
+        :param layout: Layout of the board where the state is defined
+        :param state: State dictionary to convert
+        :return: A compact state
+        """
+        board = state['board']
+        nodes = bytearray(layout.num_nodes)
+        for c, i in board['intersections'].items():
+            if i['type'] is not None:
+                offset = CITY_CODE if i['type'] == BuildingType.CITY.name else SETTLEMENT_CODE
+                nodes[layout.node_index[c]] = offset + i['owner']
+
+        paths = bytearray(layout.num_paths)
+        for c, i in board['paths'].items():
+            if i['type']:
+                paths[layout.path_index[c]] = ROAD_CODE + i['owner']
+
+        resources = [
+            state['player'][p]['resources'].get(r, 0)
+            for p in range(4)
+            for r in RESOURCE_ORDER
+        ]
+
+        return cls.build(state['player_id'], state['current_player'], nodes, paths, resources)
+
+    @property
+    def player_id(self) -> int:
+        """
+        :return: The agent's Player ID
+        """
+        return self[0]
+
+    @property
+    def current_player(self) -> int:
+        """
+        :return: Currently playing Player's ID
+        """
+        return self[1]
+
+    @property
+    def nodes(self) -> bytes:
+        """
+        :return: Node occupancy codes, ordered by node index
+        """
+        return self[HEADER_SIZE:HEADER_SIZE + self[2]]
+
+    @property
+    def paths(self) -> bytes:
+        """
+        :return: Path occupancy codes, ordered by path index
+        """
+        begin = HEADER_SIZE + self[2]
+        return self[begin:begin + self[3]]
+
+    @property
+    def resources(self) -> bytes:
+        """
+        :return: Resource counts (player-major, ordered by RESOURCE_ORDER)
+        """
+        return self[HEADER_SIZE + self[2] + self[3]:]
+
+    def state_hash(self, layout: BoardLayout) -> int:
+        """
+        Compute the 64-bit Zobrist hash of this state, which is the same as state['state_hash'] of the dictionary form.
+
+        :param layout: Layout of the board where the state is defined
+        :return: 64-bit hash value
+        """
+        return layout.zobrist.hash_of(self.nodes, self.paths, self.resources)
+
+    def to_dict(self, layout: BoardLayout) -> dict:
+        """
+        Convert this compact state into the state dictionary, which GameBoard.get_state() returns.
+
+        :param layout: Layout of the board where the state is defined
+        :return: State dictionary (read-only view)
+        """
+        nodes = self.nodes
+        paths = self.paths
+        resources = self.resources
+
+        intersections = {c: node_entry(code) for c, code in zip(layout.nodes, nodes)}
+
+        state = {
+            'state_id': None,
+            'state_hash': self.state_hash(layout),
+            'player_id': self.player_id,
+            'current_player': self.current_player,
+            'board': {
+                'hexes': layout.hexes,  # Static sections are shared.
+                'intersections': intersections,
+                'paths': {c: path_entry(code) for c, code in zip(layout.paths, paths)},
+                'harbors': layout.harbors,
+            },
+            'player': {
+                p: {
+                    'resources': {
+                        r: resources[p * len(RESOURCE_ORDER) + k]
+                        for k, r in enumerate(RESOURCE_ORDER)
+                    },
+                    # A player is connected to a harbor when one of his/her buildings is on that harbor.
+                    'harbors': [
+                        h for h in layout.harbors
+                        if any(intersections[c]['owner'] == p for c in h)
+                    ]
+                }
+                for p in range(4)
+            },
+        }
+        if layout.robber is not None:
+            state['robber'] = layout.robber
+        state['state_id'] = state_identifier(state)
+
+        return freeze(state)
+
+    def __repr__(self):  # String representation for this
+        return f'CompactState(player={self.player_id}, current={self.current_player}, {len(self)} bytes)'
+
+    __str__ = __repr__
+
+
+class StateDelta(NamedTuple):
+    """
+    Difference between two consecutive states, made by applying actions on a GameBoard.
+    Nodes and paths are given as (index, old code, new code) triples, using the indices of the BoardLayout.
+    """
+    #: Currently playing Player's ID, before applying actions
+    old_player: int
+    #: Currently playing Player's ID, after applying actions
+    new_player: int
+    #: Changed nodes, as tuples of (node index, old occupancy code, new occupancy code)
+    nodes: Tuple[Tuple[int, int, int], ...] = ()
+    #: Changed paths, as tuples of (path index, old occupancy code, new occupancy code)
+    paths: Tuple[Tuple[int, int, int], ...] = ()
+
+    def apply_to(self, state: CompactState) -> CompactState:
+        """
+        Apply this delta on a compact state.
+
+        :param state: The compact state before the change
+        :return: The compact state after the change
+        """
+        nodes = bytearray(state.nodes)
+        for i, _, new in self.nodes:
+            nodes[i] = new
+        paths = bytearray(state.paths)
+        for i, _, new in self.paths:
+            paths[i] = new
+
+        return CompactState.build(state.player_id, self.new_player, nodes, paths, state.resources)
+
+
+# Export layout and compact state classes
+__all__ = ['BoardLayout', 'CompactState', 'StateDelta', 'StateView', 'StateList', 'ZobristTable',
+           'freeze', 'thaw', 'stable_hash', 'state_identifier', 'static_signature', 'node_entry', 'path_entry', 'EMPTY', 'SETTLEMENT_CODE', 'CITY_CODE', 'ROAD_CODE', 'RESOURCE_ORDER']
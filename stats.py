@@ -0,0 +1,189 @@
+# Package for measuring latency
+from time import perf_counter_ns
+# Type specification for Python code
+from typing import Callable, Dict, Optional
+from types import GeneratorType
+
+
+#: The number of histogram buckets per power of two (i.e., relative error of a percentile is at most 1/4)
+SUB_BUCKETS = 4
+#: Percentiles to report
+PERCENTILES = (50, 90, 99)
+#: Size of a microsecond in nanoseconds
+MICROSECONDS = 1000
+
+
+def _bucket_of(ns: int) -> int:
+    """
+    Helper function for finding the histogram bucket of a latency. Buckets are log-scaled.
+
+    :param ns: Latency in nanoseconds
+    :return: Index of the bucket
+    """
+    if ns < SUB_BUCKETS:
+        return max(ns, 0)
+    shift = ns.bit_length() - SUB_BUCKETS.bit_length()
+    return shift * SUB_BUCKETS + (ns >> shift)
+
+
+def _upper_bound_of(bucket: int) -> int:
+    """
+    Helper function for finding the largest latency of a histogram bucket.
+
+    :param bucket: Index of the bucket
+    :return: Latency in nanoseconds
+    """
+    if bucket < SUB_BUCKETS:
+        return bucket
+    shift, mantissa = divmod(bucket, SUB_BUCKETS)
+    shift -= 1
+    return ((mantissa + SUB_BUCKETS + 1) << shift) - 1
+
+
+class MethodStats:
+    """
+    Call count and latency distribution of a method.
+    The latencies are kept in a log-scaled histogram, so the memory usage does not grow with the number of calls.
+    """
+
+    def __init__(self):
+        #: The number of calls
+        self.calls = 0
+        #: Cumulative latency in nanoseconds
+        self.total_ns = 0
+        #: Maximum latency in nanoseconds
+        self.max_ns = 0
+        #: [PRIVATE] Histogram of latencies: bucket index -> count
+        self._histogram: Dict[int, int] = {}
+
+    def record(self, ns: int):
+        """
+        Record a call.
+
+        :param ns: Latency of the call in nanoseconds
+        """
+        self.calls += 1
+        self.total_ns += ns
+        self.max_ns = max(self.max_ns, ns)
+        bucket = _bucket_of(ns)
+        self._histogram[bucket] = self._histogram.get(bucket, 0) + 1
+
+    def percentile(self, p: float) -> int:
+        """
+        :param p: Percentile (0 ~ 100)
+        :return: Latency at the percentile in nanoseconds (the upper bound of its bucket), or 0 if no call.
+        """
+        rank = p / 100 * self.calls
+        seen = 0
+        for bucket in sorted(self._histogram):
+            seen += self._histogram[bucket]
+            if seen >= rank:
+                return min(_upper_bound_of(bucket), self.max_ns)
+        return self.max_ns
+
+    def summary(self) -> dict:
+        """
+        :return: Dictionary of the call count, and the cumulative (in seconds) and percentile latencies
+            (in microseconds)
+        """
+        result = {
+            'calls': self.calls,
+            'total_sec': self.total_ns / 1E9,
+            'mean_us': self.total_ns / self.calls / MICROSECONDS if self.calls else 0,
+        }
+        for p in PERCENTILES:
+            result[f'p{p}_us'] = self.percentile(p) / MICROSECONDS
+        result['max_us'] = self.max_ns / MICROSECONDS
+        return result
+
+
+class BoardStats:
+    """
+    Statistics of the API calls on a game board.
+    Only the outermost calls are recorded: a call made inside another recorded call (e.g., set_to_state() inside
+    simulate_action()) is a part of the outer call.
+    """
+
+    def __init__(self):
+        #: Statistics of each method
+        self.methods: Dict[str, MethodStats] = {}
+        #: The number of state representations built by the board
+        self.states_materialized = 0
+        #: [PRIVATE] Depth of the recorded calls currently running
+        self._depth = 0
+
+    def timed(self, name: str, function: Callable) -> Callable:
+        """
+        Wrap a function, to record its calls.
+        When the function returns a generator, the time spent on iterating the generator is also recorded.
+
+        :param name: Name of the method
+        :param function: Function to wrap
+        :return: Wrapped function
+        """
+        stats = self.methods.setdefault(name, MethodStats())
+
+        def _generator(generator, elapsed):
+            try:
+                while True:
+                    self._depth += 1
+                    begin = perf_counter_ns()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        elapsed += perf_counter_ns() - begin
+                        self._depth -= 1
+                    yield item
+            finally:
+                stats.record(elapsed)
+
+        def _wrapper(*args, **kwargs):
+            if self._depth:
+                return function(*args, **kwargs)
+
+            self._depth += 1
+            begin = perf_counter_ns()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter_ns() - begin
+                self._depth -= 1
+
+            if isinstance(result, GeneratorType):
+                return _generator(result, elapsed)
+            stats.record(elapsed)
+            return result
+
+        return _wrapper
+
+    def summary(self) -> dict:
+        """
+        :return: Dictionary of the number of materialized states, and the summary of each called method
+            (ordered by the cumulative latency)
+        """
+        methods = sorted(((name, stats) for name, stats in self.methods.items() if stats.calls),
+                         key=lambda item: -item[1].total_ns)
+        return {
+            'states_materialized': self.states_materialized,
+            'methods': {name: stats.summary() for name, stats in methods}
+        }
+
+
+def top_method(summary: Optional[dict]) -> str:
+    """
+    Describe the method which took the most time.
+
+    :param summary: Summary of BoardStats (or None)
+    :return: String of the method name and its share of the total recorded time
+    """
+    if not summary or not summary['methods']:
+        return '-'
+    total = sum(m['total_sec'] for m in summary['methods'].values())
+    name, method = next(iter(summary['methods'].items()))
+    return f'{name} {method["total_sec"] / total * 100 if total else 0:3.0f}%'
+
+
+# Export the statistics classes
+__all__ = ['BoardStats', 'MethodStats', 'top_method']
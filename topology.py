@@ -0,0 +1,166 @@
+# Type specification for Python code
+from typing import Tuple, Dict, Sequence
+
+# NumPy for batch evaluation (optional)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Import some class definitions that implements the Settlers of Catan game.
+from pycatan import Resource
+from pycatan.board import HexType
+
+# Import compact state representations
+from state import BoardLayout
+
+
+#: Offsets from a node to its neighboring nodes (and also to its neighboring hexes) on the triangular grid.
+#: These are the same as Intersection.CONNECTED_CORNER_OFFSETS and Hex.CONNECTED_CORNER_OFFSETS of PyCatan.
+CORNER_OFFSETS = ((1, 0), (0, 1), (-1, 1), (-1, 0), (0, -1), (1, -1))
+
+#: Bit of each hex type in the hex-type bitmask
+HEX_TYPE_BIT = {t.name: 1 << t.value for t in HexType}
+#: Bitmask for the hex types that produce resources (i.e., all types except the desert)
+RESOURCE_TYPE_MASK = sum(bit for name, bit in HEX_TYPE_BIT.items() if name != HexType.DESERT.name)
+#: Resource name of each hex type (None for the desert)
+HEX_TYPE_RESOURCE = {
+    t.name: t.get_resource().name if t.get_resource() is not None else None
+    for t in HexType
+}
+
+
+#: The number of resource types in each hex-type bitmask (the desert is ignored). Lookup table for batch evaluation.
+TYPE_COUNT_TABLE = None if np is None else np.array(
+    [bin(mask & RESOURCE_TYPE_MASK).count('1') for mask in range(max(HEX_TYPE_BIT.values()) << 1)],
+    dtype=np.uint8
+)
+
+
+def batch_diversity(masks: Sequence[int], pairs: bool = False, base_mask: int = 0):
+    """
+    Count the resource types of many hex-type bitmasks at once.
+
+    :param masks: Hex-type bitmasks of the candidate places (e.g., BoardTopology.node_type_mask)
+    :param pairs: If True, count the resource types of every pair of candidates (i.e., both places are taken).
+    :param base_mask: Hex-type bitmask which is already taken (e.g., types near the existing villages)
+    :return: NumPy array of the number of resource types. The shape is (N,), or (N, N) if pairs is True.
+    """
+    if np is None:
+        raise ImportError('NumPy is required for batch diversity evaluation. Please install it: pip install numpy')
+
+    masks = np.asarray(masks, dtype=np.intp) | base_mask
+    if pairs:
+        masks = masks[:, None] | masks[None, :]
+    return TYPE_COUNT_TABLE[masks]
+
+
+def mask_to_resources(mask: int) -> set:
+    """
+    Convert a hex-type bitmask into the set of resource names.
+
+    :param mask: Hex-type bitmask
+    :return: Set of resource names of the hex types in the mask (the desert is ignored)
+    """
+    return {
+        HEX_TYPE_RESOURCE[name]
+        for name, bit in HEX_TYPE_BIT.items()
+        if mask & bit and HEX_TYPE_RESOURCE[name] is not None
+    }
+
+
+class BoardTopology(BoardLayout):
+    """
+    Immutable index of the static topology of a game board.
+    Hex types, dice tokens and harbors never change during the initial setup, so the GameBoard builds this index once
+    (when the initial state is set) and answers its queries from integer IDs and precomputed tuples,
+    instead of walking the PyCatan object graph.
+    """
+
+    def __init__(self, state: dict):
+        """
+        Build a topology index from a state dictionary.
+
+        :param state: A state dictionary of the board (usually, the initial state)
+        """
+        super().__init__(state)
+
+        #: Coordinates of the hexes, ordered by their index
+        self.hex_coords: Tuple[Tuple[int, int], ...] = tuple(self.hexes.keys())
+        #: Mapping from hex coordinate to its index
+        self.hex_index: Dict[Tuple[int, int], int] = {c: i for i, c in enumerate(self.hex_coords)}
+        #: Hex type name of each hex
+        self.hex_types: Tuple[str, ...] = tuple(h['type'] for h in self.hexes.values())
+        #: Dice token of each hex (None for the desert)
+        self.hex_dice: Tuple[int, ...] = tuple(h['dice'] for h in self.hexes.values())
+
+        #: Neighboring hex indices of each node
+        self.node_hexes: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(self.hex_index[(q + dq, r + dr)] for dq, dr in CORNER_OFFSETS if (q + dq, r + dr) in self.hex_index)
+            for q, r in self.nodes
+        )
+        #: Neighboring node indices of each node
+        self.node_neighbors: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(self.node_index[(q + dq, r + dr)] for dq, dr in CORNER_OFFSETS if (q + dq, r + dr) in self.node_index)
+            for q, r in self.nodes
+        )
+        #: Endpoint node indices of each edge
+        self.edge_nodes: Tuple[Tuple[int, int], ...] = tuple(
+            (self.node_index[c1], self.node_index[c2]) for c1, c2 in self.paths
+        )
+        #: Incident edge indices of each node
+        self.node_edges: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(e for e, ends in enumerate(self.edge_nodes) if n in ends)
+            for n in range(self.num_nodes)
+        )
+        #: Bitmask of the nodes blocked by a building on each node (the node itself and its neighbors; distance rule)
+        self.node_block_mask: Tuple[int, ...] = tuple(
+            sum(1 << m for m in (n,) + self.node_neighbors[n])
+            for n in range(self.num_nodes)
+        )
+        #: Bitmask of the edges incident to each node
+        self.node_edge_mask: Tuple[int, ...] = tuple(sum(1 << e for e in edges) for edges in self.node_edges)
+        #: Bitmask of the endpoint nodes of each edge
+        self.edge_node_mask: Tuple[int, ...] = tuple((1 << a) | (1 << b) for a, b in self.edge_nodes)
+        #: Bitmask of all nodes
+        self.all_nodes_mask: int = (1 << self.num_nodes) - 1
+        #: Bitmask of all edges
+        self.all_edges_mask: int = (1 << self.num_paths) - 1
+        #: Bitmask of the hex types neighboring each node (see HEX_TYPE_BIT)
+        self.node_type_mask: Tuple[int, ...] = tuple(
+            sum({HEX_TYPE_BIT[self.hex_types[h]] for h in hexes})
+            for hexes in self.node_hexes
+        )
+        #: The number of neighboring hexes of each node, for each resource name
+        self.node_resource_counts: Tuple[Dict[str, int], ...] = tuple(
+            {
+                res.name: sum(1 for h in hexes if HEX_TYPE_RESOURCE[self.hex_types[h]] == res.name)
+                for res in Resource
+            }
+            for hexes in self.node_hexes
+        )
+
+    @staticmethod
+    def bits(mask: int):
+        """
+        Iterate over the indices of set bits in the bitmask, in increasing order.
+
+        :param mask: Bitmask
+        :return: A generator of indices
+        """
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def node_resources(self, node: int) -> set:
+        """
+        :param node: Node index
+        :return: Set of resource names neighboring the node
+        """
+        return mask_to_resources(self.node_type_mask[node])
+
+
+# Export the topology index and hex-type bitmask helpers
+__all__ = ['BoardTopology', 'CORNER_OFFSETS', 'HEX_TYPE_BIT', 'HEX_TYPE_RESOURCE', 'RESOURCE_TYPE_MASK',
+           'TYPE_COUNT_TABLE', 'batch_diversity', 'mask_to_resources']